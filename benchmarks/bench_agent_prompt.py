@@ -0,0 +1,136 @@
+"""Agent 系统提示构建基准：对比每次变更都完整重建的旧实现与缓存 + 按需生成的新实现
+
+生成若干个参数结构各不相同的工具类，分别测量：
+- 构造时一次性传入全部工具；
+- 构造后逐个 add_tool（Team.__init__ 添加 AskTeamMemberTool 和团队工具的方式）。
+每种方式都在最后读取一次 system_message，保证提示已经生成。
+
+用法：python -m benchmarks.bench_agent_prompt [--tools 200] [--fields 8] [--repeat 3] [--json]
+"""
+import argparse
+import json
+import time
+from typing import Dict, Generator, List
+from pydantic import create_model
+from src.llm_proxy import LLMBase, LLMMessage, BaseTool
+from src.agent import Agent
+
+
+class NullLLM(LLMBase):
+    def __init__(self):
+        super().__init__(base_url="", api_key="")
+
+    def _chat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> Generator[str, None, None]:
+        yield ""
+
+
+class LegacyAgent(Agent):
+    """旧版 Agent：每次变更都重新生成所有工具的 Schema 并扫描会话"""
+
+    def _update_system_message(self):
+        self._render_system_message()
+        for i, msg in enumerate(self.llm.session):
+            if msg.role == "system":
+                self.llm.session[i] = self._system_message
+                break
+        else:
+            self.llm.session.insert(0, self._system_message)
+
+    def _render_system_message(self):
+        base_content = f"""
+        You are {self.name}\n
+        Your backstory: {self.backstory}\n
+        Your goal: {self.goal}\n"""
+        function_call = self.function_call
+        if function_call.tools:
+            prompts = ["You can use the following tools to help user:"]
+            for tool in function_call.tools.values():
+                prompts.append(json.dumps({
+                    "name": tool.name,
+                    "description": tool.description,
+                    "argSchema": tool.argSchema.model_json_schema()
+                }))
+            dialect = function_call.dialects[0]
+            prompts.append(
+                "You can use the following format to call tools:\n"
+                f"{dialect.start}tool_name(parameter_JSON){dialect.end}\n"
+                "The parameter_JSON must match the input pattern of the tool.\n"
+                "You can insert these function calls in the middle of your response, you will get the result in the next response."
+            )
+            base_content += "\n" + "\n".join(prompts)
+        self._system_message = LLMMessage(role="system", content=base_content)
+        self._system_dirty = False
+
+
+def build_tools(count: int, fields: int) -> List[BaseTool]:
+    tools = []
+    for i in range(count):
+        schema = create_model(f"Args{i}", **{f"field_{i}_{j}": (str, ...) for j in range(fields)})
+        tool_cls = type(f"Tool{i}", (BaseTool,), {
+            "name": f"tool_{i}",
+            "description": f"synthetic tool number {i}",
+            "argSchema": schema,
+            "_run": lambda self, **kwargs: "ok",
+        })
+        tools.append(tool_cls())
+    return tools
+
+
+def clear_tool_caches():
+    BaseTool._schema_cache.clear()
+    BaseTool._prompt_cache.clear()
+
+
+def build_at_once(agent_cls, tools: List[BaseTool]) -> str:
+    agent = agent_cls("bench", "backstory", "goal", NullLLM(), "model", tools=tools)
+    return agent.system_message.content
+
+
+def build_one_by_one(agent_cls, tools: List[BaseTool]) -> str:
+    agent = agent_cls("bench", "backstory", "goal", NullLLM(), "model")
+    for tool in tools:
+        agent.add_tool(tool)
+    return agent.system_message.content
+
+
+def measure(name: str, run, repeat: int, cold: bool) -> dict:
+    best = float("inf")
+    output = None
+    for _ in range(repeat):
+        if cold:
+            clear_tool_caches()
+        start = time.perf_counter()
+        output = run()
+        best = min(best, time.perf_counter() - start)
+    return {"name": name, "seconds": best, "prompt_chars": len(output)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tools", type=int, default=200)
+    parser.add_argument("--fields", type=int, default=8, help="每个工具参数的字段数")
+    parser.add_argument("--repeat", type=int, default=3, help="取多次运行中的最短时间")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    tools = build_tools(args.tools, args.fields)
+    results = [
+        measure("legacy, constructor", lambda: build_at_once(LegacyAgent, tools), args.repeat, cold=True),
+        measure("legacy, add_tool", lambda: build_one_by_one(LegacyAgent, tools), args.repeat, cold=True),
+        measure("cached, constructor (cold)", lambda: build_at_once(Agent, tools), args.repeat, cold=True),
+        measure("cached, add_tool (cold)", lambda: build_one_by_one(Agent, tools), args.repeat, cold=True),
+        measure("cached, add_tool (warm)", lambda: build_one_by_one(Agent, tools), args.repeat, cold=False),
+    ]
+    # 所有实现生成的提示必须一致
+    assert len({r["prompt_chars"] for r in results}) == 1
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.tools} tools, {args.fields} fields each")
+    for r in results:
+        print(f"{r['name']:<28}{r['seconds'] * 1000:>10.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""输出合并基准：对比直接转发每个 SSE 增量与经过 ChunkCoalescer 合并后再转发
+
+消费者模拟 websocket 发送，每条消息有固定开销（--send-us 微秒）。分别测量：
+- 转发的消息数与平均每条消息的字符数；
+- 首条消息的延迟与整个回复的耗时（每条消息的开销超过 token 间隔时，直接转发会越积越慢）。
+
+用法：python -m benchmarks.bench_coalesce [--tokens 2000] [--tokens-per-sec 2000] [--send-us 1000] [--json]
+"""
+import argparse
+import json
+import time
+from typing import Callable, Iterable
+from src.llm_proxy import OpenAILLM, HTTPTransport, ChunkCoalescer
+from benchmarks.fake_server import FakeOpenAIServer, Script
+
+
+def consume(stream: Iterable[str], send_seconds: float) -> dict:
+    start = time.perf_counter()
+    first = None
+    messages = chars = 0
+    for chunk in stream:
+        if first is None:
+            first = time.perf_counter() - start
+        # 模拟每条消息的发送开销
+        end = time.perf_counter() + send_seconds
+        while time.perf_counter() < end:
+            pass
+        messages += 1
+        chars += len(chunk)
+    return {"messages": messages, "avg_chars": chars / messages if messages else 0.0,
+            "first_seconds": first or 0.0, "total_seconds": time.perf_counter() - start}
+
+
+def measure(name: str, server: FakeOpenAIServer, wrap: Callable[[Iterable[str]], Iterable[str]],
+            send_seconds: float) -> dict:
+    llm = OpenAILLM(server.base_url, "key", transport=HTTPTransport(server.base_url))
+    return {"name": name, **consume(wrap(llm.chat("hi", "m", 0)), send_seconds)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokens", type=int, default=2000, help="回复的 token 数")
+    parser.add_argument("--tokens-per-sec", type=float, default=2000, help="服务端输出速度")
+    parser.add_argument("--send-us", type=float, default=1000, help="每条消息的发送开销（微秒）")
+    parser.add_argument("--min-chars", type=int, default=64)
+    parser.add_argument("--max-delay", type=float, default=0.02, help="合并的最长等待时间（秒）")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    send_seconds = args.send_us / 1e6
+    stages = [
+        ("direct", lambda stream: stream),
+        ("size only", ChunkCoalescer(args.min_chars, max_delay=None).coalesce),
+        ("size+time", ChunkCoalescer(args.min_chars, max_delay=args.max_delay).coalesce),
+    ]
+    script = Script(reply_tokens=args.tokens, tokens_per_sec=args.tokens_per_sec)
+    with FakeOpenAIServer(script) as server:
+        results = [measure(name, server, wrap, send_seconds) for name, wrap in stages]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.tokens} tokens at {args.tokens_per_sec:g} tok/s, {args.send_us:g} us per message")
+    print(f"{'':<12}{'messages':>10}{'avg chars':>11}{'first':>11}{'total':>11}")
+    for r in results:
+        print(f"{r['name']:<12}{r['messages']:>10}{r['avg_chars']:>11.1f}"
+              f"{r['first_seconds'] * 1000:>8.1f} ms{r['total_seconds'] * 1000:>8.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
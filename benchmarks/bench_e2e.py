@@ -0,0 +1,240 @@
+"""端到端基准：在本地假服务（benchmarks.fake_server）上测量完整的请求路径
+
+套件：
+- llm：OpenAILLM.chat 的原始流；
+- agent：带工具的 Agent.chat，回复中插入一次函数调用；
+- team：Team 中的队长通过 ask_team_member 把问题转给成员；
+- handle_stream：不限速的长回复，对比原始流与经过 FunctionCall.handle_stream 的耗时。
+前三个套件在每个并发级别下测量首包时间（TTFT）、token 速度、错误数和内存增长。
+
+结果可以用 --output 写入 JSON 文件，便于在不同版本之间对比。
+
+用法：python -m benchmarks.bench_e2e [--suites llm agent team handle_stream] [--concurrency 1 8 32]
+      [--team-concurrency 1 4 16] [--rounds 2] [--tokens-per-sec 200] [--ttft 0.05] [--json] [--output FILE]
+"""
+import argparse
+import json
+import platform
+import statistics
+import threading
+import time
+from typing import Callable, Iterator, List, Optional
+from pydantic import BaseModel
+from src.llm_proxy import OpenAILLM, BaseTool, HTTPTransport
+from src.agent import Agent
+from src.agent.team import Team
+from benchmarks.fake_server import FakeOpenAIServer, Script
+
+
+class GreetingSchema(BaseModel):
+    name: str
+
+
+class GreetingTool(BaseTool):
+    name = "greeting"
+    description = "问候"
+    argSchema = GreetingSchema
+
+    def _run(self, name: str) -> str:
+        return f"你好，{name}！"
+
+
+GREETING_CALL = '<function_call>greeting({"name": "bench"})</function_call>'
+ASK_CALL = '<function_call>ask_team_member({"name": "member", "question": "help"})</function_call>'
+
+
+def rss_kb() -> Optional[int]:
+    """当前进程的常驻内存（KB），无法获取时返回 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        import resource
+        return pages * resource.getpagesize() // 1024
+    except (OSError, ImportError):
+        return None
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def run_streams(concurrency: int, rounds: int, make_stream: Callable[[int], Callable[[], Iterator[str]]]) -> dict:
+    """concurrency 个线程各自依次运行 rounds 个流，记录每个流的首包时间和耗时"""
+    ttfts: List[float] = []
+    durations: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    barrier = threading.Barrier(concurrency)
+
+    def worker(index: int):
+        start_stream = make_stream(index)
+        barrier.wait()
+        for _ in range(rounds):
+            start = time.perf_counter()
+            first = None
+            try:
+                for _chunk in start_stream():
+                    if first is None:
+                        first = time.perf_counter()
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                continue
+            end = time.perf_counter()
+            with lock:
+                ttfts.append((first or end) - start)
+                durations.append(end - start)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {"wall": time.perf_counter() - start, "ttfts": ttfts, "durations": durations, "errors": errors[0]}
+
+
+def summarize(suite: str, concurrency: int, server: FakeOpenAIServer, run: Callable[[], dict]) -> dict:
+    before_tokens = server.tokens
+    before_rss = rss_kb()
+    result = run()
+    after_rss = rss_kb()
+    tokens = server.tokens - before_tokens
+    streams = len(result["durations"])
+    mean_duration = statistics.mean(result["durations"]) if streams else 0.0
+    return {
+        "suite": suite,
+        "concurrency": concurrency,
+        "streams": streams,
+        "errors": result["errors"],
+        "wall_s": result["wall"],
+        "ttft_p50_ms": percentile(result["ttfts"], 0.5) * 1000,
+        "ttft_p95_ms": percentile(result["ttfts"], 0.95) * 1000,
+        "tokens_per_sec": tokens / result["wall"] if result["wall"] else 0.0,
+        "tokens_per_sec_per_stream": tokens / streams / mean_duration if streams and mean_duration else 0.0,
+        "rss_growth_kb": None if before_rss is None else after_rss - before_rss,
+    }
+
+
+def bench_llm(server: FakeOpenAIServer, transport: HTTPTransport, concurrency: int, rounds: int) -> dict:
+    def make_stream(_):
+        llm = OpenAILLM(server.base_url, "key", transport=transport)
+        return lambda: llm.chat("hello", "plain", 0)
+    return summarize("llm", concurrency, server, lambda: run_streams(concurrency, rounds, make_stream))
+
+
+def bench_agent(server: FakeOpenAIServer, transport: HTTPTransport, concurrency: int, rounds: int) -> dict:
+    def make_stream(_):
+        agent = Agent("bench", "backstory", "goal", OpenAILLM(server.base_url, "key", transport=transport),
+                      "tools", tools=[GreetingTool()])
+        return lambda: agent.chat_default("hello")
+    return summarize("agent", concurrency, server, lambda: run_streams(concurrency, rounds, make_stream))
+
+
+def bench_team(server: FakeOpenAIServer, transport: HTTPTransport, concurrency: int, rounds: int) -> dict:
+    def make_stream(_):
+        leader = Agent("leader", "backstory", "goal", OpenAILLM(server.base_url, "key", transport=transport),
+                       "leader", allow_ask_other=True)
+        member = Agent("member", "backstory", "goal", OpenAILLM(server.base_url, "key", transport=transport),
+                       "plain")
+        Team("bench", "goal", "backstory", agents=[leader, member])
+        return lambda: leader.chat_default("hello")
+    return summarize("team", concurrency, server, lambda: run_streams(concurrency, rounds, make_stream))
+
+
+def bench_handle_stream(server: FakeOpenAIServer, transport: HTTPTransport, repeat: int) -> dict:
+    """不限速的长回复：原始流与经过 handle_stream 的流的耗时差，按每个数据块平均"""
+    llm = OpenAILLM(server.base_url, "key", transport=transport)
+    agent = Agent("bench", "backstory", "goal", llm, "long", tools=[GreetingTool()])
+    function_call = agent.function_call
+
+    def timed(run) -> float:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _chunk in run():
+                pass
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    chunks = sum(1 for _ in llm.chat("hello", "long", 0))
+    raw = timed(lambda: llm.chat("hello", "long", 0))
+    handled = timed(lambda: function_call.handle_stream(llm.chat("hello", "long", 0)))
+    return {
+        "suite": "handle_stream",
+        "chunks": chunks,
+        "raw_s": raw,
+        "handle_stream_s": handled,
+        "overhead_us_per_chunk": (handled - raw) / chunks * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--suites", nargs="+", default=["llm", "agent", "team", "handle_stream"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--team-concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--rounds", type=int, default=2, help="每个线程依次运行的流数")
+    parser.add_argument("--reply-tokens", type=int, default=64)
+    parser.add_argument("--tokens-per-sec", type=float, default=200)
+    parser.add_argument("--ttft", type=float, default=0.05, help="假服务的首包延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="llm 套件的错误注入概率")
+    parser.add_argument("--long-tokens", type=int, default=20000, help="handle_stream 套件的回复 token 数")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    parser.add_argument("--output", help="把 JSON 结果写入文件")
+    args = parser.parse_args()
+
+    paced = Script(reply_tokens=args.reply_tokens, tokens_per_sec=args.tokens_per_sec, ttft=args.ttft)
+    scenarios = {
+        "plain": paced._replace(error_rate=args.error_rate),
+        "tools": paced._replace(inject=GREETING_CALL),
+        "leader": paced._replace(inject=ASK_CALL),
+        "long": Script(reply_tokens=args.long_tokens, inject=GREETING_CALL, inject_at=args.long_tokens // 2),
+    }
+
+    results = []
+    with FakeOpenAIServer(paced, scenarios=scenarios) as server:
+        transport = HTTPTransport(server.base_url, pool_size=max(args.concurrency + args.team_concurrency) * 2)
+        for suite, levels, bench in (("llm", args.concurrency, bench_llm),
+                                     ("agent", args.concurrency, bench_agent),
+                                     ("team", args.team_concurrency, bench_team)):
+            if suite in args.suites:
+                for concurrency in levels:
+                    results.append(bench(server, transport, concurrency, args.rounds))
+        if "handle_stream" in args.suites:
+            results.append(bench_handle_stream(server, transport, repeat=3))
+        transport.close()
+        server_stats = server.stats()
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "args": vars(args),
+            "server": server_stats,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return
+    for r in results:
+        if r["suite"] == "handle_stream":
+            print(f"handle_stream  {r['chunks']:,} chunks: raw {r['raw_s'] * 1000:.1f} ms, "
+                  f"handled {r['handle_stream_s'] * 1000:.1f} ms, {r['overhead_us_per_chunk']:.2f} us/chunk overhead")
+            continue
+        rss = "n/a" if r["rss_growth_kb"] is None else f"{r['rss_growth_kb']:,} KB"
+        print(f"{r['suite']:<6} x{r['concurrency']:<4} streams {r['streams']:>4} errors {r['errors']:>3} "
+              f"TTFT p50 {r['ttft_p50_ms']:7.1f} ms p95 {r['ttft_p95_ms']:7.1f} ms "
+              f"{r['tokens_per_sec']:9.0f} tok/s ({r['tokens_per_sec_per_stream']:6.1f}/stream) rss +{rss}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""冷启动导入时间基准
+
+在新的解释器进程中以 python -X importtime 执行各个导入场景，解析 stderr 中的累计耗时，
+报告每个场景的导入时间、加载的模块数以及其中的重量级依赖（requests、aiohttp、pydantic 等）。
+每个场景运行 --repeat 次取中位数，第一次运行会生成 .pyc，不计入结果。
+
+用法：python -m benchmarks.bench_import [--repeat 5] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, Iterable, List, NamedTuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    "package": "import src.llm_proxy",
+    "agent_package": "import src.agent",
+    "message": "from src.llm_proxy import LLMMessage",
+    "session_store": "from src.llm_proxy import SQLiteSessionStore",
+    "sync_backend": "from src.llm_proxy import OpenAILLM",
+    "async_backend": "from src.llm_proxy import AsyncOpenAILLM",
+    "agent": "from src.agent import Agent",
+}
+
+HEAVY_MODULES = ("requests", "aiohttp", "pydantic", "asyncio", "json_repair", "multiprocessing", "sqlite3")
+
+
+class ImportProfile(NamedTuple):
+    total_us: int  # 直接触发的导入的累计耗时之和（微秒）
+    modules: Dict[str, int]  # 模块名 -> 累计耗时（微秒）
+
+    def heavy(self) -> List[str]:
+        return [name for name in HEAVY_MODULES if name in self.modules]
+
+
+def parse_importtime(stderr: str, exclude: Iterable[str] = ()) -> ImportProfile:
+    """解析 -X importtime 的输出，忽略 exclude 中的模块
+
+    每行的格式为 "import time: self | cumulative | 缩进的模块名"，
+    缩进表示嵌套，没有缩进的行是直接触发的导入，它们的累计耗时之和就是总耗时。
+    """
+    exclude = set(exclude)
+    modules = {}
+    total = 0
+    for line in stderr.splitlines():
+        parts = line[len("import time:"):].split("|")
+        if not line.startswith("import time:") or len(parts) != 3 or not parts[1].strip().isdigit():
+            continue  # 表头或程序自身的输出
+        name = parts[2].rstrip()
+        stripped = name.lstrip()
+        if stripped in exclude:
+            continue
+        cumulative = int(parts[1])
+        modules[stripped] = cumulative
+        if len(name) - len(stripped) == 1:
+            total += cumulative
+    return ImportProfile(total, modules)
+
+
+def profile_import(statement: str, python: str = sys.executable) -> ImportProfile:
+    """在新的解释器中执行 statement，返回它触发的导入
+
+    解释器启动时导入的模块（site 等）也出现在输出中，先执行一次空语句得到它们并排除。
+    """
+    baseline = subprocess.run(
+        [python, "-X", "importtime", "-c", "pass"], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    startup = parse_importtime(baseline.stderr).modules
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", statement], cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{statement!r} 执行失败：\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr, exclude=startup)
+
+
+def run(repeat: int) -> Dict[str, Dict]:
+    results = {}
+    for name, statement in SCENARIOS.items():
+        profile_import(statement)  # 预热 .pyc
+        profiles = [profile_import(statement) for _ in range(repeat)]
+        results[name] = {
+            "statement": statement,
+            "median_ms": statistics.median(p.total_us for p in profiles) / 1000,
+            "min_ms": min(p.total_us for p in profiles) / 1000,
+            "modules": len(profiles[0].modules),
+            "heavy": profiles[0].heavy(),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+    print(f"{'scenario':<16}{'median ms':>10}{'min ms':>10}{'modules':>9}  heavy dependencies")
+    for name, r in results.items():
+        print(f"{name:<16}{r['median_ms']:>10.1f}{r['min_ms']:>10.1f}{r['modules']:>9}  {', '.join(r['heavy']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""提示前缀缓存基准：多轮对话中途加入工具、团队成员并修改身份，统计服务端前缀缓存的命中率
+
+FakeOpenAIServer 按消息模拟服务端的前缀缓存（见 fake_server.py），命中率由服务端统计，
+不依赖客户端解析 usage，因此同一脚本也可以在改动前的代码上运行作对比。
+
+分别统计：
+- 全部 --turns 轮对话的提示 token 数、命中缓存的 token 数与命中率；
+- 发生变更后第一轮请求的命中率（变更前系统提示被原地重写时，这一轮几乎整体失效）。
+
+用法：python -m benchmarks.bench_prompt_cache [--turns 8] [--tools 4] [--members 4] [--json]
+"""
+import argparse
+import json
+from typing import Dict, List, Tuple
+from pydantic import BaseModel
+from src.llm_proxy import OpenAILLM, HTTPTransport, BaseTool
+from src.agent import Agent
+from src.agent.team import Team
+from benchmarks.fake_server import FakeOpenAIServer, Script
+
+
+class QueryArgs(BaseModel):
+    query: str
+
+
+def build_tools(count: int, prefix: str = "tool") -> List[BaseTool]:
+    tools = []
+    for i in range(count):
+        tool_cls = type(f"Tool{prefix}{i}", (BaseTool,), {
+            "name": f"{prefix}_{i}",
+            "description": f"synthetic tool number {i}, " + "with a long description " * 10,
+            "argSchema": QueryArgs,
+            "_run": lambda self, **kwargs: "ok",
+        })
+        tools.append(tool_cls())
+    return tools
+
+
+def build_agent(server: FakeOpenAIServer, name: str, tools: List[BaseTool]) -> Agent:
+    llm = OpenAILLM(server.base_url, "key", transport=HTTPTransport(server.base_url))
+    return Agent(name, f"member {name}\n" + "detailed backstory " * 30, "goal", llm, "model",
+                 tools=tools, allow_ask_other=True)
+
+
+def measure(turns: int, tools: int, members: int, reply_tokens: int) -> Tuple[Dict[str, int], Dict[str, int]]:
+    with FakeOpenAIServer(Script(reply_tokens=reply_tokens)) as server:
+        agents = [build_agent(server, f"member_{i}", build_tools(tools)) for i in range(members)]
+        team = Team("bench", "goal", "backstory " * 20, agents)
+        agent = agents[0]
+        after_change = {}
+        for turn in range(turns):
+            if turn == turns // 2:
+                agent.add_tool(build_tools(1, "extra")[0])
+                team.add_agent(build_agent(server, "newcomer", build_tools(tools)))
+                agent.update_identity(goal="a new goal")
+            prompt, cached = server.prompt_tokens, server.cached_tokens
+            "".join(agent.chat_default(f"question {turn}"))
+            if turn == turns // 2:
+                after_change = {"prompt_tokens": server.prompt_tokens - prompt, "cached_tokens": server.cached_tokens - cached}
+        total = {"prompt_tokens": server.prompt_tokens, "cached_tokens": server.cached_tokens}
+    return total, after_change
+
+
+def hit_rate(counts: Dict[str, int]) -> float:
+    return counts["cached_tokens"] / counts["prompt_tokens"] if counts["prompt_tokens"] else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=8, help="对话轮数，变更发生在中间一轮之前")
+    parser.add_argument("--tools", type=int, default=4, help="每个成员的工具数")
+    parser.add_argument("--members", type=int, default=4, help="团队的初始成员数")
+    parser.add_argument("--reply-tokens", type=int, default=32, help="每次回复的 token 数")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    total, after_change = measure(args.turns, args.tools, args.members, args.reply_tokens)
+    results = [
+        {"name": "all turns", **total, "cache_hit_rate": hit_rate(total)},
+        {"name": "after change", **after_change, "cache_hit_rate": hit_rate(after_change)},
+    ]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.turns} turns, {args.members} members, {args.tools} tools each")
+    print(f"{'':<16}{'prompt':>10}{'cached':>10}{'hit rate':>10}")
+    for r in results:
+        print(f"{r['name']:<16}{r['prompt_tokens']:>10}{r['cached_tokens']:>10}{r['cache_hit_rate']:>10.1%}")
+
+
+if __name__ == "__main__":
+    main()
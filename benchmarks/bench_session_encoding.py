@@ -0,0 +1,108 @@
+"""请求体编码基准：对比每轮重新编码全部历史与拼接缓存的消息片段
+
+模拟一段已有 N 条消息的会话，每轮追加一条用户消息并编码完整请求体：
+- legacy：[msg.to_dict() for msg in session] 后由 json.dumps 编码（requests 的 json= 参数）；
+- cached：MessageList + encode_request_body，每条消息只在第一次发送时编码。
+另外对比有 __dict__ 的旧消息对象与 __slots__ 消息对象本身的内存占用。
+
+用法：python -m benchmarks.bench_session_encoding [--history 1000 10000] [--turns 50] [--chars 400] [--json]
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from typing import List
+from src.llm_proxy import LLMMessage
+from src.llm_proxy.llm_base import MessageList, encode_request_body
+
+
+class LegacyMessage:
+    """旧版 LLMMessage：普通对象，每个实例带 __dict__"""
+
+    def __init__(self, role: str, content: str):
+        self.role = role
+        self.content = content
+
+
+def build_session(size: int, chars: int, seed: int = 0) -> List[LLMMessage]:
+    rng = random.Random(seed)
+    words = ["stream", "token", "agent", "工具", "调用", "context", "\"quoted\"", "响应"]
+    session = [LLMMessage(role="system", content="You are a benchmark agent.")]
+    for i in range(size - 1):
+        text = " ".join(rng.choice(words) for _ in range(chars // 6))
+        session.append(LLMMessage(role="user" if i % 2 == 0 else "assistant", content=text))
+    return session
+
+
+def message_overhead(message_cls, size: int) -> float:
+    """每条消息对象本身（不含 role/content 字符串）占用的字节数"""
+    role, content = "user", "x"
+    tracemalloc.start()
+    messages = [message_cls(role, content) for _ in range(size)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del messages
+    return current / size
+
+
+def legacy_body(session: List[LLMMessage]) -> bytes:
+    messages = [msg.to_dict() for msg in session]
+    data = {"messages": messages, "model": "bench", "temperature": 0.7, "stream": True}
+    return json.dumps(data, allow_nan=False).encode("utf-8")
+
+
+def cached_body(session: List[LLMMessage]) -> bytes:
+    return encode_request_body(MessageList(session), model="bench", temperature=0.7, stream=True)
+
+
+def measure(name: str, encode, history: int, turns: int, chars: int) -> dict:
+    session = build_session(history, chars)
+    # 预热：历史消息在之前的轮次中已经发送过
+    encode(session)
+    start = time.perf_counter()
+    size = 0
+    for i in range(turns):
+        session.append(LLMMessage(role="user", content=f"turn {i}"))
+        size = len(encode(session))
+    seconds = time.perf_counter() - start
+    return {
+        "name": name,
+        "history": history,
+        "ms_per_turn": seconds / turns * 1000,
+        "body_bytes": size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--history", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--chars", type=int, default=400, help="每条历史消息的大致长度")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    results = []
+    for history in args.history:
+        legacy = measure("legacy", legacy_body, history, args.turns, args.chars)
+        cached = measure("cached", cached_body, history, args.turns, args.chars)
+        # 两种编码的内容必须一致
+        session = build_session(history, args.chars)
+        assert json.loads(legacy_body(session)) == json.loads(cached_body(session))
+        results += [legacy, cached]
+    memory = {
+        "legacy_bytes_per_message": message_overhead(LegacyMessage, 10000),
+        "slots_bytes_per_message": message_overhead(LLMMessage, 10000),
+    }
+
+    if args.json:
+        print(json.dumps({"encoding": results, "memory": memory}, indent=2))
+        return
+    for r in results:
+        print(f"{r['name']:<8}{r['history']:>7} msgs {r['ms_per_turn']:>9.2f} ms/turn {r['body_bytes'] / 1024:>9.0f} KB body")
+    print(f"message object: {memory['legacy_bytes_per_message']:.0f} B with __dict__, "
+          f"{memory['slots_bytes_per_message']:.0f} B with __slots__")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""SSE 解码微基准：对比旧的 iter_lines + json.loads 实现与字节级增量解码器
+
+用法：python -m benchmarks.bench_sse [--frames 200000] [--repeat 3] [--json]
+"""
+import argparse
+import json
+import random
+import time
+from typing import Callable, Generator, Iterable, List
+import requests
+from src.llm_proxy.sse import iter_deltas, json_loads, _fast_loads
+
+
+def build_payload(frames: int) -> bytes:
+    """构造与 DeepSeek 流式返回格式一致的 SSE 响应体"""
+    words = ["你好", "，", "我们", "来", " solve", " this", " problem", "。", "\n", "ok"]
+    parts = []
+    for i in range(frames):
+        event = {
+            "id": "7a5b1c2e-0000-4000-8000-000000000000",
+            "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "model": "deepseek-chat",
+            "system_fingerprint": "fp_7e73fd9a08",
+            "choices": [{"index": 0, "delta": {"content": words[i % len(words)]}, "logprobs": None, "finish_reason": None}]
+        }
+        parts.append(b"data: " + json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n\n")
+    parts.append(b"data: [DONE]\n\n")
+    return b"".join(parts)
+
+
+def split_reads(payload: bytes, seed: int = 0, max_read: int = 1400) -> List[bytes]:
+    """按随机大小切分，模拟网络读取，数据帧会落在读取边界上"""
+    rng = random.Random(seed)
+    reads = []
+    i = 0
+    while i < len(payload):
+        n = rng.randint(1, max_read)
+        reads.append(payload[i:i + n])
+        i += n
+    return reads
+
+
+class ReplayResponse(requests.Response):
+    """按预先切好的块回放响应体，iter_lines 仍走 requests 自身的实现"""
+
+    def __init__(self, reads: List[bytes]):
+        super().__init__()
+        self.status_code = 200
+        self._reads = reads
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        return iter(self._reads)
+
+
+def legacy_decode(response: requests.Response) -> Generator[str, None, None]:
+    """旧版 OpenAILLM._handle_stream_response"""
+    for chunk in response.iter_lines():
+        if chunk:
+            chunk_str = chunk.decode('utf-8')
+            if chunk_str.startswith("data: "):
+                data = chunk_str[6:]
+                if data.strip() == "[DONE]":
+                    break
+                try:
+                    parsed = json.loads(data)
+                    if "choices" in parsed:
+                        delta = parsed["choices"][0].get("delta", {})
+                        content = delta.get("content", "")
+                        yield content
+                except json.JSONDecodeError:
+                    print(f"JSON解析错误: {data}")
+                    continue
+
+
+def measure(name: str, run: Callable[[], Iterable[str]], frames: int, repeat: int) -> dict:
+    best = float("inf")
+    text = ""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        text = "".join(run())
+        best = min(best, time.perf_counter() - start)
+    return {"name": name, "frames": frames, "seconds": best, "frames_per_sec": frames / best, "chars": len(text)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    reads = split_reads(build_payload(args.frames))
+    results = [
+        measure("legacy iter_lines+json", lambda: legacy_decode(ReplayResponse(reads)), args.frames, args.repeat),
+        measure("SSEDecoder+json", lambda: iter_deltas(reads, loads=json_loads), args.frames, args.repeat),
+    ]
+    if _fast_loads is not None:
+        results.append(measure("SSEDecoder+orjson", lambda: iter_deltas(reads, loads=_fast_loads), args.frames, args.repeat))
+
+    # 各实现解码出的文本必须一致
+    assert len({r["chars"] for r in results}) == 1
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    baseline = results[0]["frames_per_sec"]
+    for r in results:
+        print(f"{r['name']:<26}{r['frames_per_sec']:>14,.0f} frames/s  x{r['frames_per_sec'] / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
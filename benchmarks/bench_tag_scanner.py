@@ -0,0 +1,131 @@
+"""FunctionCall.handle_stream 基准：对比旧的缓冲区重扫实现与增量标签扫描器
+
+合成若干 MB 的流：小块普通文本中夹杂 '<' 字符和参数很长的函数调用。
+旧实现在调用打开期间每块都从头重扫缓冲区，耗时随参数长度平方增长。
+
+用法：python -m benchmarks.bench_tag_scanner [--size-mb 4] [--arg-kb 16] [--chunk 4] [--json]
+"""
+import argparse
+import json
+import random
+import time
+from typing import Generator, List
+from pydantic import BaseModel
+from src.llm_proxy import BaseTool, FunctionCall
+
+
+class PayloadSchema(BaseModel):
+    data: str
+
+
+class PayloadTool(BaseTool):
+    name = "payload"
+    description = "接收一段长参数"
+    argSchema = PayloadSchema
+
+    def _run(self, data: str) -> str:
+        return str(len(data))
+
+
+def build_stream(size_mb: float, arg_kb: int, chunk: int, seed: int = 0) -> List[str]:
+    """生成按固定大小切块的合成流，约 1/4 的字节位于函数调用参数中"""
+    rng = random.Random(seed)
+    target = int(size_mb * 1024 * 1024)
+    words = ["hello", "world", "a<b", "<", "x < y", "<function", "流式", "响应"]
+    call = f'<function_call>payload({json.dumps({"data": "x" * (arg_kb * 1024)})})</function_call>'
+    parts = []
+    total = 0
+    text_since_call = 0
+    while total < target:
+        if text_since_call >= 3 * len(call):
+            part = call
+            text_since_call = 0
+        else:
+            part = rng.choice(words) + " "
+            text_since_call += len(part)
+        parts.append(part)
+        total += len(part)
+    text = "".join(parts)
+    return [text[i:i + chunk] for i in range(0, len(text), chunk)]
+
+
+def legacy_handle_stream(function_call: FunctionCall, stream) -> Generator[str, None, None]:
+    """旧版 FunctionCall.handle_stream"""
+    buffer = ""
+    function_call.executed_tools = []
+    start_tag = '<function_call>'
+    end_tag = '</function_call>'
+    for chunk in stream:
+        buffer += chunk
+        while True:
+            start_idx = buffer.find(start_tag)
+            if start_idx != -1:
+                end_idx = buffer.find(end_tag, start_idx + len(start_tag))
+                if end_idx != -1:
+                    content = buffer[start_idx+len(start_tag):end_idx]
+                    result_gen = function_call._execute_function_call(content)
+                    if start_idx > 0:
+                        yield buffer[:start_idx]
+                    yield result_gen
+                    buffer = buffer[end_idx+len(end_tag):]
+                    continue
+                else:
+                    if start_idx > 0:
+                        yield buffer[:start_idx]
+                        buffer = buffer[start_idx:]
+                    break
+            else:
+                max_prefix = 0
+                max_check = min(len(buffer), len(start_tag))
+                for k in range(1, max_check+1):
+                    if buffer[-k:] == start_tag[:k]:
+                        max_prefix = k
+                if max_prefix > 0:
+                    output = buffer[:-max_prefix]
+                    if output:
+                        yield output
+                    buffer = buffer[-max_prefix:]
+                else:
+                    if buffer:
+                        yield buffer
+                        buffer = ""
+                break
+
+
+def measure(name: str, run, size: int) -> dict:
+    start = time.perf_counter()
+    text = "".join(run())
+    seconds = time.perf_counter() - start
+    return {"name": name, "bytes": size, "seconds": seconds, "mb_per_sec": size / seconds / 1024 / 1024, "output_chars": len(text)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=float, default=4)
+    parser.add_argument("--arg-kb", type=int, default=16, help="每个函数调用参数的长度（KB）")
+    parser.add_argument("--chunk", type=int, default=4, help="每个数据块的字符数")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    stream = build_stream(args.size_mb, args.arg_kb, args.chunk)
+    size = sum(len(c) for c in stream)
+    function_call = FunctionCall()
+    function_call.add_tool(PayloadTool())
+
+    results = [
+        measure("legacy rescan", lambda: legacy_handle_stream(function_call, stream), size),
+        measure("TagScanner", lambda: function_call.handle_stream(iter(stream)), size),
+    ]
+    # 两种实现的输出必须一致
+    assert len({r["output_chars"] for r in results}) == 1
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"stream: {size / 1024 / 1024:.1f} MB in {len(stream):,} chunks, {len(function_call.executed_tools)} calls")
+    for r in results:
+        print(f"{r['name']:<16}{r['seconds']:>8.2f} s {r['mb_per_sec']:>8.2f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
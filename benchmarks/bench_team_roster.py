@@ -0,0 +1,157 @@
+"""团队名单构建基准：对比每个成员加入时都生成一份名单的旧实现与共享、按需生成的新实现
+
+分别测量：
+- 构造 --members 个成员的团队，并读取每个成员会话中的名单；
+- 构造完成后再加入、移除一个成员；
+- 每个成员会话中名单的字符数（成员数超过阈值时名单只包含名字和一行简介）。
+
+用法：python -m benchmarks.bench_team_roster [--members 500] [--tools 4] [--repeat 3] [--json]
+"""
+import argparse
+import json
+import time
+from typing import Dict, Generator, List
+from pydantic import BaseModel
+from src.llm_proxy import LLMBase, LLMMessage, BaseTool
+from src.agent import Agent
+from src.agent.team import Team, AskTeamMemberTool
+
+
+class NullLLM(LLMBase):
+    def __init__(self):
+        super().__init__(base_url="", api_key="")
+
+    def _chat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> Generator[str, None, None]:
+        yield ""
+
+
+class LegacyTeam(Team):
+    """旧版 Team：每个成员加入时生成一份完整名单插入自己的会话，移除时修改会话"""
+
+    def __init__(self, name: str, goal: str, backstory: str, agents: List[Agent]):
+        self.name = name
+        self.goal = goal
+        self.backstory = backstory
+        self.team_tools = []
+        self._list: List[Agent] = []
+        for agent in agents:
+            self.add_agent(agent)
+            if agent.allow_ask_other:
+                agent.add_tool(AskTeamMemberTool(self))
+
+    @property
+    def agents(self) -> List[Agent]:
+        return self._list
+
+    def get_agent(self, name: str):
+        for agent in self._list:
+            if agent.name == name:
+                return agent
+        return None
+
+    def add_agent(self, agent: Agent):
+        for i, msg in enumerate(agent.llm.session):
+            if msg.role == "system":
+                agent.llm.session.insert(i+1, LLMMessage(role="system", content=self._get_team_prompt()))
+                break
+        else:
+            agent.llm.session.append(LLMMessage(role="system", content=self._get_team_prompt()))
+        self._list.append(agent)
+
+    def remove_agent(self, agent: Agent):
+        for i, msg in enumerate(agent.llm.session):
+            if msg.role == "system":
+                agent.llm.session.pop(i+1)
+                break
+        agent.remove_tool(AskTeamMemberTool.name)
+        self._list.remove(agent)
+
+    def _get_team_prompt(self):
+        members = '\n'.join([self._get_agent_prompt(agent) for agent in self._list])
+        return f"""
+        Your team name: {self.name}\n
+        Your team goal: {self.goal}\n
+        Your team backstory: {self.backstory}\n
+        Other members in your team:
+        {members}
+        """
+
+    def _get_agent_prompt(self, agent: Agent):
+        tools = '\n'.join([f"{tool.name}:{tool.description}" for tool in agent.function_call.tools.values()])
+        return f"""
+        Member name: {agent.name}\n
+        Member backstory: {agent.backstory}\n
+        Member tools: {tools}\n
+        """
+
+
+class QueryArgs(BaseModel):
+    query: str
+
+
+def build_tools(count: int) -> List[BaseTool]:
+    tools = []
+    for i in range(count):
+        tool_cls = type(f"Tool{i}", (BaseTool,), {
+            "name": f"tool_{i}",
+            "description": f"synthetic tool number {i}",
+            "argSchema": QueryArgs,
+            "_run": lambda self, **kwargs: "ok",
+        })
+        tools.append(tool_cls())
+    return tools
+
+
+def build_agents(count: int, tools: List[BaseTool]) -> List[Agent]:
+    return [Agent(f"member_{i}", f"member number {i}\ndetailed backstory of member {i}", "goal", NullLLM(), "model",
+                  tools=tools, allow_ask_other=True) for i in range(count)]
+
+
+def roster_chars(agent: Agent) -> int:
+    return len(agent.llm.session[1].content)
+
+
+def measure(name: str, team_cls, members: int, tools: List[BaseTool], repeat: int) -> dict:
+    build = change = float("inf")
+    chars = 0
+    for _ in range(repeat):
+        agents = build_agents(members + 1, tools)
+        extra = agents.pop()
+        start = time.perf_counter()
+        team = team_cls("bench", "goal", "backstory", agents)
+        chars = max(roster_chars(agent) for agent in agents)
+        build = min(build, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        team.add_agent(extra)
+        team.remove_agent(agents[0])
+        roster_chars(agents[1])
+        change = min(change, time.perf_counter() - start)
+    return {"name": name, "build_seconds": build, "change_seconds": change, "roster_chars": chars}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--members", type=int, default=500)
+    parser.add_argument("--tools", type=int, default=4, help="每个成员的工具数")
+    parser.add_argument("--repeat", type=int, default=3, help="取多次运行中的最短时间")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    tools = build_tools(args.tools)
+    results = [
+        measure("legacy", LegacyTeam, args.members, tools, args.repeat),
+        measure("shared roster", Team, args.members, tools, args.repeat),
+    ]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.members} members, {args.tools} tools each")
+    print(f"{'':<16}{'build':>12}{'add+remove':>14}{'roster chars':>16}")
+    for r in results:
+        print(f"{r['name']:<16}{r['build_seconds'] * 1000:>9.2f} ms{r['change_seconds'] * 1000:>11.3f} ms{r['roster_chars']:>16}")
+
+
+if __name__ == "__main__":
+    main()
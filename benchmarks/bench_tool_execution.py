@@ -0,0 +1,86 @@
+"""工具执行方式基准：CPU 密集的工具对同一进程中其他对话的影响
+
+在一个线程上通过 FunctionCall.handle_stream 执行纯 Python 的 CPU 密集工具，另一个线程模拟
+正在读取 LLM 流的其他对话，每 --tick 毫秒醒来一次，记录醒来的最大延迟和完成的次数。
+inline/thread 模式下工具持有 GIL，其他线程被拖慢；process 模式下工具在工作进程中运行。
+
+用法：python -m benchmarks.bench_tool_execution [--calls 4] [--work 3000000] [--tick 5] [--json]
+"""
+import argparse
+import json
+import threading
+import time
+from src.llm_proxy import BaseTool, BaseModel, FunctionCall, ProcessToolPool
+
+
+class SpinInput(BaseModel):
+    n: int
+
+
+class SpinTool(BaseTool):
+    name: str = "spin"
+    description: str = "CPU-bound loop"
+    argSchema: BaseModel = SpinInput
+    cacheable: bool = False
+
+    def _run(self, n: int) -> str:
+        total = 0
+        for i in range(n):
+            total += i * i
+        return str(total % 1000)
+
+
+def run_mode(mode: str, calls: int, work: int, tick: float) -> dict:
+    tool = SpinTool()
+    tool.execution = mode
+    function_call = FunctionCall()
+    function_call.add_tool(tool)
+    stream = [f'<function_call>spin({{"n": {work}}})</function_call>' for _ in range(calls)]
+
+    stop = threading.Event()
+    delays = []
+
+    def heartbeat():
+        while not stop.is_set():
+            expected = time.perf_counter() + tick
+            time.sleep(tick)
+            delays.append(max(0.0, time.perf_counter() - expected))
+
+    thread = threading.Thread(target=heartbeat)
+    thread.start()
+    start = time.perf_counter()
+    output = "".join(function_call.handle_stream(iter(stream)))
+    seconds = time.perf_counter() - start
+    stop.set()
+    thread.join()
+    assert output.count("Result:") == calls, output
+    return {
+        "mode": mode,
+        "seconds": seconds,
+        "ticks": len(delays),
+        "max_delay_ms": max(delays) * 1000 if delays else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=4, help="工具调用次数")
+    parser.add_argument("--work", type=int, default=3_000_000, help="每次调用的循环次数")
+    parser.add_argument("--tick", type=float, default=5, help="模拟对话的唤醒间隔（毫秒）")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    # 预先启动工作进程，启动开销不计入结果
+    ProcessToolPool.shared(max_workers=1).warm()
+    runs = [run_mode(mode, args.calls, args.work, args.tick / 1000) for mode in ("inline", "thread", "process")]
+
+    if args.json:
+        print(json.dumps(runs, indent=2))
+        return
+    print(f"{args.calls} calls x {args.work} iterations, heartbeat every {args.tick} ms")
+    for r in runs:
+        print(f"{r['mode']:<8}{r['seconds'] * 1000:>10.1f} ms{r['ticks']:>8} ticks{r['max_delay_ms']:>10.1f} ms max delay")
+
+
+if __name__ == "__main__":
+    main()
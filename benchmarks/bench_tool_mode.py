@@ -0,0 +1,79 @@
+"""工具调用模式基准：对比文本模式（系统提示 + 标签扫描）与原生模式（tools 参数 + tool_calls 增量）
+
+分别测量：
+- 每个请求中工具说明的估算 token 数（FunctionCall.tool_prompt_tokens）；
+- 通过假服务端完成 --turns 轮对话时发送的请求体字节数和总耗时，每轮回复包含一次工具调用。
+
+用法：python -m benchmarks.bench_tool_mode [--tools 20] [--fields 6] [--turns 20] [--reply-tokens 200] [--json]
+"""
+import argparse
+import json
+import time
+from typing import List
+from pydantic import create_model
+from src.llm_proxy import BaseTool, OpenAILLM, HTTPTransport
+from src.agent import Agent
+from benchmarks.fake_server import FakeOpenAIServer, Script
+
+
+def build_tools(count: int, fields: int) -> List[BaseTool]:
+    tools = []
+    for i in range(count):
+        schema = create_model(f"Args{i}", **{f"field_{j}": (str, "") for j in range(fields)})
+        tool_cls = type(f"Tool{i}", (BaseTool,), {
+            "name": f"tool_{i}",
+            "description": f"synthetic tool number {i}",
+            "argSchema": schema,
+            "_run": lambda self, **kwargs: "ok",
+        })
+        tools.append(tool_cls())
+    return tools
+
+
+def run_mode(mode: str, tools: List[BaseTool], turns: int, reply_tokens: int) -> dict:
+    call = 'tool_0({"field_0": "value"})'
+    script = Script(reply_tokens=reply_tokens, chunk_tokens=1, inject=f"<function_call>{call}</function_call>",
+                    inject_at=reply_tokens // 2, tool_call=call)
+    # 文本模式的回复里带标签，原生模式的回复里带 tool_calls 增量
+    if mode == "native":
+        script = script._replace(inject="")
+    with FakeOpenAIServer(scenarios={"bench": script}) as server:
+        llm = OpenAILLM(server.base_url, "key", transport=HTTPTransport(server.base_url))
+        agent = Agent("bench", "backstory", "goal", llm, "bench", tools=tools, tool_mode=mode)
+        start = time.perf_counter()
+        results = 0
+        for _ in range(turns):
+            reply = "".join(agent.chat_default("hi"))
+            results += reply.count("Result: ok")
+            agent.clear_context()
+        seconds = time.perf_counter() - start
+        request_bytes = server.request_bytes
+    assert results == turns
+    return {"mode": mode, "seconds": seconds, "request_bytes": request_bytes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tools", type=int, default=20)
+    parser.add_argument("--fields", type=int, default=6, help="每个工具参数的字段数")
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--reply-tokens", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    tools = build_tools(args.tools, args.fields)
+    agent = Agent("bench", "backstory", "goal", OpenAILLM("http://127.0.0.1:1", "key"), "bench", tools=tools)
+    tokens = agent.function_call.tool_prompt_tokens()
+    runs = [run_mode(mode, tools, args.turns, args.reply_tokens) for mode in ("text", "native")]
+
+    if args.json:
+        print(json.dumps({"tool_prompt_tokens": tokens, "runs": runs}, indent=2))
+        return
+    print(f"{args.tools} tools, {args.fields} fields each, {args.turns} turns")
+    print(f"tool prompt tokens per request: text {tokens['text']}, native {tokens['native']}, saved {tokens['saved']}")
+    for r in runs:
+        print(f"{r['mode']:<8}{r['seconds'] * 1000:>10.1f} ms{r['request_bytes']:>12} request bytes")
+
+
+if __name__ == "__main__":
+    main()
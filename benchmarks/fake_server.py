@@ -0,0 +1,304 @@
+"""本地的 OpenAI 兼容 /chat/completions 流式服务，用于离线测试和基准测试
+
+回复内容、分块大小、输出速度、首包延迟、插入的函数调用和错误都可以通过 Script 配置，
+请求中的 model 字段可以选择不同的 Script（见 FakeOpenAIServer 的 scenarios 参数）。
+服务端模拟提供方的前缀缓存：提示（tools 加上各条消息）的前缀与之前的请求相同的部分计为命中，
+请求带 stream_options.include_usage 时在流的最后返回 usage。
+
+单独运行：python -m benchmarks.fake_server [--port 8000] [--tokens-per-sec 50] [--ttft 0.3] ...
+然后把 OpenAILLM 的 base_url 设为 http://127.0.0.1:8000/v1。
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+
+class Script(NamedTuple):
+    """一次回复的脚本"""
+    reply_tokens: int = 64  # 回复的 token 数（不含插入的文本）
+    chunk_tokens: int = 1  # 每个 SSE 数据帧包含的 token 数
+    tokens_per_sec: float = 0.0  # 输出速度，0 表示不限速
+    ttft: float = 0.0  # 发送第一个数据帧之前的延迟（秒）
+    inject: str = ""  # 插入回复中的文本，例如 <function_call>...</function_call>
+    inject_at: int = 8  # 在第几个 token 之后插入
+    error_rate: float = 0.0  # 以此概率直接返回 error_status
+    error_status: int = 500
+    fail_first: int = 0  # 此脚本的前几个请求直接返回 error_status
+    retry_after: Optional[str] = None  # 错误响应的 Retry-After 头
+    drop_after: Optional[int] = None  # 发送这么多数据帧后直接断开连接
+    malformed_rate: float = 0.0  # 以此概率在数据帧之间插入格式错误的帧
+    tool_call: str = ""  # 请求带 tools 参数时以 delta.tool_calls 返回的调用，格式为 name(参数JSON)，在 inject_at 处插入
+
+
+def script_tokens(script: Script) -> List[str]:
+    """按脚本生成回复的 token 序列，插入的文本按 4 个字符切分，函数调用标签会跨数据帧"""
+    tokens = [f"t{i} " for i in range(script.reply_tokens)]
+    if script.inject:
+        pieces = [script.inject[i:i + 4] for i in range(0, len(script.inject), 4)]
+        at = min(script.inject_at, len(tokens))
+        tokens[at:at] = pieces
+    return tokens
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认的监听队列只有 5，高并发建连时会被拒绝
+    request_queue_size = 1024
+
+
+class FakeOpenAIServer:
+    """在后台线程中运行的假 OpenAI 服务
+
+    用法：
+        with FakeOpenAIServer(Script(tokens_per_sec=100)) as server:
+            llm = OpenAILLM(server.base_url, "key")
+    """
+
+    def __init__(self, script: Script = Script(), scenarios: Dict[str, Script] = None,
+                 host: str = "127.0.0.1", port: int = 0, seed: int = 0):
+        """
+        Args:
+            script: 默认脚本
+            scenarios: model 名 -> 脚本，请求的 model 不在其中时使用默认脚本
+            host: 监听地址
+            port: 监听端口，0 表示随机选择
+            seed: 错误注入使用的随机数种子
+        """
+        self.script = script
+        self.scenarios = dict(scenarios or {})
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0  # 注入的错误数（HTTP 错误和断开连接）
+        self.tokens = 0  # 已发送的 token 数
+        self.request_bytes = 0  # 收到的请求体字节数
+        self.aborted = 0  # 客户端在回复结束前断开的流
+        self.prompt_tokens = 0  # 估算的提示 token 数
+        self.cached_tokens = 0  # 其中命中前缀缓存的部分
+        self._prefixes = set()  # 出现过的提示前缀的摘要
+        self.connections = set()  # 出现过的客户端连接
+        self._served: Dict[str, int] = {}  # 每个 model 收到的请求数
+        self._httpd = _Server((host, port), self._handler_class())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True, name="fake-openai")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self) -> Dict[str, int]:
+        return {"requests": self.requests, "errors": self.errors, "tokens": self.tokens,
+                "connections": len(self.connections)}
+
+    def _prompt_usage(self, body: dict) -> Tuple[int, int]:
+        """按消息粒度模拟前缀缓存，返回 (提示 token 数, 命中缓存的 token 数)
+
+        提示依次由 tools 和每条消息组成，每部分按 4 个字符一个 token 估算；
+        从头开始与之前某个请求相同的部分计为命中。
+        """
+        units = [body["tools"]] if body.get("tools") else []
+        units.extend(body.get("messages", []))
+        digest = hashlib.sha1()
+        prompt = cached = 0
+        with self._lock:
+            hit = True
+            for unit in units:
+                data = json.dumps(unit, ensure_ascii=False, sort_keys=True).encode("utf-8")
+                tokens = max(1, len(data) // 4)
+                digest.update(data)
+                key = digest.digest()
+                hit = hit and key in self._prefixes
+                self._prefixes.add(key)
+                prompt += tokens
+                if hit:
+                    cached += tokens
+            self.prompt_tokens += prompt
+            self.cached_tokens += cached
+        return prompt, cached
+
+    def _roll(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < rate
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                server.connections.add(self.client_address)
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_GET(self):
+                server.connections.add(self.client_address)
+                if not self.path.endswith("/models"):
+                    return self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+                models = sorted(set(server.scenarios) | {"default"})
+                self._send_json(200, {"object": "list", "data": [{"id": m, "object": "model"} for m in models]})
+
+            def do_POST(self):
+                server.connections.add(self.client_address)
+                raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                body = json.loads(raw or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    return self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+                script = server.scenarios.get(body.get("model"), server.script)
+                model = body.get("model", "")
+                with server._lock:
+                    server.requests += 1
+                    server.request_bytes += len(raw)
+                    served = server._served[model] = server._served.get(model, 0) + 1
+                if served <= script.fail_first or server._roll(script.error_rate):
+                    with server._lock:
+                        server.errors += 1
+                    headers = {"Retry-After": script.retry_after} if script.retry_after is not None else {}
+                    return self._send_json(script.error_status, {"error": {"message": "injected error"}}, headers)
+                prompt, cached = server._prompt_usage(body)
+                usage = None
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    usage = {"prompt_tokens": prompt, "prompt_tokens_details": {"cached_tokens": cached},
+                             "prompt_cache_hit_tokens": cached, "prompt_cache_miss_tokens": prompt - cached}
+                self._stream(script, native=bool(body.get("tools")), usage=usage)
+
+            def _send_json(self, status: int, payload: dict, headers: Dict[str, str] = None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _write_chunk(self, data: bytes):
+                # HTTP/1.1 分块传输，连接可以被客户端复用
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def _write_event(self, event: dict):
+                self._write_chunk(b"data: " + json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n\n")
+
+            def _write_tool_call(self, call: str):
+                """把 name(参数JSON) 拆成 delta.tool_calls 增量：第一帧带 id 和名字，之后每帧 8 个字符的参数"""
+                name, arguments = call[:call.index("(")], call[call.index("(") + 1:-1]
+                first = {"index": 0, "id": "call_0", "type": "function", "function": {"name": name, "arguments": ""}}
+                self._write_event({"choices": [{"index": 0, "delta": {"tool_calls": [first]}}]})
+                for i in range(0, len(arguments), 8):
+                    part = {"index": 0, "function": {"arguments": arguments[i:i + 8]}}
+                    self._write_event({"choices": [{"index": 0, "delta": {"tool_calls": [part]}}]})
+
+            def _stream(self, script: Script, native: bool = False, usage: dict = None):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                tool_call = script.tool_call if native else ""
+                tokens = script_tokens(script)
+                start = time.perf_counter() + script.ttft
+                step = max(1, script.chunk_tokens)
+                frames = 0
+                try:
+                    for i in range(0, len(tokens), step):
+                        due = start + (i / script.tokens_per_sec if script.tokens_per_sec > 0 else 0)
+                        delay = due - time.perf_counter()
+                        if delay > 0:
+                            time.sleep(delay)
+                        if script.drop_after is not None and frames >= script.drop_after:
+                            with server._lock:
+                                server.errors += 1
+                            self.close_connection = True
+                            return
+                        if server._roll(script.malformed_rate):
+                            self._write_chunk(b"data: {malformed\n\n")
+                        if tool_call and i >= script.inject_at:
+                            self._write_tool_call(tool_call)
+                            tool_call = ""
+                        self._write_event({"choices": [{"index": 0, "delta": {"content": "".join(tokens[i:i + step])}}]})
+                        frames += 1
+                        with server._lock:
+                            server.tokens += len(tokens[i:i + step])
+                    if tool_call:
+                        self._write_tool_call(tool_call)
+                    self._write_event({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+                    if usage is not None:
+                        # OpenAI 和 DeepSeek 的字段都返回
+                        completion = len(tokens)
+                        usage = dict(usage, completion_tokens=completion, total_tokens=usage["prompt_tokens"] + completion)
+                        self._write_event({"choices": [], "usage": usage})
+                    self._write_chunk(b"data: [DONE]\n\n")
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端提前断开
+                    with server._lock:
+                        server.aborted += 1
+                    self.close_connection = True
+
+        return Handler
+
+
+def main():
+    defaults = Script()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--reply-tokens", type=int, default=defaults.reply_tokens)
+    parser.add_argument("--chunk-tokens", type=int, default=defaults.chunk_tokens)
+    parser.add_argument("--tokens-per-sec", type=float, default=defaults.tokens_per_sec)
+    parser.add_argument("--ttft", type=float, default=defaults.ttft)
+    parser.add_argument("--inject", default="", help="插入回复中的文本，例如函数调用")
+    parser.add_argument("--inject-at", type=int, default=defaults.inject_at)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--fail-first", type=int, default=0, help="每个 model 的前几个请求直接返回错误")
+    parser.add_argument("--retry-after", default=None, help="错误响应的 Retry-After 头")
+    parser.add_argument("--drop-after", type=int, default=None)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    script = Script(
+        reply_tokens=args.reply_tokens, chunk_tokens=args.chunk_tokens, tokens_per_sec=args.tokens_per_sec,
+        ttft=args.ttft, inject=args.inject, inject_at=args.inject_at, error_rate=args.error_rate,
+        error_status=args.error_status, fail_first=args.fail_first, retry_after=args.retry_after,
+        drop_after=args.drop_after, malformed_rate=args.malformed_rate,
+    )
+    server = FakeOpenAIServer(script, host=args.host, port=args.port)
+    print(f"serving {server.base_url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
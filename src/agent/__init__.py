@@ -1,3 +1,19 @@
-from .agent import Agent
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .agent import Agent
 
 __all__ = ["Agent"]
+
+
+def __getattr__(name: str):
+    # 第一次访问 Agent 时才导入 agent 模块及其依赖（见 src.llm_proxy）
+    if name == "Agent":
+        from .agent import Agent
+        globals()["Agent"] = Agent
+        return Agent
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
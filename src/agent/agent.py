@@ -1,7 +1,16 @@
-from typing import List, Dict, Any, Generator, Union
+from typing import List, Dict, Any, Generator, AsyncGenerator, Iterable, Union
 from src.llm_proxy.llm_base import LLMBase, LLMMessage
 from src.llm_proxy.function_call import FunctionCall
 from src.llm_proxy.tool import BaseTool
+from src.llm_proxy.tool_executor import ToolExecutor
+from src.llm_proxy.tool_cache import ToolCache
+from src.llm_proxy.context_policy import ContextPolicy
+from src.llm_proxy.session_store import SessionStore
+from src.llm_proxy.instrumentation import start_span, iter_in_span, aiter_in_span, observe_chunk
+from src.llm_proxy.batch import BatchRun
+from src.llm_proxy.llm_base import MessageList
+from src.llm_proxy.cancellation import CancelToken, current_token, iter_cancellable, aiter_cancellable
+from src.llm_proxy.coalesce import ChunkCoalescer
 from typing import Type
 
 class Agent:
@@ -25,7 +34,14 @@ class Agent:
         default_model: str ,
         tools: List[BaseTool] = None ,
         default_temperature: float = 0.7,
-        allow_ask_other: bool = False
+        allow_ask_other: bool = False,
+        tool_executor: ToolExecutor = None,
+        tool_cache: ToolCache = None,
+        context_policy: ContextPolicy = None,
+        session_store: SessionStore = None,
+        session_id: str = None,
+        tool_mode: Union[str, Dict[str, str]] = "text",
+        coalescer: ChunkCoalescer = None
     ):
         """
         Initialize an agent with its identity and capabilities.
@@ -36,15 +52,36 @@ class Agent:
             goal: The agent's primary objective
             llm: An instance of LLMBase for language model interactions
             tools: List of tool classes the agent can use
+            tool_executor: Optional thread pool that runs the function calls of one
+                response concurrently while the LLM stream keeps being read
+            tool_cache: Optional result cache for tool calls, can be shared
+                between agents
+            context_policy: Optional policy that limits which history messages are
+                sent with each request, e.g. TokenBudgetPolicy; installed on the llm
+            session_store: Optional backend that persists the llm session, e.g.
+                SQLiteSessionStore; the stored history is loaded on first access
+            session_id: Key of the session in session_store, defaults to the agent name
+            tool_mode: How tools are offered to the model. "text" describes them in the
+                system prompt and parses <function_call> tags from the reply; "native"
+                sends them through the OpenAI tools parameter and executes the streamed
+                tool_calls. A dict maps model names to modes, unlisted models use "text"
+            coalescer: Optional ChunkCoalescer that merges the tiny stream deltas of
+                chat / achat into larger chunks by size, time and word boundary
         """
         self.name = name
         self.backstory = backstory
         self.goal = goal
         self.llm = llm
-        self.function_call = FunctionCall()
+        self.function_call = FunctionCall(executor=tool_executor, cache=tool_cache)
         self.allow_ask_other = allow_ask_other
         self.default_temperature = default_temperature
         self.default_model = default_model
+        self.tool_mode = tool_mode
+        self.coalescer = coalescer
+        if context_policy is not None:
+            self.llm.context_policy = context_policy
+        if session_store is not None:
+            self.llm.bind_session(session_store, session_id or name)
 
 
 
@@ -53,83 +90,300 @@ class Agent:
             for tool in tools:
                 self.function_call.add_tool(tool)
         
-        # Initialize the system message
-        self._update_system_message()
+        # Render the system message once and place it at the first slot
+        self._system_message = None
+        self._system_dirty = True
+        self._system_native = False
+        # What the model has been told so far, through the system message and appended updates
+        self._told_identity = None
+        self._told_tools: Dict[str, BaseTool] = {}
+        self._has_updates = False
+        self._sync_system_message(self.uses_native_tools(default_model))
     
+    @property
+    def system_message(self) -> LLMMessage:
+        """The system message at slot 0, rendered on demand.
+
+        Once the conversation has started, changes to identity and tools are appended
+        to the session as system updates and are not reflected here.
+        """
+        self._sync_system_message(self.uses_native_tools(self.default_model))
+        return self._system_message
+
+    def uses_native_tools(self, model: str = None) -> bool:
+        """Whether requests for model send tools through the native tools parameter."""
+        mode = self.tool_mode
+        if isinstance(mode, dict):
+            mode = mode.get(model, "text")
+        if mode not in ("text", "native"):
+            raise ValueError(f"Invalid tool mode: {mode}")
+        return mode == "native"
+
+    def _tool_kwargs(self, native: bool) -> Dict[str, Any]:
+        """Extra request fields for the tool mode."""
+        if native and self.function_call.tools:
+            return {"tools": self.function_call.get_tool_specs()}
+        return {}
+
     def _update_system_message(self):
-        """Update the system message with current agent identity and tools."""
-        # Base system message with agent identity
-        base_content = f"""
+        """Mark the system message stale; it is rebuilt once before the next request."""
+        self._system_dirty = True
+
+    def _sync_system_message(self, native: bool = False):
+        """Bring the instructions up to date and make sure the system message sits at slot 0.
+
+        Before the conversation starts the system message is simply rebuilt. After that the
+        session prefix has been sent and may be cached by the provider, so identity and tool
+        changes are appended as a system update and the prefix stays byte-identical.
+        Switching the tool mode changes the request anyway and always rebuilds it.
+        """
+        previous = self._system_message
+        if previous is None or native != self._system_native:
+            self._render_system_message(native)
+        elif self._system_dirty:
+            if self.llm.has_history():
+                self._append_update(native)
+            else:
+                self._render_system_message(native)
+
+        # The agent's system message always lives at slot 0, other messages are preserved
+        session = self.llm.session
+        if session and session[0] is self._system_message:
+            return
+        if self._has_updates:
+            # The updates went away with the old session, fold them into a fresh system message
+            self._render_system_message(native)
+        if session and (session[0] is previous or (previous is None and session[0].role == "system")):
+            session[0] = self._system_message
+        else:
+            session.insert(0, self._system_message)
+
+    def _identity(self) -> tuple:
+        return (self.name, self.backstory, self.goal)
+
+    def _identity_prompt(self) -> str:
+        return f"""
         You are {self.name}\n
         Your backstory: {self.backstory}\n
         Your goal: {self.goal}\n"""
 
-        # Add tools information if any tools are available
-        tools_prompt = self.function_call.get_system_prompt()
+    def _render_system_message(self, native: bool = False):
+        # Base system message with agent identity
+        base_content = self._identity_prompt()
+
+        # Add tools information if any tools are available; native mode sends them with the request
+        tools_prompt = "" if native else self.function_call.get_system_prompt()
         if tools_prompt:
             base_content += f"\n{tools_prompt}"
 
-        # Create new system message
-        self.system_message = LLMMessage(
+        self._system_message = LLMMessage(
             role="system",
             content=base_content
         )
-        
-        # Update session while preserving other messages
-        if self.llm.session:
-            # Find and replace the system message
-            for i, msg in enumerate(self.llm.session):
-                if msg.role == "system":
-                    self.llm.session[i] = self.system_message
-                    break
-            else:
-                # If no system message found, add it at the beginning
-                self.llm.session.insert(0, self.system_message)
-        else:
-            # If session is empty, just add the system message
-            self.llm.session = [self.system_message]
+        self._system_dirty = False
+        self._system_native = native
+        self._told_identity = self._identity()
+        self._told_tools = {} if native else dict(self.function_call.tools)
+        self._has_updates = False
+
+    def _append_update(self, native: bool):
+        """Append what changed since the model was last told as a system message."""
+        parts = []
+        identity = self._identity()
+        if identity != self._told_identity:
+            parts.append("Your identity has changed:" + self._identity_prompt())
+        if not native:
+            tools = self.function_call.tools
+            added = [tool for name, tool in tools.items() if self._told_tools.get(name) is not tool]
+            removed = [name for name in self._told_tools if name not in tools]
+            tools_prompt = self.function_call.get_update_prompt(added, removed, with_format=not self._told_tools)
+            if tools_prompt:
+                parts.append(tools_prompt)
+            self._told_tools = dict(tools)
+        self._told_identity = identity
+        self._system_dirty = False
+        if parts:
+            self.llm.session.append(LLMMessage(role="system", content="\n".join(parts)))
+            self._has_updates = True
     
-    def chat(self, message: str, model:str=None,temperature:float=0.7) -> Generator[str, None, None]:
+    def chat(self, message: str, model:str=None,temperature:float=0.7, deadline: float = None,
+             cancel_token: CancelToken = None) -> Generator[str, None, None]:
         """
         Have a conversation with the agent.
+
+        Closing the returned generator early cancels the reply: the HTTP response,
+        running tools and nested team member chats are closed right away. The session
+        keeps the part of the reply that was produced, or drops the user message if
+        nothing was.
         
         Args:
             message: The user's message
             model: The model to use
             temperature: The temperature to use
+            deadline: Optional time limit in seconds for the whole reply, including
+                tool calls; DeadlineExceeded is raised when it passes
+            cancel_token: Optional CancelToken; cancelling it from any thread stops
+                the reply and raises ChatCancelled
             
         Returns:
             A generator yielding response chunks
         """
-        # Add user message to session
+        # Created now so that a chat started inside a tool is tied to the caller's reply
+        token = CancelToken(deadline, parent=cancel_token or current_token())
+        stream = self._chat_in_span(message, model, temperature)
+        if self.coalescer is not None:
+            stream = self.coalescer.coalesce(stream)
+        return iter_cancellable(token, stream)
+
+    def _chat_in_span(self, message: str, model: str, temperature: float) -> Generator[str, None, None]:
+        span = start_span("agent.chat", agent=self.name, model=model)
+        if span is None:
+            yield from self._chat(message, model, temperature)
+        else:
+            yield from iter_in_span(span, self._chat(message, model, temperature), observe_chunk)
+
+    def _chat(self, message: str, model: str, temperature: float) -> Generator[str, None, None]:
+        native = self.uses_native_tools(model)
+        self._sync_system_message(native)
         user_message = LLMMessage(role="user", content=message)
-        self.llm.session.append(user_message)
-        
-        # Get response from LLM
-        response = self.llm.chat_with_context(
-            message,
-            model=model,
-            temperature=temperature
-        )
-        
-        buffer = ""
-        # Handle streaming response with function calls
-        tool_response = self.function_call.handle_stream(response)
-        for chunk in tool_response:
-            buffer += chunk
-            yield chunk
-        self.llm.chat_with_context(
-            LLMMessage(role="assistant", content=buffer),
-            model=model,
-            temperature=temperature
-        )
+        parts = []
+        completed = False
+        try:
+            # Get response from LLM; the user message is appended to the session here
+            response = self.llm.chat_with_context(
+                user_message,
+                model=model,
+                temperature=temperature,
+                save_reply=False,
+                **self._tool_kwargs(native)
+            )
+
+            # Handle streaming response with function calls
+            tool_response = self.function_call.handle_stream(response, native=native)
+            try:
+                for chunk in tool_response:
+                    parts.append(chunk)
+                    yield chunk
+                completed = True
+            finally:
+                tool_response.close()
+        finally:
+            # Store the reply with tool results substituted, once
+            self.llm.end_turn([user_message], "".join(parts), completed)
     
     def chat_default(self,message:str,**kwargs) -> Generator[str, None, None]:
         return self.chat(message,self.default_model,self.default_temperature,**kwargs)
+
+    def achat(self, message: str, model:str=None,temperature:float=0.7, deadline: float = None,
+              cancel_token: CancelToken = None) -> AsyncGenerator[str, None]:
+        """
+        Asynchronous version of chat, driven by the LLM's native async backend.
+
+        Cancellation works as in chat; the task waiting for the next chunk is
+        interrupted, so the pending request is cancelled where it awaits.
+        
+        Args:
+            message: The user's message
+            model: The model to use
+            temperature: The temperature to use
+            deadline: Optional time limit in seconds for the whole reply
+            cancel_token: Optional CancelToken that stops the reply when cancelled
+            
+        Returns:
+            An async generator yielding response chunks
+        """
+        token = CancelToken(deadline, parent=cancel_token or current_token())
+        stream = self._achat_in_span(message, model, temperature)
+        if self.coalescer is not None:
+            stream = self.coalescer.acoalesce(stream)
+        return aiter_cancellable(token, stream)
+
+    async def _achat_in_span(self, message: str, model: str, temperature: float) -> AsyncGenerator[str, None]:
+        span = start_span("agent.chat", agent=self.name, model=model)
+        stream = self._achat(message, model, temperature)
+        if span is not None:
+            stream = aiter_in_span(span, stream, observe_chunk)
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    async def _achat(self, message: str, model: str, temperature: float) -> AsyncGenerator[str, None]:
+        native = self.uses_native_tools(model)
+        self._sync_system_message(native)
+        user_message = LLMMessage(role="user", content=message)
+        parts = []
+        completed = False
+        try:
+            # Get response from LLM; the user message is appended to the session here
+            response = self.llm.achat_with_context(
+                user_message,
+                model=model,
+                temperature=temperature,
+                save_reply=False,
+                **self._tool_kwargs(native)
+            )
+
+            # Handle streaming response with function calls
+            tool_response = self.function_call.ahandle_stream(response, native=native)
+            try:
+                async for chunk in tool_response:
+                    parts.append(chunk)
+                    yield chunk
+                completed = True
+            finally:
+                await tool_response.aclose()
+        finally:
+            # Store the reply with tool results substituted, once
+            self.llm.end_turn([user_message], "".join(parts), completed)
+
+    def achat_default(self,message:str,**kwargs) -> AsyncGenerator[str, None]:
+        return self.achat(message,self.default_model,self.default_temperature,**kwargs)
     
+    def run_batch(self, inputs: Iterable[str], model: str = None, temperature: float = None,
+                  max_concurrency: int = 8, checkpoint: str = None) -> BatchRun:
+        """
+        Run many independent messages through the agent concurrently.
+
+        Each input gets its own session made of the agent's current system messages
+        (identity, tools, team roster and any updates appended to them) followed by the
+        input; the agent's session is not modified. Function calls are handled as in chat.
+
+        Args:
+            inputs: The user messages, may be a generator
+            model: The model to use, defaults to default_model
+            temperature: The temperature to use, defaults to default_temperature
+            max_concurrency: Maximum number of inputs in flight
+            checkpoint: Optional JSON Lines file; finished inputs are skipped when rerun
+
+        Returns:
+            A BatchRun yielding BatchResult items as they complete; its summary is
+            available once the iteration ends
+        """
+        model = self.default_model if model is None else model
+        temperature = self.default_temperature if temperature is None else temperature
+        native = self.uses_native_tools(model)
+        self._sync_system_message(native)
+        prefix = [msg for msg in self.llm.session if msg.role == "system"]
+        tool_kwargs = self._tool_kwargs(native)
+
+        def run_one(message: str) -> str:
+            span = start_span("agent.chat", agent=self.name, model=model)
+            messages = MessageList(prefix + [LLMMessage(role="user", content=message)])
+            response = self.llm.chat_messages(messages, model, temperature, **tool_kwargs)
+            # Inputs run in parallel threads, each records its calls on its own FunctionCall
+            stream = self.function_call.fork().handle_stream(response, native=native)
+            if span is not None:
+                stream = iter_in_span(span, stream, observe_chunk)
+            return "".join(stream)
+
+        return BatchRun(inputs, run_one, max_concurrency=max_concurrency, checkpoint=checkpoint)
+
     def clear_context(self):
         """Clear the conversation history while maintaining the system message."""
-        self.llm.session = [self.system_message]
+        self.llm.session = []
+        self._sync_system_message(self.uses_native_tools(self.default_model))
     
     def add_tool(self, tool: Type[BaseTool]):
         """Add a new tool to the agent's capabilities."""
@@ -139,8 +393,7 @@ class Agent:
     
     def remove_tool(self, tool_name: str):
         """Remove a tool from the agent's capabilities."""
-        if tool_name in self.function_call.tools:
-            del self.function_call.tools[tool_name]
+        if self.function_call.remove_tool(tool_name):
             self._update_system_message()
     
     def get_tools(self) -> List[str]:
@@ -1,7 +1,15 @@
 from .agent import Agent
 from src.llm_proxy import BaseTool,BaseModel,LLMMessage
-from typing import Any, Generator
+from src.llm_proxy.instrumentation import start_span, iter_in_span, aiter_in_span
+from typing import Any, Callable, Dict, Generator, AsyncGenerator, List, Optional
+from concurrent.futures import ThreadPoolExecutor
 from pydantic import Field
+import asyncio
+import contextvars
+import functools
+import queue
+import threading
+import time
 
 
 class AskTeamMemberInput(BaseModel):
@@ -12,77 +20,516 @@ class AskTeamMemberTool(BaseTool):
     name: str = "ask_team_member"
     description: str = "Ask other members in your team for help"
     argSchema: BaseModel = AskTeamMemberInput
+    cacheable: bool = False
     team:Any
 
     def __init__(self, team:Any):
         self.team = team
 
     def _run(self, name: str, question: str) -> Generator[str, None, None]:
-        for agent in self.team.agents:
-            if agent.name == name:
-                return agent.chat_default(question)
-        return "Agent not found"
+        agent = self.team.get_agent(name)
+        if agent is None:
+            return "Agent not found"
+        span = start_span("team.ask", team=self.team.name, member=name)
+        stream = agent.chat_default(question)
+        return stream if span is None else iter_in_span(span, stream)
+
+    async def _arun(self, name: str, question: str) -> AsyncGenerator[str, None] | str:
+        agent = self.team.get_agent(name)
+        if agent is None:
+            return "Agent not found"
+        span = start_span("team.ask", team=self.team.name, member=name)
+        stream = agent.achat_default(question)
+        return stream if span is None else aiter_in_span(span, stream)
+
+
+class DescribeTeamMemberInput(BaseModel):
+    name: str = Field(description="The name of the member")
+
+
+class DescribeTeamMemberTool(BaseTool):
+    name: str = "describe_team_member"
+    description: str = "Get the backstory and tools of a member in your team"
+    argSchema: BaseModel = DescribeTeamMemberInput
+    cacheable: bool = False
+    team: Any
+
+    def __init__(self, team: Any):
+        self.team = team
+
+    def _run(self, name: str) -> str:
+        agent = self.team.get_agent(name)
+        if agent is None:
+            return "Agent not found"
+        return self.team._get_agent_prompt(agent)
+
+
+class AskTeamMembersInput(BaseModel):
+    question: str = Field(description="The question to ask")
+    names: List[str] = Field(default_factory=list, description="Names of the members to ask, empty to ask all other members")
+
+
+# 成员流中的结束标记
+_DONE = object()
+
+
+class AskTeamMembersTool(BaseTool):
+    """同时向多个队友提问并汇总回答
+
+    每个成员的回答以 "[成员名]: " 开头：
+    - ordering="completed"：成员回答完整后按完成顺序输出；
+    - ordering="member"：按成员顺序输出，当前成员的回答边生成边输出，其余成员的回答先缓存；
+    到达 deadline 时输出各成员已生成的部分回答并停止等待。
+    """
+    name: str = "ask_team_members"
+    description: str = "Ask several members in your team the same question at once and collect all of their answers"
+    argSchema: BaseModel = AskTeamMembersInput
+    cacheable: bool = False
+    team: Any
+
+    def __init__(self, team: Any, asker: Optional[Agent] = None, ordering: str = "completed",
+                 deadline: Optional[float] = 120.0, max_concurrency: int = 8):
+        """
+        Args:
+            team: 所属团队
+            asker: 使用此工具的成员，提问所有人时排除自己
+            ordering: "completed" 或 "member"
+            deadline: 等待所有回答的总时间（秒），None 表示一直等待
+            max_concurrency: 同时提问的成员数上限
+        """
+        if ordering not in ("completed", "member"):
+            raise ValueError(f"ordering 只能是 completed 或 member：{ordering}")
+        self.team = team
+        self.asker = asker
+        self.ordering = ordering
+        self.deadline = deadline
+        self.fan_out = max_concurrency
+
+    def _members(self, names: List[str]) -> List[tuple]:
+        """(成员名, 成员)，找不到的成员为 None"""
+        if not names:
+            return [(agent.name, agent) for agent in self.team.agents if agent is not self.asker]
+        # 不能向自己提问，否则会在同一个会话上并发对话
+        return [(name, None if agent is self.asker else agent)
+                for name, agent in ((name, self.team.get_agent(name)) for name in dict.fromkeys(names))]
+
+    def _run(self, question: str, names: List[str] = ()) -> Generator[str, None, None]:
+        return self._collect(self._members(list(names)), question)
+
+    def _collect(self, members: List[tuple], question: str) -> Generator[str, None, None]:
+        events: "queue.Queue[tuple]" = queue.Queue()
+        cancelled = threading.Event()
+
+        def ask(name: str, agent: Agent):
+            span = start_span("team.ask", team=self.team.name, member=name)
+            stream = agent.chat_default(question)
+            if span is not None:
+                stream = iter_in_span(span, stream)
+            try:
+                for chunk in stream:
+                    if cancelled.is_set():
+                        break
+                    events.put((name, chunk))
+            except Exception as e:
+                events.put((name, f"[Error: {e}]"))
+            finally:
+                stream.close()
+                events.put((name, _DONE))
+
+        found = [(name, agent) for name, agent in members if agent is not None]
+        executor = ThreadPoolExecutor(max_workers=max(1, min(self.fan_out, len(found))), thread_name_prefix="team-ask")
+        for name, agent in found:
+            # 复制上下文，成员的 span 挂在当前工具调用下
+            executor.submit(contextvars.copy_context().run, ask, name, agent)
+        executor.shutdown(wait=False)
+
+        deadline = None if self.deadline is None else time.monotonic() + self.deadline
+        collector = _AnswerCollector([name for name, _ in members], self.ordering)
+        for name, agent in members:
+            if agent is None:
+                yield from collector.finish(name, "Agent not found")
+        try:
+            while not collector.complete():
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    break
+                try:
+                    name, item = events.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                yield from collector.finish(name) if item is _DONE else collector.add(name, item)
+            yield from collector.flush_partial()
+        finally:
+            cancelled.set()
+
+    async def _arun(self, question: str, names: List[str] = ()) -> AsyncGenerator[str, None]:
+        return self._acollect(self._members(list(names)), question)
+
+    async def _acollect(self, members: List[tuple], question: str) -> AsyncGenerator[str, None]:
+        events: "asyncio.Queue[tuple]" = asyncio.Queue()
+        semaphore = asyncio.Semaphore(max(1, self.fan_out))
+
+        async def ask(name: str, agent: Agent):
+            try:
+                async with semaphore:
+                    span = start_span("team.ask", team=self.team.name, member=name)
+                    stream = agent.achat_default(question)
+                    if span is not None:
+                        stream = aiter_in_span(span, stream)
+                    try:
+                        async for chunk in stream:
+                            events.put_nowait((name, chunk))
+                    finally:
+                        await stream.aclose()
+            except Exception as e:
+                events.put_nowait((name, f"[Error: {e}]"))
+            finally:
+                events.put_nowait((name, _DONE))
+
+        tasks = [asyncio.ensure_future(ask(name, agent)) for name, agent in members if agent is not None]
+        loop = asyncio.get_running_loop()
+        deadline = None if self.deadline is None else loop.time() + self.deadline
+        collector = _AnswerCollector([name for name, _ in members], self.ordering)
+        try:
+            for name, agent in members:
+                if agent is None:
+                    for chunk in collector.finish(name, "Agent not found"):
+                        yield chunk
+            while not collector.complete():
+                timeout = None if deadline is None else deadline - loop.time()
+                if timeout is not None and timeout <= 0:
+                    break
+                try:
+                    name, item = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                for chunk in (collector.finish(name) if item is _DONE else collector.add(name, item)):
+                    yield chunk
+            for chunk in collector.flush_partial():
+                yield chunk
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+class _AnswerCollector:
+    """按 ordering 决定成员回答的输出时机"""
+
+    def __init__(self, names: List[str], ordering: str):
+        self.names = names
+        self.ordering = ordering
+        self.buffers: Dict[str, List[str]] = {name: [] for name in names}
+        self.done: Dict[str, bool] = {name: False for name in names}
+        self.emitted = set()  # 已输出的成员
+        self.current = 0  # member 模式下正在输出的成员
+
+    def complete(self) -> bool:
+        return len(self.emitted) == len(self.names)
+
+    def add(self, name: str, chunk: str) -> List[str]:
+        self.buffers[name].append(chunk)
+        if self.ordering == "member" and self.current < len(self.names) and self.names[self.current] == name:
+            return self._advance()
+        return []
+
+    def finish(self, name: str, text: str = None) -> List[str]:
+        if text is not None:
+            self.buffers[name].append(text)
+        self.done[name] = True
+        if self.ordering == "completed":
+            self.emitted.add(name)
+            return [self._header(name), *self._take(name)]
+        return self._advance()
+
+    def _advance(self) -> List[str]:
+        """member 模式：输出当前成员已缓存的内容，已完成时依次推进到下一个成员"""
+        out = []
+        while self.current < len(self.names):
+            name = self.names[self.current]
+            if name not in self.emitted:
+                self.emitted.add(name)
+                out.append(self._header(name))
+            out.extend(self._take(name))
+            if not self.done[name]:
+                break
+            self.current += 1
+        return out
+
+    def flush_partial(self) -> List[str]:
+        """到达截止时间：输出尚未完成的成员已生成的部分"""
+        out = []
+        if self.ordering == "member":
+            out.extend(self._advance())
+        for name in self.names:
+            if self.done[name]:
+                continue
+            if name not in self.emitted:
+                self.emitted.add(name)
+                out.append(self._header(name))
+            out.extend(self._take(name))
+            out.append(" [no complete answer before the deadline]")
+            self.done[name] = True
+        return out
+
+    def _take(self, name: str) -> List[str]:
+        chunks, self.buffers[name] = self.buffers[name], []
+        return chunks
+
+    @staticmethod
+    def _header(name: str) -> str:
+        return f"\n[{name}]: "
+
+class RosterMessage(LLMMessage):
+    """团队成员名单消息，同一个对象被所有成员的会话引用
+
+    成员变化时只标记过期，下次读取内容时才重新生成，构造 n 个成员的团队只生成一次。
+    """
+    __slots__ = ("_render", "_stale")
+
+    def __init__(self, render: Callable[[], str]):
+        super().__init__("system", "")
+        self._render = render
+        self._stale = True
+
+    def invalidate(self):
+        self._stale = True
+
+    @property
+    def stale(self) -> bool:
+        """内容是否需要重新生成；为 False 时当前内容可能已经发送过"""
+        return self._stale
+
+    def _refresh(self):
+        if self._stale:
+            self._stale = False
+            self._content = self._render()
+            self._json = None
+
+    @property
+    def content(self) -> str:
+        self._refresh()
+        return self._content
+
+    @content.setter
+    def content(self, value: str):
+        self._content = value
+        self._json = None
+        self._stale = False
+
+    def to_dict(self):
+        self._refresh()
+        return super().to_dict()
+
+    def to_json(self) -> bytes:
+        self._refresh()
+        return super().to_json()
+
 
 class Team:
     name: str
     goal: str
     backstory: str
-    agents: list[Agent]
     team_tools:list[BaseTool]
 
-    def __init__(self,name:str,goal:str,backstory:str,agents:list[Agent]=[],team_tools:list[BaseTool]=[]):
+    def __init__(self,name:str,goal:str,backstory:str,agents:list[Agent]=[],team_tools:list[BaseTool]=[],
+                 broadcast_ordering:str="completed",broadcast_deadline:Optional[float]=120.0,
+                 roster_summary_threshold:int=12):
+        """
+        Args:
+            broadcast_ordering: ask_team_members 输出回答的顺序，"completed" 或 "member"
+            broadcast_deadline: ask_team_members 等待所有回答的总时间（秒）
+            roster_summary_threshold: 成员数超过此值时名单只列出名字和一行简介，
+                                      详细信息通过 describe_team_member 按需获取
+        """
         self.name = name
         self.goal = goal
         self.backstory = backstory
-        self.agents = agents
-        temp_agents = self.agents
-        self.agents = []
-        for agent in temp_agents:
+        self.team_tools = list(team_tools)
+        self.broadcast_ordering = broadcast_ordering
+        self.broadcast_deadline = broadcast_deadline
+        self.roster_summary_threshold = roster_summary_threshold
+        # 成员按加入顺序保存，按名字查找、加入和移除都是 O(1)
+        self._members: Dict[str, Agent] = {}
+        self._roster = RosterMessage(self._get_team_prompt)
+        self._entries: Dict[str, str] = {}  # 名单上次生成时每个成员的条目
+        # 已经发送过名单的成员：名字 -> 它看到的条目，以及还没有生成的名单更新消息
+        self._known: Dict[str, Dict[str, str]] = {}
+        self._updates: Dict[str, RosterMessage] = {}
+        self._describe_tool = DescribeTeamMemberTool(self)
+        for agent in agents:
             self.add_agent(agent)
             if agent.allow_ask_other:
                 agent.add_tool(AskTeamMemberTool(self))
+                agent.add_tool(AskTeamMembersTool(self, agent, self.broadcast_ordering, self.broadcast_deadline))
+
+    @property
+    def agents(self) -> List[Agent]:
+        return list(self._members.values())
+
+    @property
+    def roster_message(self) -> RosterMessage:
+        """所有成员共享的团队名单消息"""
+        return self._roster
+
+    def get_agent(self, name: str) -> Optional[Agent]:
+        """按名字查找成员"""
+        return self._members.get(name)
+
+    def refresh_roster(self):
+        """成员的工具或简介变化后调用，名单在下次请求前重新生成"""
+        self._roster_changed()
 
     def add_agent(self, agent: Agent):
-        #找到agent的第一条system消息，插入到后面
-        for i, msg in enumerate(agent.llm.session):
-            if msg.role == "system":
-                agent.llm.session.insert(i+1, LLMMessage(role="system", content=self._get_team_prompt()))
-                break
+        if agent.name in self._members:
+            raise ValueError(f"团队中已有同名成员：{agent.name}")
+        self._roster_changed()
+        #名单放在agent的第一条system消息后面，会话中已有本团队的名单（例如从存储加载）时替换它
+        session = agent.llm.session
+        index = self._find_roster(session)
+        if index is not None:
+            session[index] = self._roster
+        elif agent.llm.has_history():
+            # 对话已经开始，名单追加在末尾，已经发送过的前缀保持不变
+            session.append(self._roster)
         else:
-            agent.llm.session.append(LLMMessage(role="system", content=self._get_team_prompt()))
+            for i, msg in enumerate(session):
+                if msg.role == "system":
+                    session.insert(i+1, self._roster)
+                    break
+            else:
+                session.append(self._roster)
 
+        agent.add_tool(self._describe_tool)
         for tool in self.team_tools:
             agent.add_tool(tool)
-        self.agents.append(agent)
+        self._members[agent.name] = agent
 
     def remove_agent(self, agent: Agent):
-        #找到agent的第1条system消息之后的system消息
-        for i, msg in enumerate(agent.llm.session):
-            if msg.role == "system":
-                agent.llm.session.pop(i+1)
-                break
+        if self._members.get(agent.name) is not agent:
+            raise ValueError(f"{agent.name} 不是团队 {self.name} 的成员")
+        session = agent.llm.session
+        index = self._find_roster(session)
+        if not agent.llm.has_history():
+            if index is not None:
+                session.pop(index)
+        else:
+            # 已经发送过的名单和更新不移除，追加离开团队的说明
+            if index is not None and session[index] is self._roster:
+                if self._roster.stale:
+                    session.pop(index)  # 加入后还没有发送过
+                else:
+                    session[index] = LLMMessage("system", self._roster.content)
+            update = self._updates.pop(agent.name, None)
+            if update is not None:
+                update._refresh()  # 在离开之前生成，之后不再变化
+            session.append(LLMMessage("system", f"You are no longer a member of the team {self.name}."))
+        self._known.pop(agent.name, None)
         if agent.allow_ask_other:
             agent.remove_tool(AskTeamMemberTool.name)
+            agent.remove_tool(AskTeamMembersTool.name)
+        agent.remove_tool(self._describe_tool.name)
         for tool in self.team_tools:
             agent.remove_tool(tool.name)
-        self.agents.remove(agent)
+        del self._members[agent.name]
+        self._roster_changed()
 
-    def _get_team_prompt(self):
+    def _roster_changed(self):
+        """成员或成员信息变化
+
+        还没有开始对话的成员共享的名单在下次请求前重新生成。已经发送过名单的成员保留原来的名单，
+        变化以更新消息追加到会话末尾，会话前缀保持不变，服务端的前缀缓存继续命中；
+        同一个成员还没有发送的更新消息合并后续的变化。
+        """
+        roster = self._roster
+        if not roster.stale or self._known:
+            for name, agent in self._members.items():
+                session = agent.llm.session
+                if name not in self._known:
+                    if roster.stale or not agent.llm.has_history():
+                        continue  # 名单的当前内容还没有发送给它
+                    index = next((i for i, msg in enumerate(session) if msg is roster), None)
+                    if index is None:
+                        continue
+                    # 换成内容相同的普通消息，不再随名单变化
+                    session[index] = LLMMessage("system", roster.content)
+                    self._known[name] = self._entries
+                update = self._updates.get(name)
+                if update is None or not update.stale:
+                    update = self._updates[name] = RosterMessage(functools.partial(self._render_update, name))
+                    session.append(update)
+        roster.invalidate()
+
+    def _render_update(self, name: str) -> str:
+        """成员 name 上次看到名单之后的变化"""
+        entries = self._roster_entries()
+        known = self._known.get(name, {})
+        self._known[name] = entries
+        joined = [entry for member, entry in entries.items() if member not in known]
+        changed = [entry for member, entry in entries.items() if member in known and known[member] != entry]
+        left = [member for member in known if member not in entries]
+        lines = [f"Update of your team {self.name}:"]
+        if joined:
+            lines.append("New members in your team:\n" + "\n".join(joined))
+        if changed:
+            lines.append("Updated members:\n" + "\n".join(changed))
+        if left:
+            lines.append(f"Members who left your team: {', '.join(left)}")
+        if len(lines) == 1:
+            lines.append("No member changes.")
+        return "\n".join(lines)
+
+    def _find_roster(self, session: List[LLMMessage]) -> Optional[int]:
+        """本团队名单在会话中的位置：同一个对象，或内容以本团队名开头的 system 消息"""
+        header = self._team_header()
+        for i, msg in enumerate(session):
+            if msg is self._roster:
+                return i
+            if msg.role == "system" and not isinstance(msg, RosterMessage) and msg.content.startswith(header):
+                return i
+        return None
+
+    def _team_header(self) -> str:
         return f"""
-        Your team name: {self.name}\n
+        Your team name: {self.name}\n"""
+
+    def _roster_entries(self) -> Dict[str, str]:
+        """名单中每个成员的条目；成员数超过阈值时只有名字和一行简介"""
+        if len(self._members) > self.roster_summary_threshold:
+            return {name: self._get_agent_summary(agent) for name, agent in self._members.items()}
+        return {name: self._get_agent_prompt(agent) for name, agent in self._members.items()}
+
+    def _get_team_prompt(self):
+        self._entries = self._roster_entries()
+        members = '\n'.join(self._entries.values())
+        if len(self._members) > self.roster_summary_threshold:
+            details = f"Use {DescribeTeamMemberTool.name} function to see the backstory and tools of a member.\n"
+        else:
+            details = ""
+        return self._team_header() + f"""
         Your team goal: {self.goal}\n
         Your team backstory: {self.backstory}\n
-        You can ask other members in your team for help by use ask_team_member function.
-        Other members in your team:
-        {'\n'.join([self._get_agent_prompt(agent) for agent in self.agents])}
+        You can ask other members in your team for help by use ask_team_member function,
+        or ask several members at once by use ask_team_members function.
+        {details}Other members in your team:
+        {members}
         """
+
+    # 所有成员都有的团队工具，不在名单中重复列出
+    _TEAM_TOOL_NAMES = frozenset({AskTeamMemberTool.name, AskTeamMembersTool.name, DescribeTeamMemberTool.name})
+
     def _get_agent_prompt(self, agent: Agent):
+        shared = self._TEAM_TOOL_NAMES | {tool.name for tool in self.team_tools}
+        tools = '\n'.join([f"{tool.name}:{tool.description}" for tool in agent.function_call.tools.values()
+                           if tool.name not in shared])
         return f"""
         Member name: {agent.name}\n
         Member backstory: {agent.backstory}\n
-        Member tools: {'\n'.join([f"{tool.name}:{tool.description}" for tool in agent.function_call.tools.values()])}\n
+        Member tools: {tools}\n
         """
-        
-        
 
-    
\ No newline at end of file
+    @staticmethod
+    def _get_agent_summary(agent: Agent, width: int = 80):
+        role = agent.backstory.strip().split('\n', 1)[0] if agent.backstory else ""
+        if len(role) > width:
+            role = role[:width - 3] + "..."
+        return f"- {agent.name}: {role}"
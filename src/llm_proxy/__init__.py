@@ -1,19 +1,101 @@
 #导出
+# 子模块在第一次访问其中的名字时才导入（PEP 562 的模块级 __getattr__），
+# import src.llm_proxy 不会加载 requests、aiohttp、pydantic 和各个后端，
+# 只用到其中一部分的进程（单个后端、只恢复会话等）不为其余部分付出导入时间。
+import importlib
+from typing import TYPE_CHECKING
 
-from .llm_base import LLMBase
-from .openai_llm import OpenAILLM
-from .function_call import FunctionCall
-from .tool import BaseTool
-from .llm_base import LLMMessage
-from .openai_llm import DeepSeekLLM
-from pydantic import BaseModel
+if TYPE_CHECKING:
+    from .llm_base import LLMBase, LLMMessage, APIError
+    from .openai_llm import OpenAILLM, DeepSeekLLM
+    from .function_call import FunctionCall
+    from .tool import BaseTool
+    from .async_openai_llm import AsyncOpenAILLM, AsyncDeepSeekLLM
+    from .transport import HTTPTransport
+    from .tool_executor import ToolExecutor
+    from .tool_cache import ToolCache
+    from .tool_workers import ThreadToolPool, ProcessToolPool
+    from .tag_scanner import TagScanner, TagDialect, FUNCTION_CALL_TAG, TOOL_CALL_TAG
+    from .tool_calls import ToolCall
+    from .session_store import SessionStore, MemorySessionStore, SQLiteSessionStore
+    from .response_cache import ResponseCache, CachedLLM
+    from .retrying_llm import RetryingLLM
+    from .router_llm import RouterLLM, Backend
+    from .batch import BatchRun, BatchResult, BatchSummary
+    from .rate_limiter import RateLimiter, RateLimitExceeded, Priority, request_priority
+    from .cancellation import CancelToken, ChatCancelled, DeadlineExceeded
+    from .usage import Usage
+    from .coalesce import ChunkCoalescer
+    from .context_policy import ContextPolicy, TokenBudgetPolicy, SummarizingPolicy, estimate_tokens
+    from .instrumentation import Event, Span, add_hook, remove_hook, start_span, MetricsCollector
+    from pydantic import BaseModel
 
-__all__ = [
-    "LLMBase",
-    "OpenAILLM",
-    "FunctionCall",
-    "BaseTool",
-    "LLMMessage",
-    "DeepSeekLLM",
-    "BaseModel"
-    ]
+# 导出的名字 -> 所在模块，以 . 开头的是本包的子模块
+_EXPORTS = {
+    "LLMBase": ".llm_base",
+    "LLMMessage": ".llm_base",
+    "APIError": ".llm_base",
+    "OpenAILLM": ".openai_llm",
+    "DeepSeekLLM": ".openai_llm",
+    "FunctionCall": ".function_call",
+    "BaseTool": ".tool",
+    "AsyncOpenAILLM": ".async_openai_llm",
+    "AsyncDeepSeekLLM": ".async_openai_llm",
+    "HTTPTransport": ".transport",
+    "ToolExecutor": ".tool_executor",
+    "ToolCache": ".tool_cache",
+    "ThreadToolPool": ".tool_workers",
+    "ProcessToolPool": ".tool_workers",
+    "TagScanner": ".tag_scanner",
+    "TagDialect": ".tag_scanner",
+    "FUNCTION_CALL_TAG": ".tag_scanner",
+    "TOOL_CALL_TAG": ".tag_scanner",
+    "ToolCall": ".tool_calls",
+    "SessionStore": ".session_store",
+    "MemorySessionStore": ".session_store",
+    "SQLiteSessionStore": ".session_store",
+    "ResponseCache": ".response_cache",
+    "CachedLLM": ".response_cache",
+    "RetryingLLM": ".retrying_llm",
+    "RouterLLM": ".router_llm",
+    "Backend": ".router_llm",
+    "BatchRun": ".batch",
+    "BatchResult": ".batch",
+    "BatchSummary": ".batch",
+    "RateLimiter": ".rate_limiter",
+    "RateLimitExceeded": ".rate_limiter",
+    "Priority": ".rate_limiter",
+    "request_priority": ".rate_limiter",
+    "CancelToken": ".cancellation",
+    "ChatCancelled": ".cancellation",
+    "DeadlineExceeded": ".cancellation",
+    "Usage": ".usage",
+    "ChunkCoalescer": ".coalesce",
+    "ContextPolicy": ".context_policy",
+    "TokenBudgetPolicy": ".context_policy",
+    "SummarizingPolicy": ".context_policy",
+    "estimate_tokens": ".context_policy",
+    "Event": ".instrumentation",
+    "Span": ".instrumentation",
+    "add_hook": ".instrumentation",
+    "remove_hook": ".instrumentation",
+    "start_span": ".instrumentation",
+    "MetricsCollector": ".instrumentation",
+    "BaseModel": "pydantic",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    # 缓存到模块字典中，之后的访问不再经过 __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,98 @@
+from .openai_llm import OpenAILLM, _limit
+from .cancellation import remaining_time
+from .llm_base import APIError, encode_request_body
+from .transport import HTTPTransport
+from .sse import aiter_deltas, ErrorCallback, UsageCallback
+from .tool_calls import aiter_tool_deltas
+from .instrumentation import start_span, observe_chunk
+from .rate_limiter import RateLimiter
+import time
+from typing import AsyncGenerator, Dict, Any, List
+
+
+class AsyncOpenAILLM(OpenAILLM):
+    """原生异步的 OpenAI 兼容后端
+
+    同步接口沿用 OpenAILLM；异步接口基于 aiohttp，所有流共享同一个事件循环，
+    单个事件循环即可承载大量并发流，无需为每个流占用一个线程。
+    连接池由 HTTPTransport 管理，并发上限见 HTTPTransport.async_limit。
+    """
+
+    async def _achat_raw(
+        self,
+        messages: List[Dict[str,str]],
+        model: str,
+        temperature: float = 0.7,
+        **kwargs
+    ) -> AsyncGenerator[str, None]:
+        url = f"{self.base_url}/chat/completions"
+        self._request_usage(kwargs)
+        # 历史消息使用各自缓存的 JSON 片段，每轮只编码新消息
+        data = encode_request_body(
+            messages,
+            model=model,
+            temperature=temperature,
+            stream=True,
+            **kwargs
+        )
+
+        limiter = self.rate_limiter
+        if limiter is not None:
+            await limiter.aacquire(limiter.estimate(data, kwargs), timeout=_limit(remaining_time(), limiter.timeout))
+
+        span = start_span("llm.request", model=model, base_url=self.base_url)
+        try:
+            client = self.transport.get_async_client()
+            async with client.post(url, headers=self.headers, data=data) as response:
+                if span is not None:
+                    span.set(connect_s=time.perf_counter() - span.start)
+                if response.status != 200:
+                    text = await response.text()
+                    if limiter is not None:
+                        limiter.settle(limiter.reserve_output(kwargs), 0)
+                        if response.status == 429:
+                            limiter.throttle(response.headers.get("Retry-After"))
+                    if span is not None:
+                        span.end(f"HTTP {response.status}", status=response.status)
+                    raise APIError(response.status, text, response.headers.get("Retry-After"))
+
+                stream = self._ahandle_stream_response(response, native=bool(kwargs.get("tools")),
+                                                       on_usage=self._usage_callback(span))
+                if limiter is not None:
+                    stream = limiter.atrack(stream, limiter.reserve_output(kwargs))
+                async for content in stream:
+                    if span is not None:
+                        observe_chunk(span, content)
+                    yield content
+        except GeneratorExit:
+            if span is not None:
+                span.end(cancelled=True)
+            raise
+        except BaseException as e:
+            if span is not None:
+                span.end(e)
+            raise
+        if span is not None:
+            span.end()
+
+    async def _ahandle_stream_response(self, response: Any, native: bool = False,
+                                       on_usage: UsageCallback = None) -> AsyncGenerator[str, None]:
+        """
+        处理异步流式响应，生成连续的数据块
+
+        收到结束标志后继续读完响应体，连接才能放回连接池复用；native、on_usage 同 OpenAILLM._handle_stream_response
+        """
+        deltas = aiter_tool_deltas if native else aiter_deltas
+        async for content in deltas(response.content.iter_any(), on_error=self.on_sse_error, on_usage=on_usage):
+            yield content
+
+    async def aclose(self):
+        """关闭当前事件循环上的异步连接池，使用共享传输层时会影响同一 base_url 的其他实例"""
+        await self.transport.aclose()
+
+
+class AsyncDeepSeekLLM(AsyncOpenAILLM):
+    def __init__(self, api_key: str, transport: HTTPTransport = None, on_sse_error: ErrorCallback = None,
+                 rate_limiter: RateLimiter = None, include_usage: bool = True):
+        super().__init__(base_url="https://api.deepseek.com/v1", api_key=api_key, transport=transport,
+                         on_sse_error=on_sse_error, rate_limiter=rate_limiter, include_usage=include_usage)
@@ -0,0 +1,26 @@
+import asyncio
+from concurrent.futures import Executor
+from typing import AsyncGenerator, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+_SENTINEL = object()
+
+
+async def iterate_in_executor(iterator: Iterator[T], executor: Optional[Executor] = None) -> AsyncGenerator[T, None]:
+    """在线程池中逐项驱动同步迭代器，避免阻塞事件循环
+
+    Args:
+        iterator: 同步迭代器或生成器
+        executor: 执行器，默认使用事件循环的默认线程池
+
+    Yields:
+        迭代器产出的每一项
+    """
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterator)
+    while True:
+        item = await loop.run_in_executor(executor, next, iterator, _SENTINEL)
+        if item is _SENTINEL:
+            break
+        yield item
@@ -0,0 +1,214 @@
+"""批量推理
+
+把大量相互独立的输入交给 LLMBase.batch 或 Agent.run_batch：
+- 每个输入使用独立的会话，由共享的前缀消息（系统提示等）加上输入本身组成，
+  前缀消息对象在所有输入之间复用，编码后的 JSON 也只生成一次；
+- 最多 max_concurrency 个输入同时进行，输入按需读取，结果按完成顺序返回并带上输入下标；
+- 请求使用 Priority.BATCH 排队，不会挤占交互式请求的限额；
+- 设置 checkpoint 后每完成一个输入就追加一行记录，中断后重新运行会跳过已完成的输入；
+- 迭代结束后 summary 给出吞吐量和失败数。
+
+    run = agent.run_batch(prompts, max_concurrency=16, checkpoint="batch.jsonl")
+    for result in run:
+        ...
+    print(run.summary)
+"""
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Generator, Iterable, NamedTuple, Optional
+from .rate_limiter import Priority, request_priority
+from .tokens import estimate_tokens
+
+
+class BatchResult(NamedTuple):
+    """一个输入的结果"""
+    index: int  # 输入的下标
+    output: Optional[str]  # 失败时为 None
+    error: Optional[str] = None
+    seconds: float = 0.0
+    resumed: bool = False  # 是否来自检查点，没有重新执行
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class BatchSummary(NamedTuple):
+    total: int
+    succeeded: int
+    failed: int
+    resumed: int  # 从检查点恢复、没有重新执行的输入数
+    seconds: float
+    items_per_sec: float  # 本次实际执行的输入的吞吐量
+    output_tokens: int  # 本次生成的估算 token 数
+    tokens_per_sec: float
+
+    def __str__(self) -> str:
+        return (f"{self.total} items: {self.succeeded} succeeded, {self.failed} failed, {self.resumed} resumed, "
+                f"{self.seconds:.2f}s, {self.items_per_sec:.2f} items/s, {self.tokens_per_sec:.1f} tokens/s")
+
+
+def input_key(item: Any) -> str:
+    """输入的指纹，用于确认检查点中的记录对应同一个输入"""
+    data = json.dumps(item, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+class BatchCheckpoint:
+    """JSON Lines 格式的检查点文件，每行一个已成功的输入
+
+    失败的输入不记录，恢复时会重新执行；文件末尾写了一半的行（进程崩溃）会被忽略。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def load(self) -> Dict[int, Dict[str, Any]]:
+        """下标 -> 记录"""
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records[record["index"]] = record
+        return records
+
+    def record(self, result: BatchResult, key: str):
+        line = json.dumps({"index": result.index, "key": key, "output": result.output}, ensure_ascii=False)
+        with self._lock:
+            if self._file is None:
+                self._file = self._open()
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def _open(self):
+        # 上次运行崩溃时最后一行可能没有写完，新记录从新的一行开始
+        partial = False
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                partial = f.read(1) != b"\n"
+        file = open(self.path, "a", encoding="utf-8")
+        if partial:
+            file.write("\n")
+        return file
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class BatchRun:
+    """一次批量运行，迭代得到按完成顺序排列的 BatchResult，迭代结束后 summary 可用"""
+
+    def __init__(self, inputs: Iterable[Any], run_one: Callable[[Any], str], max_concurrency: int = 8,
+                 checkpoint: Optional[str] = None, priority: Priority = Priority.BATCH):
+        """
+        Args:
+            inputs: 输入序列，可以是生成器，按需读取
+            run_one: 处理一个输入并返回完整输出，在线程池中调用
+            max_concurrency: 同时处理的输入数上限
+            checkpoint: 检查点文件路径，None 表示不记录
+            priority: 请求在限流队列中的优先级
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency 必须大于 0")
+        self.inputs = inputs
+        self.run_one = run_one
+        self.max_concurrency = max_concurrency
+        self.checkpoint = BatchCheckpoint(checkpoint) if checkpoint else None
+        self.priority = priority
+        self.summary: Optional[BatchSummary] = None
+        self._started = False
+
+    def __iter__(self) -> Generator[BatchResult, None, None]:
+        if self._started:
+            raise ValueError("BatchRun 只能迭代一次")
+        self._started = True
+        return self._run()
+
+    def results(self) -> list:
+        """运行到结束，返回按输入下标排序的结果"""
+        return sorted(self, key=lambda r: r.index)
+
+    def _call(self, item: Any) -> BatchResult:
+        start = time.perf_counter()
+        try:
+            with request_priority(self.priority):
+                output = self.run_one(item)
+        except Exception as e:
+            return BatchResult(-1, None, f"{type(e).__name__}: {e}", time.perf_counter() - start)
+        return BatchResult(-1, output, None, time.perf_counter() - start)
+
+    def _run(self) -> Generator[BatchResult, None, None]:
+        done_records = self.checkpoint.load() if self.checkpoint else {}
+        counts = {"total": 0, "succeeded": 0, "failed": 0, "resumed": 0}
+        output_tokens = 0
+        start = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="llm-batch")
+        pending = {}  # future -> (下标, 指纹)
+        items = enumerate(self.inputs)
+        exhausted = False
+        try:
+            while True:
+                # 补充到并发上限，已在检查点中的输入直接返回
+                while not exhausted and len(pending) < self.max_concurrency:
+                    try:
+                        index, item = next(items)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    counts["total"] += 1
+                    key = input_key(item) if self.checkpoint else None
+                    record = done_records.get(index)
+                    if record is not None and record.get("key") == key:
+                        counts["resumed"] += 1
+                        counts["succeeded"] += 1
+                        yield BatchResult(index, record["output"], resumed=True)
+                        continue
+                    # 复制上下文，请求的 span 挂在调用方当前的 span 下
+                    future = executor.submit(contextvars.copy_context().run, self._call, item)
+                    pending[future] = (index, key)
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index, key = pending.pop(future)
+                    result = future.result()._replace(index=index)
+                    if result.ok:
+                        counts["succeeded"] += 1
+                        output_tokens += estimate_tokens(result.output or "")
+                        if self.checkpoint:
+                            self.checkpoint.record(result, key)
+                    else:
+                        counts["failed"] += 1
+                    yield result
+        finally:
+            # 调用方提前停止迭代时不再启动新的输入，已在进行的输入完成后丢弃
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+            if self.checkpoint:
+                self.checkpoint.close()
+            seconds = time.perf_counter() - start
+            executed = counts["succeeded"] + counts["failed"] - counts["resumed"]
+            self.summary = BatchSummary(
+                seconds=seconds,
+                items_per_sec=executed / seconds if seconds > 0 else 0.0,
+                output_tokens=output_tokens,
+                tokens_per_sec=output_tokens / seconds if seconds > 0 else 0.0,
+                **counts
+            )
@@ -0,0 +1,291 @@
+"""取消与截止时间
+
+Agent.chat / achat 为每次对话创建一个 CancelToken，读取回复期间它是当前的取消令牌：
+- 调用方提前关闭回复的生成器、在任意线程调用 token.cancel() 或超过 deadline 时，令牌被取消；
+- 取消沿调用链向下传递：同步后端在令牌上注册关闭 HTTP 响应的回调，阻塞中的读取立即返回；
+  工具生成器、工作者中的工具和嵌套的成员对话随外层一起关闭，
+  成员对话（包括在其他线程中运行的）的令牌是外层令牌的子令牌；
+- 令牌取消后重试和故障转移不再发起新请求；
+- 调用方收到 ChatCancelled（超过截止时间时为 DeadlineExceeded），主动关闭生成器时不会收到异常。
+
+    token = CancelToken()
+    for chunk in agent.chat_default("...", cancel_token=token, deadline=30):
+        ...
+    # 在其他线程中：token.cancel()
+
+在读取流的线程上直接执行的同步工具无法被中断，取消在它返回后生效。
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncGenerator, AsyncIterable, Callable, Dict, Generator, Iterable, Optional
+
+
+class ChatCancelled(Exception):
+    """对话被取消"""
+    pass
+
+
+class DeadlineExceeded(ChatCancelled, TimeoutError):
+    """对话超过了截止时间"""
+    pass
+
+
+_current: contextvars.ContextVar[Optional["CancelToken"]] = contextvars.ContextVar("fastagent_cancel_token", default=None)
+
+
+def _noop():
+    pass
+
+
+class CancelToken:
+    """可以在任意线程取消的令牌，父令牌取消时子令牌一起取消"""
+
+    def __init__(self, deadline: Optional[float] = None, parent: Optional["CancelToken"] = None):
+        """
+        Args:
+            deadline: 从现在起的最长时间（秒），None 表示不限制
+            parent: 父令牌；子令牌的截止时间不晚于父令牌
+        """
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._callbacks: Dict[int, Callable[[], Any]] = {}
+        self._next_id = 0
+        self._expired = False
+        self._timer: Optional[threading.Timer] = None
+        self._detach = _noop
+        self.deadline = None if deadline is None else time.monotonic() + deadline  # time.monotonic() 时间
+        if parent is not None:
+            if parent.deadline is not None and (self.deadline is None or parent.deadline <= self.deadline):
+                # 父令牌的计时器会先到期，不需要自己的计时器
+                self.deadline = parent.deadline
+                deadline = None
+            self._detach = parent.on_cancel(self._cancel_from_parent(parent))
+        if deadline is not None and not self._event.is_set():
+            self._timer = threading.Timer(max(0.0, self.deadline - time.monotonic()), self.cancel, kwargs={"expired": True})
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _cancel_from_parent(self, parent: "CancelToken") -> Callable[[], None]:
+        return lambda: self.cancel(expired=parent._expired)
+
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            # 计时器线程可能还没有运行
+            self.cancel(expired=True)
+            return True
+        return False
+
+    @property
+    def expired(self) -> bool:
+        """是否因为超过截止时间而被取消"""
+        return self.cancelled and self._expired
+
+    def remaining(self) -> Optional[float]:
+        """距截止时间的秒数，没有截止时间时返回 None"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def cancel(self, expired: bool = False):
+        """取消令牌并执行注册的回调，重复调用没有效果"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._expired = expired
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        if self._timer is not None:
+            self._timer.cancel()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def on_cancel(self, callback: Callable[[], Any]) -> Callable[[], None]:
+        """注册取消时执行的回调（可能在其他线程中执行），返回注销函数；已取消时立即执行"""
+        with self._lock:
+            if not self._event.is_set():
+                key = self._next_id
+                self._next_id += 1
+                self._callbacks[key] = callback
+                return lambda: self._remove(key)
+        callback()
+        return _noop
+
+    def _remove(self, key: int):
+        with self._lock:
+            self._callbacks.pop(key, None)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待最多 timeout 秒，返回令牌是否已被取消"""
+        remaining = self.remaining()
+        if remaining is not None and (timeout is None or remaining < timeout):
+            timeout = remaining
+        self._event.wait(timeout)
+        return self.cancelled
+
+    def error(self) -> ChatCancelled:
+        if self._expired:
+            return DeadlineExceeded("对话超过了截止时间")
+        return ChatCancelled("对话已取消")
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise self.error()
+
+    def close(self):
+        """对话结束后释放计时器和父令牌上的回调，不会取消令牌"""
+        if self._timer is not None:
+            self._timer.cancel()
+        self._detach()
+        with self._lock:
+            self._callbacks.clear()
+
+
+def current_token() -> Optional[CancelToken]:
+    """当前的取消令牌，不在对话中时返回 None"""
+    return _current.get()
+
+
+@contextmanager
+def cancel_scope(token: Optional[CancelToken]):
+    """在 with 块内把 token 设为当前的取消令牌"""
+    ctx = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(ctx)
+
+
+def on_cancel(callback: Callable[[], Any]) -> Callable[[], None]:
+    """在当前令牌上注册回调，没有当前令牌时什么都不做，返回注销函数"""
+    token = _current.get()
+    if token is None:
+        return _noop
+    return token.on_cancel(callback)
+
+
+def check_cancelled():
+    """当前令牌已取消时抛出 ChatCancelled"""
+    token = _current.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def remaining_time() -> Optional[float]:
+    """当前令牌距截止时间的秒数，没有截止时间时返回 None"""
+    token = _current.get()
+    return None if token is None else token.remaining()
+
+
+def sleep(seconds: float):
+    """可以被当前令牌打断的 time.sleep，令牌取消时抛出 ChatCancelled"""
+    token = _current.get()
+    if token is None:
+        time.sleep(seconds)
+    elif token.wait(seconds):
+        raise token.error()
+
+
+def iter_cancellable(token: CancelToken, iterable: Iterable[Any]) -> Generator[Any, None, None]:
+    """逐项读取 iterable，读取期间 token 是当前的取消令牌
+
+    令牌被取消时关闭 iterable 并抛出 ChatCancelled；调用方提前关闭或读取出错时取消令牌，
+    其他线程中以它为父令牌的任务一起停止。结束后释放令牌。
+    """
+    iterator = iter(iterable)
+    finished = False
+    try:
+        while True:
+            if token.cancelled:
+                raise token.error()
+            ctx = _current.set(token)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                finished = True
+                return
+            except Exception as e:
+                if token.cancelled:
+                    raise token.error() from e
+                raise
+            finally:
+                _current.reset(ctx)
+            yield item
+    finally:
+        if not finished:
+            token.cancel()
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                with cancel_scope(token):
+                    close()
+        token.close()
+
+
+async def aiter_cancellable(token: CancelToken, iterable: AsyncIterable[Any]) -> AsyncGenerator[Any, None]:
+    """iter_cancellable 的异步版本
+
+    令牌被取消时打断正在等待下一项的任务，CancelledError 在 iterable 内部的 await 处抛出，
+    各层的 finally（关闭响应等）照常执行，调用方收到 ChatCancelled。
+    """
+    iterator = iterable.__aiter__()
+    loop = asyncio.get_running_loop()
+    waiting = [None]  # 正在等待下一项的任务
+
+    def interrupt():
+        if waiting[0] is not None:
+            waiting[0].cancel()
+
+    def wake():
+        try:
+            loop.call_soon_threadsafe(interrupt)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    detach = token.on_cancel(wake)
+    finished = False
+    try:
+        while True:
+            if token.cancelled:
+                raise token.error()
+            ctx = _current.set(token)
+            waiting[0] = asyncio.current_task()
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                finished = True
+                return
+            except asyncio.CancelledError:
+                if not token.cancelled:
+                    raise
+                # 取消请求来自令牌而不是调用方
+                uncancel = getattr(waiting[0], "uncancel", None)
+                if uncancel is not None:
+                    uncancel()
+                raise token.error() from None
+            except Exception as e:
+                if token.cancelled:
+                    raise token.error() from e
+                raise
+            finally:
+                waiting[0] = None
+                _current.reset(ctx)
+            yield item
+    finally:
+        detach()
+        if not finished:
+            token.cancel()
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                with cancel_scope(token):
+                    await aclose()
+        token.close()
@@ -0,0 +1,240 @@
+"""输出流的数据块合并
+
+SSE 的每个增量通常只有一两个字符，handle_stream 在标签边界附近还会产出空串或单个字符。
+转发到 websocket 等按消息计费的通道时，每条消息的固定开销远大于内容本身。
+ChunkCoalescer 把小块合并后再输出：
+- 累计达到 min_chars 个字符时输出；
+- 最早的未输出字符等待超过 max_delay 秒时输出，上游停顿（例如执行工具）时已产生的文本不会被扣住；
+- word_boundary 为 True 时在最后一个空白处切开，未完成的单词留到下一块，流结束时全部输出；
+- 设置了 max_delay 时由后台读取者读取上游，消费者处理较慢时读取者继续累积，下一次一次性取走；
+  累积达到 max_buffer 个字符后读取者停止读取上游，压力沿流传回服务端，不会无限占用内存。
+
+上游结束或出错时，已累积的文本先全部输出，然后结束或抛出上游的异常。
+
+    coalescer = ChunkCoalescer(min_chars=64, max_delay=0.02)
+    for chunk in coalescer.coalesce(llm.chat("...", "deepseek-chat", 0.7)):
+        websocket.send(chunk)
+
+Agent 的 coalescer 参数对 chat / achat 的输出使用同一个阶段。
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from typing import AsyncGenerator, AsyncIterable, Generator, Iterable, List, Optional
+from .cancellation import CancelToken, current_token, iter_cancellable
+
+_WHITESPACE = (" ", "\n", "\t")
+
+
+class _Pending:
+    """尚未输出的文本，用列表累积，输出时一次 join"""
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.size = 0
+        self.since = 0.0  # 最早的未输出文本到达的时间（time.monotonic()）
+        self.done = False  # 上游已经结束
+        self.closed = False  # 消费者已经关闭，读取者线程应当停止
+        self.error: Optional[BaseException] = None
+
+    def add(self, chunk: str):
+        if not self.parts:
+            self.since = time.monotonic()
+        self.parts.append(chunk)
+        self.size += len(chunk)
+
+
+class ChunkCoalescer:
+    """按大小、时间和单词边界合并流式输出的数据块，同一个实例可以同时用于多个流"""
+
+    def __init__(self, min_chars: int = 64, max_delay: Optional[float] = 0.02,
+                 word_boundary: bool = True, max_buffer: int = 65536):
+        """
+        Args:
+            min_chars: 累计达到这么多字符时输出
+            max_delay: 文本最多等待的秒数，None 表示只按大小合并（不启动读取者，上游停顿时文本会被扣住）
+            word_boundary: 是否只在空白处切开，不完整的单词与后面的文本一起输出
+            max_buffer: 读取者最多累积的字符数，达到后暂停读取上游
+        """
+        if min_chars < 1:
+            raise ValueError("min_chars 必须大于 0")
+        if max_delay is not None and max_delay < 0:
+            raise ValueError("max_delay 不能为负数")
+        if max_buffer < min_chars:
+            raise ValueError("max_buffer 不能小于 min_chars")
+        self.min_chars = min_chars
+        self.max_delay = max_delay
+        self.word_boundary = word_boundary
+        self.max_buffer = max_buffer
+
+    def _wait_time(self, pending: _Pending) -> Optional[float]:
+        """距下一次输出的秒数，0 表示现在就可以输出，None 表示等待新的数据"""
+        if pending.done or pending.size >= self.min_chars:
+            return 0.0
+        if not pending.parts or self.max_delay is None:
+            return None
+        return max(0.0, pending.since + self.max_delay - time.monotonic())
+
+    def _take(self, pending: _Pending, final: bool) -> str:
+        """取出要输出的文本，必要时把最后一个不完整的单词留在 pending 中"""
+        if not pending.parts:
+            return ""
+        text = "".join(pending.parts)
+        rest = ""
+        if self.word_boundary and not final:
+            cut = max(text.rfind(ch) for ch in _WHITESPACE) + 1
+            # 没有空白，或剩下的部分已经足够输出一次时不切开
+            if cut and len(text) - cut < self.min_chars:
+                text, rest = text[:cut], text[cut:]
+        pending.parts = [rest] if rest else []
+        pending.size = len(rest)
+        if rest:
+            pending.since = time.monotonic()
+        return text
+
+    def coalesce(self, stream: Iterable[str]) -> Generator[str, None, None]:
+        """合并同步流的数据块，关闭返回的生成器时关闭上游"""
+        if self.max_delay is None:
+            return self._coalesce_by_size(stream)
+        return self._coalesce_with_reader(stream)
+
+    def _coalesce_by_size(self, stream: Iterable[str]) -> Generator[str, None, None]:
+        pending = _Pending()
+        iterator = iter(stream)
+        try:
+            try:
+                for chunk in iterator:
+                    if not chunk:
+                        continue
+                    pending.add(chunk)
+                    if pending.size >= self.min_chars:
+                        text = self._take(pending, False)
+                        if text:
+                            yield text
+            except Exception:
+                tail = self._take(pending, True)
+                if tail:
+                    yield tail
+                raise
+            tail = self._take(pending, True)
+            if tail:
+                yield tail
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    def _coalesce_with_reader(self, stream: Iterable[str]) -> Generator[str, None, None]:
+        pending = _Pending()
+        cond = threading.Condition()
+        # 读取者在子令牌下读取上游，消费者提前关闭时取消子令牌，阻塞中的读取（HTTP 响应等）立即返回
+        token = CancelToken(parent=current_token())
+        reader = threading.Thread(target=contextvars.copy_context().run,
+                                  args=(self._read, stream, token, pending, cond), daemon=True)
+        reader.start()
+        finished = False
+        try:
+            while True:
+                with cond:
+                    wait = self._wait_time(pending)
+                    while wait is None or wait > 0:
+                        cond.wait(wait)
+                        wait = self._wait_time(pending)
+                    final = pending.done
+                    text = self._take(pending, final)
+                    # 读取者可能在等待空间
+                    cond.notify_all()
+                if text:
+                    yield text
+                if final:
+                    finished = True
+                    if pending.error is not None:
+                        raise pending.error
+                    return
+        finally:
+            if not finished:
+                with cond:
+                    pending.closed = True
+                    cond.notify_all()
+                token.cancel()
+            # 上游在读取者线程中关闭（会话在这时保存回复），等它结束后再返回
+            reader.join()
+            token.close()
+
+    def _read(self, stream: Iterable[str], token: CancelToken, pending: _Pending, cond: threading.Condition):
+        items = iter_cancellable(token, stream)
+        try:
+            for chunk in items:
+                if not chunk:
+                    continue
+                with cond:
+                    while pending.size >= self.max_buffer and not pending.closed:
+                        cond.wait()
+                    if pending.closed:
+                        break
+                    pending.add(chunk)
+                    # 只在消费者需要重新计算等待时间时唤醒它
+                    if len(pending.parts) == 1 or pending.size >= self.min_chars:
+                        cond.notify_all()
+        except BaseException as e:
+            with cond:
+                pending.error = e
+        finally:
+            items.close()
+            with cond:
+                pending.done = True
+                cond.notify_all()
+
+    async def acoalesce(self, stream: AsyncIterable[str]) -> AsyncGenerator[str, None]:
+        """合并异步流的数据块，读取者是同一事件循环中的任务"""
+        pending = _Pending()
+        wake = asyncio.Event()
+        space = asyncio.Event()
+        reader = asyncio.ensure_future(self._aread(stream, pending, wake, space))
+        try:
+            while True:
+                wait = self._wait_time(pending)
+                if wait is None or wait > 0:
+                    wake.clear()
+                    try:
+                        await asyncio.wait_for(wake.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                final = pending.done
+                text = self._take(pending, final)
+                space.set()
+                if text:
+                    yield text
+                if final:
+                    if pending.error is not None:
+                        raise pending.error
+                    return
+        finally:
+            if not reader.done():
+                reader.cancel()
+            await asyncio.wait({reader})
+
+    async def _aread(self, stream: AsyncIterable[str], pending: _Pending, wake: asyncio.Event, space: asyncio.Event):
+        iterator = stream.__aiter__()
+        try:
+            async for chunk in iterator:
+                if not chunk:
+                    continue
+                while pending.size >= self.max_buffer:
+                    space.clear()
+                    await space.wait()
+                pending.add(chunk)
+                if len(pending.parts) == 1 or pending.size >= self.min_chars:
+                    wake.set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            pending.error = e
+        finally:
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            pending.done = True
+            wake.set()
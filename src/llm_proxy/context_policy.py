@@ -0,0 +1,188 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional
+from .llm_base import LLMBase, LLMMessage
+from .tokens import MESSAGE_OVERHEAD_TOKENS, estimate_tokens
+from .rate_limiter import Priority, request_priority
+
+logger = logging.getLogger(__name__)
+
+def estimate_message_tokens(msg: LLMMessage) -> int:
+    return estimate_tokens(msg.content) + MESSAGE_OVERHEAD_TOKENS
+
+
+class ContextPolicy:
+    """上下文策略：决定每次请求实际发送会话中的哪些消息
+
+    策略只挑选要发送的消息，不修改 LLMBase.session，完整的历史仍然保留在会话中。
+    默认实现发送全部消息。
+    """
+
+    def select(self, session: List[LLMMessage]) -> List[LLMMessage]:
+        return session
+
+
+class TokenBudgetPolicy(ContextPolicy):
+    """按 token 预算滑动窗口
+
+    会话开头连续的 system 消息（Agent 身份、团队信息）始终保留，
+    其余消息从最新的一条往前取，直到用完 max_tokens 预算。最新的一条消息总会被发送。
+    对话中途追加的 system 消息（工具、身份和团队的更新）移出窗口后也保留，放在开头的消息之后。
+    """
+
+    def __init__(self, max_tokens: int, estimator: Callable[[LLMMessage], int] = estimate_message_tokens):
+        """
+        Args:
+            max_tokens: 每次请求的提示 token 预算（估算值）
+            estimator: 单条消息的 token 估算函数
+        """
+        self.max_tokens = max_tokens
+        self.estimator = estimator
+
+    def select(self, session: List[LLMMessage]) -> List[LLMMessage]:
+        pinned = self._pinned_count(session)
+        start = self._window_start(session, pinned, self.max_tokens)
+        if pinned == 0 and start == 0:
+            return session
+        return session[:pinned] + self._updates(session, pinned, start) + session[start:]
+
+    @staticmethod
+    def _updates(session: List[LLMMessage], pinned: int, start: int) -> List[LLMMessage]:
+        """移出窗口的 system 消息"""
+        return [msg for msg in session[pinned:start] if msg.role == "system"]
+
+    def _pinned_count(self, session: List[LLMMessage]) -> int:
+        count = 0
+        for msg in session:
+            if msg.role != "system":
+                break
+            count += 1
+        return count
+
+    def _window_start(self, session: List[LLMMessage], pinned: int, budget: int) -> int:
+        """返回窗口起点：session[start:] 放得进预算，且 start >= pinned
+
+        所有 system 消息无论是否在窗口中都会发送，预先从预算中扣除。
+        """
+        budget -= sum(self.estimator(msg) for msg in session[:pinned])
+        budget -= sum(self.estimator(msg) for msg in session[pinned:] if msg.role == "system")
+        start = len(session)
+        while start > pinned:
+            msg = session[start - 1]
+            cost = 0 if msg.role == "system" else self.estimator(msg)
+            if cost > budget and start < len(session):
+                break
+            budget -= cost
+            start -= 1
+        # 不以孤立的 assistant 回复开头
+        if start > pinned and start < len(session) - 1 and session[start].role == "assistant":
+            start += 1
+        return start
+
+
+class SummarizingPolicy(TokenBudgetPolicy):
+    """在滑动窗口的基础上，把移出窗口的旧消息压缩成一条摘要
+
+    摘要由后台线程调用 LLM 生成，不阻塞当前请求；生成完成前，移出窗口的消息暂时不发送。
+    每次摘要都在上一份摘要的基础上合并新移出的消息。摘要以 system 消息的形式放在固定消息之后。
+
+    策略对象记录摘要状态，每个 LLMBase 应使用单独的实例。
+    """
+
+    SUMMARY_INSTRUCTION = (
+        "Summarize the following conversation into a compact note that keeps facts, decisions, "
+        "names, numbers and open questions. Reply with the summary only."
+    )
+
+    def __init__(self, max_tokens: int, llm: LLMBase, model: str, summary_tokens: int = 512,
+                 estimator: Callable[[LLMMessage], int] = estimate_message_tokens):
+        """
+        Args:
+            max_tokens: 每次请求的提示 token 预算（估算值），包括摘要
+            llm: 用于生成摘要的 LLM，可以是更便宜的模型，不使用其会话
+            model: 生成摘要使用的模型
+            summary_tokens: 摘要的长度上限（估算值），超出部分会被截断
+        """
+        super().__init__(max_tokens, estimator)
+        self.llm = llm
+        self.model = model
+        self.summary_tokens = summary_tokens
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._session: Optional[List[LLMMessage]] = None
+        self._summary: Optional[LLMMessage] = None
+        self._covered = 0  # 摘要覆盖的消息范围为 session[pinned:_covered]
+        self._pending: Optional[Future] = None
+
+    @property
+    def summary(self) -> Optional[str]:
+        return None if self._summary is None else self._summary.content
+
+    def select(self, session: List[LLMMessage]) -> List[LLMMessage]:
+        pinned = self._pinned_count(session)
+        with self._lock:
+            if session is not self._session or len(session) < self._covered:
+                # 会话被清空或替换，之前的摘要失效
+                self._session = session
+                self._summary = None
+                self._covered = pinned
+            summary = self._summary
+
+        budget = self.max_tokens
+        if summary is not None:
+            budget -= self.estimator(summary)
+        start = self._window_start(session, pinned, budget)
+        if start > self._covered:
+            self._schedule(session, pinned, start)
+
+        selected = session[:pinned]
+        selected.extend(self._updates(session, pinned, start))
+        if summary is not None:
+            selected.append(summary)
+        selected.extend(session[start:])
+        return selected
+
+    def wait(self, timeout: Optional[float] = None):
+        """等待正在生成的摘要完成"""
+        pending = self._pending
+        if pending is not None:
+            pending.result(timeout)
+
+    def _schedule(self, session: List[LLMMessage], pinned: int, end: int):
+        with self._lock:
+            if self._pending is not None:
+                return
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary")
+            # 中途追加的 system 消息原样保留，不计入摘要
+            dropped = [msg for msg in session[max(self._covered, pinned):end] if msg.role != "system"]
+            previous = self.summary
+            self._pending = self._pool.submit(self._summarize, session, previous, dropped, end)
+
+    def _summarize(self, session: List[LLMMessage], previous: Optional[str], dropped: List[LLMMessage], end: int):
+        try:
+            transcript = "\n".join(f"{msg.role}: {msg.content}" for msg in dropped)
+            if previous:
+                transcript = f"Earlier summary:\n{previous}\n\nNew messages:\n{transcript}"
+            prompt = [
+                LLMMessage(role="system", content=self.SUMMARY_INSTRUCTION),
+                LLMMessage(role="user", content=transcript),
+            ]
+            # 摘要是后台任务，共享限流器时排在交互请求之后
+            with request_priority(Priority.BACKGROUND):
+                text = "".join(self.llm.chat(prompt, self.model, 0))
+            tokens = estimate_tokens(text)
+            if tokens > self.summary_tokens:
+                text = text[:len(text) * self.summary_tokens // tokens]
+            summary = LLMMessage(role="system", content=f"Summary of the earlier conversation:\n{text}")
+            with self._lock:
+                if session is self._session:
+                    self._summary = summary
+                    self._covered = end
+        except Exception:
+            # 摘要失败时保留旧摘要，下次移出窗口时重试
+            logger.exception("failed to summarize conversation")
+        finally:
+            with self._lock:
+                self._pending = None
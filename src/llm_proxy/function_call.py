@@ -1,117 +1,325 @@
 from src.llm_proxy.tool import BaseTool
 import re
-from typing import Dict, Type, List, Generator, Any
+from src.llm_proxy.async_utils import iterate_in_executor
+from src.llm_proxy.tag_scanner import TagScanner, TagDialect, FUNCTION_CALL_TAG
+from src.llm_proxy.tool_executor import ToolExecutor, ToolCallResult
+from src.llm_proxy.tool_cache import ToolCache
+from src.llm_proxy.tool_calls import ToolCall, NativeScanner, parse_arguments, tool_spec
+from src.llm_proxy.tool_workers import run_tool
+from src.llm_proxy.cancellation import on_cancel, check_cancelled
+from src.llm_proxy.tokens import estimate_tokens
+from src.llm_proxy.instrumentation import Span, start_span, current_span, call_in_span, iter_in_span, aiter_in_span
+from collections import deque
+from typing import Dict, Type, List, Generator, AsyncGenerator, Any, Sequence
+import asyncio
+import contextvars
+import copy
+import functools
 import json
 
+def _close(stream: Any):
+    close = getattr(stream, "close", None)
+    if close is not None:
+        close()
+
 class FunctionCall:
     """函数调用管理器，用于处理工具调用和流式响应"""
     
     tools: Dict[str, BaseTool]
 
-    def __init__(self):
+    def __init__(self, dialects: Sequence[TagDialect] = (FUNCTION_CALL_TAG,), executor: ToolExecutor = None,
+                 cache: ToolCache = None):
+        """
+        Args:
+            dialects: 识别的函数调用定界符，第一种会写入系统提示
+            executor: 并发执行函数调用的线程池；为 None 时在读取流的线程上依次执行
+            cache: 工具结果缓存，工具自身设置了 cache 时优先使用工具的
+        """
         self.tools: Dict[str, BaseTool] = {}
+        self.dialects = list(dialects)
+        self.executor = executor
+        self.cache = cache
         self.func_regex = re.compile(r"<function_call>(.*?)</function_call>")
-        self.buffer = ""
         self.executed_calls = set()  # 记录已执行的函数调用
+        self._system_prompt: str = None  # 工具变化后置为 None，下次获取时重新生成
+        self._tool_specs: List[Dict[str, Any]] = None  # 原生模式的 tools 参数，同样按需生成
+
+    def fork(self) -> "FunctionCall":
+        """返回共享工具、执行器和缓存的新实例
+
+        executed_calls / executed_tools 记录的是最近一个流，同时处理多个流（例如批量推理）时
+        每个流使用自己的实例，记录不会相互覆盖。
+        """
+        forked = copy.copy(self)
+        forked.executed_calls = set()
+        forked.executed_tools = []
+        return forked
 
     def add_tool(self, tool: BaseTool) -> None:
         """添加工具到管理器"""
         self.tools[tool.name] = tool
+        self._system_prompt = None
+        self._tool_specs = None
+
+    def remove_tool(self, tool_name: str) -> bool:
+        """移除工具，返回工具是否存在"""
+        if self.tools.pop(tool_name, None) is None:
+            return False
+        self._system_prompt = None
+        self._tool_specs = None
+        return True
 
     def get_system_prompt(self) -> str:
-        """获取包含所有工具信息的系统提示"""
+        """获取包含所有工具信息的系统提示，工具不变时直接返回上次的结果"""
+        if self._system_prompt is None:
+            self._system_prompt = self._render_system_prompt()
+        return self._system_prompt
+
+    def get_tool_specs(self) -> List[Dict[str, Any]]:
+        """原生工具调用模式下请求的 tools 参数，工具不变时直接返回上次的结果"""
+        if self._tool_specs is None:
+            self._tool_specs = [tool_spec(tool) for tool in self.tools.values()]
+        return self._tool_specs
+
+    def tool_prompt_tokens(self) -> Dict[str, int]:
+        """每个请求中工具说明的估算 token 数
+
+        Returns:
+            {"text": 系统提示中的工具说明, "native": tools 参数的 JSON, "saved": 两者之差}；
+            服务端仍会把 tools 参数计入提示 token，这里只比较客户端发送的内容
+        """
+        text = estimate_tokens(self.get_system_prompt())
+        native = estimate_tokens(json.dumps(self.get_tool_specs(), ensure_ascii=False)) if self.tools else 0
+        return {"text": text, "native": native, "saved": text - native}
+
+    def _scanner(self, native: bool):
+        return NativeScanner() if native else TagScanner(self.dialects)
+
+    def _render_system_prompt(self) -> str:
         if not self.tools:
             return ""
         
         prompts = ["You can use the following tools to help user:"]
         for tool in self.tools.values():
             prompts.append(f"{tool}")
-        prompts.append(
+        prompts.append(self._call_format())
+
+        return "\n".join(prompts)
+
+    def _call_format(self) -> str:
+        dialect = self.dialects[0]
+        return (
             "You can use the following format to call tools:\n"
-            "<function_call>tool_name(parameter_JSON)</function_call>\n"
+            f"{dialect.start}tool_name(parameter_JSON){dialect.end}\n"
             "The parameter_JSON must match the input pattern of the tool.\n"
             "You can insert these function calls in the middle of your response, you will get the result in the next response."
         )
 
+    def get_update_prompt(self, added: Sequence[BaseTool], removed: Sequence[str], with_format: bool = False) -> str:
+        """工具变化的说明，对话开始后追加在会话末尾，不改写已经发送过的系统提示
+
+        Args:
+            added: 新增或被替换的工具
+            removed: 移除的工具名
+            with_format: 是否附带调用格式，之前的提示中没有任何工具时需要
+        """
+        prompts = []
+        if added:
+            prompts.append("You can now also use the following tools:")
+            prompts.extend(f"{tool}" for tool in added)
+            if with_format:
+                prompts.append(self._call_format())
+        if removed:
+            prompts.append(f"The following tools are no longer available, do not call them: {', '.join(removed)}")
         return "\n".join(prompts)
     
-    def handle_stream(self, stream: Generator[str, None, None]) -> Generator[str, None, None]:
+    def handle_stream(self, stream: Generator[str, None, None], native: bool = False) -> Generator[str, None, None]:
         """处理流式响应，自动执行并替换检测到的函数调用
         
         Args:
             stream: 原始响应流
+            native: 流来自原生工具调用模式（tools 参数），调用以 ToolCall 出现，不扫描文本中的标签
             
         Yields:
             处理后的响应文本，包含函数调用结果和最终汇总
         """
-        self.buffer = ""
+        span = start_span("function_call.stream")
+        if span is None:
+            yield from self._handle_stream(stream, native)
+        else:
+            yield from iter_in_span(span, self._handle_stream(stream, native))
+
+    def _handle_stream(self, stream: Generator[str, None, None], native: bool = False) -> Generator[str, None, None]:
         self.executed_calls = set()
         self.executed_tools = []  # 存储工具调用详情
+        if self.executor is not None:
+            yield from self._handle_stream_concurrent(stream, native)
+            return
+        scanner = self._scanner(native)
         
-        start_tag = '<function_call>'
-        end_tag = '</function_call>'
-        
-        for chunk in stream:
-            self.buffer += chunk
-            
-            while True:
-                # 查找完整标签开始位置
-                start_idx = self.buffer.find(start_tag)
-                if start_idx != -1:
-                    # 查找对应结束标签
-                    end_idx = self.buffer.find(end_tag, start_idx + len(start_tag))
-                    if end_idx != -1:
-                        # 提取并执行函数调用
-                        content = self.buffer[start_idx+len(start_tag):end_idx]
-                        result_gen = self._execute_function_call(content)
-                        
-                        # 拼接并返回处理结果
-                        if start_idx > 0:
-                            yield self.buffer[:start_idx]  # 标签前内容
-                        
-                        # 处理函数调用结果
-                        if isinstance(result_gen, Generator):
-                            result_chunks = []
-                            for chunk in result_gen:
-                                result_chunks.append(chunk)
-                                yield chunk
-                            result = ''.join(result_chunks)
+        try:
+            for chunk in stream:
+                for kind, value in scanner.feed(chunk):
+                    if kind == 'text':
+                        yield value
+                    else:
+                        yield from self._call_results(value)
+        finally:
+            # 调用方提前关闭时立即关闭上游的流，不等待垃圾回收
+            _close(stream)
+        # 流结束时输出被截断的标签前缀或未闭合的调用
+        for _, value in scanner.flush():
+            yield value
+
+    def _handle_stream_concurrent(self, stream: Generator[str, None, None], native: bool = False) -> Generator[str, None, None]:
+        """并发模式：函数调用解析后立即提交到线程池，继续读取 LLM 流
+
+        输出严格按文档顺序：尚未完成的调用之后的文本和结果会先排队，
+        每读到一块 LLM 输出就不阻塞地推进一次队列，流结束后再依次等待剩余调用。
+        """
+        scanner = self._scanner(native)
+        # 按文档顺序排队的输出：str 为文本，ToolCallResult 为执行中的调用
+        pending = deque()
+        submitted: List[ToolCallResult] = []
+        # 对话被取消时放弃所有调用，阻塞在结果上的读取立即返回
+        detach = on_cancel(lambda: self._cancel_results(submitted))
+
+        try:
+            for chunk in stream:
+                for kind, value in scanner.feed(chunk):
+                    if kind == 'text':
+                        if pending:
+                            pending.append(value)
                         else:
-                            result = result_gen
-                            yield result
-                        
-                        # 重置buffer为剩余内容
-                        self.buffer = self.buffer[end_idx+len(end_tag):]
-                        continue  # 继续处理剩余内容
+                            yield value
                     else:
-                        # 只有开始标签，保留标签开始后的内容
-                        if start_idx > 0:
-                            yield self.buffer[:start_idx]
-                            self.buffer = self.buffer[start_idx:]
+                        result = self._submit_function_call(value)
+                        submitted.append(result)
+                        pending.append(result)
+                # 不阻塞地输出队首已就绪的内容
+                while pending:
+                    head = pending[0]
+                    if isinstance(head, str):
+                        yield pending.popleft()
+                        continue
+                    chunks, done = head.poll()
+                    yield from chunks
+                    if not done:
                         break
+                    pending.popleft()
+
+            for _, value in scanner.flush():
+                pending.append(value)
+            while pending:
+                head = pending.popleft()
+                if isinstance(head, str):
+                    yield head
                 else:
-                    # 检查是否有可能形成开始标签的部分匹配
-                    max_prefix = 0
-                    max_check = min(len(self.buffer), len(start_tag))
-                    for k in range(1, max_check+1):
-                        if self.buffer[-k:] == start_tag[:k]:
-                            max_prefix = k
-                    
-                    if max_prefix > 0:
-                        # 保留可能形成标签头的内容
-                        output = self.buffer[:-max_prefix]
-                        if output:
-                            yield output
-                        self.buffer = self.buffer[-max_prefix:]
+                    yield from head
+        finally:
+            detach()
+            # 提前关闭或出错时，仍在执行的调用不再需要
+            self._cancel_results(submitted)
+            _close(stream)
+
+    @staticmethod
+    def _cancel_results(results: List[ToolCallResult]):
+        for result in list(results):
+            if not result.done:
+                result.cancel()
+
+    def _submit_function_call(self, function_str: str) -> ToolCallResult:
+        """把函数调用提交到线程池，工具的并发上限和超时取自工具的类属性"""
+        try:
+            tool_name, _ = self._parse_function_call(function_str)
+        except Exception:
+            tool_name = ""
+        tool = self.tools.get(tool_name)
+        # 线程池中的线程没有当前 span 和取消令牌，在复制的上下文中执行，并显式传入父 span
+        parent = current_span()
+        context = contextvars.copy_context()
+        return self.executor.submit(
+            tool_name,
+            lambda: context.run(self._execute_function_call, function_str, parent),
+            max_concurrency=getattr(tool, 'max_concurrency', None),
+            timeout=getattr(tool, 'timeout', None)
+        )
+
+    def _call_results(self, function_str: str) -> Generator[str, None, None]:
+        """执行函数调用并逐块产出结果"""
+        result_gen = self._execute_function_call(function_str)
+        if isinstance(result_gen, Generator):
+            yield from result_gen
+        else:
+            yield result_gen
+
+    async def ahandle_stream(self, stream: AsyncGenerator[str, None], native: bool = False) -> AsyncGenerator[str, None]:
+        """handle_stream 的异步版本
+
+        工具通过 BaseTool._arun 执行：异步工具直接 await，同步工具在线程池中运行，
+        同步生成器结果也在线程池中逐块读取，不会阻塞事件循环。
+
+        Args:
+            stream: 原始异步响应流
+            native: 同 handle_stream
+
+        Yields:
+            处理后的响应文本
+        """
+        span = start_span("function_call.stream")
+        stream = self._ahandle_stream(stream, native)
+        if span is not None:
+            stream = aiter_in_span(span, stream)
+        async for chunk in stream:
+            yield chunk
+
+    async def _ahandle_stream(self, stream: AsyncGenerator[str, None], native: bool = False) -> AsyncGenerator[str, None]:
+        self.executed_calls = set()
+        self.executed_tools = []  # 存储工具调用详情
+        scanner = self._scanner(native)
+
+        try:
+            async for chunk in stream:
+                for kind, value in scanner.feed(chunk):
+                    if kind == 'text':
+                        yield value
                     else:
-                        # 直接返回所有内容
-                        if self.buffer:
-                            yield self.buffer
-                            self.buffer = ""
-                    break
+                        async for result_chunk in self._acall_results(value):
+                            yield result_chunk
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        for _, value in scanner.flush():
+            yield value
+
+    async def _acall_results(self, function_str: str) -> AsyncGenerator[str, None]:
+        """_call_results 的异步版本"""
+        result_gen = await self._aexecute_function_call(function_str)
+        if isinstance(result_gen, AsyncGenerator):
+            async for result_chunk in result_gen:
+                yield result_chunk
+        elif isinstance(result_gen, Generator):
+            async for result_chunk in iterate_in_executor(result_gen):
+                yield result_chunk
+        else:
+            yield result_gen
 
     def _parse_function_call(self, call_str: str) -> tuple[str, str]:
-        """解析函数调用字符串"""
+        """解析函数调用字符串
+
+        支持 tool_name(parameter_JSON) 和 {"name": ..., "arguments": {...}} 两种写法
+        """
+        if isinstance(call_str, ToolCall):
+            return call_str.name, call_str.arguments
+        call_str = call_str.strip()
+        if call_str.startswith("{"):
+            call = json.loads(call_str)
+            arguments = call.get("arguments", {})
+            if not isinstance(arguments, str):
+                arguments = json.dumps(arguments, ensure_ascii=False)
+            return call["name"], arguments
+
         paren_idx = call_str.find("(")
         if paren_idx == -1 or not call_str.endswith(")"):
             raise ValueError("无效的函数调用格式")
@@ -120,44 +328,142 @@ class FunctionCall:
         args_json = call_str[paren_idx+1:-1].strip()
         return tool_name, args_json
     
-    def _execute_function_call(self, function_str: str) -> Generator[str, None, None] | str:
+    def _resolve_function_call(self, function_str: str) -> tuple[str, BaseTool, Dict[str, Any], str] | str:
+        """解析函数调用并查找工具
+
+        Returns:
+            (工具名, 工具, 参数, 参数JSON)；出错时返回错误信息字符串
+        """
+        # 解析工具名称和参数
+        tool_name, params_str = self._parse_function_call(function_str)
+        
+        if tool_name not in self.tools:
+            return f"[Function Call Error: Tool '{tool_name}' not found]"
+        
+        tool = self.tools[tool_name]
+        if isinstance(function_str, ToolCall):
+            # 原生调用的参数按 argSchema 校验一次，格式错误时尝试修复
+            try:
+                params = parse_arguments(tool, params_str)
+            except Exception as e:
+                return f"[Function Call Error: Parameter validation failed: {str(e)}]"
+            return tool_name, tool, params, params_str
+
+        try:
+            params = json.loads(params_str)
+        except Exception as e:
+            return f"[Function Call Error: Parameter parsing failed: {str(e)}]"
+        
+        return tool_name, tool, params, params_str
+
+    def _record_function_call(self, function_str: str, tool_name: str, params_str: str, result: Any) -> Any:
+        """记录工具调用，并把非流式结果包装成结果格式"""
+        streaming = isinstance(result, (Generator, AsyncGenerator))
+        self.executed_tools.append({
+            'tool': tool_name,
+            'params': params_str,
+            'result': str(result) if not streaming else "streaming..."
+        })
+        
+        # 如果是生成器，直接返回
+        if streaming:
+            return result
+        
+        # 如果是字符串，包装成结果格式
+        return f"[Function Call: {function_str}, Result: {result}]"
+    
+    def _get_cache(self, tool: BaseTool) -> ToolCache | None:
+        if not tool.cacheable:
+            return None
+        return tool.cache if tool.cache is not None else self.cache
+
+    def _invoke_tool(self, tool: BaseTool, params: Dict[str, Any]) -> Any:
+        """执行工具，启用缓存时相同参数的调用复用结果；按 tool.execution 在线程池或工作进程中执行"""
+        cache = self._get_cache(tool)
+        if tool.execution != "inline":
+            run = functools.partial(run_tool, tool, params)
+            return run() if cache is None else cache.call(tool, params, run)
+        if cache is None:
+            return tool._run(**params)
+        return cache.call(tool, params)
+
+    async def _ainvoke_tool(self, tool: BaseTool, params: Dict[str, Any]) -> Any:
+        """_invoke_tool 的异步版本"""
+        if tool.execution != "inline":
+            # 等待工作者时不阻塞事件循环，生成器结果由调用方在线程池中逐块读取
+            loop = asyncio.get_running_loop()
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(None, context.run, self._invoke_tool, tool, params)
+        cache = self._get_cache(tool)
+        if cache is None:
+            return await tool._arun(**params)
+        return await cache.acall(tool, params)
+
+    @staticmethod
+    def _end_tool_span(span: Span | None, result: Any) -> Any:
+        """结束 tool.call span；生成器结果在读完时结束，读取期间嵌套的 span 以它为父 span"""
+        if span is None:
+            return result
+        if isinstance(result, Generator):
+            return iter_in_span(span, result)
+        if isinstance(result, AsyncGenerator):
+            return aiter_in_span(span, result)
+        span.end(result if result.startswith("[Function Call Error") else None)
+        return result
+
+    def _execute_function_call(self, function_str: str, parent: Span = None) -> Generator[str, None, None] | str:
         """执行函数调用并返回结果
         
         Args:
             function_str: 函数调用字符串，格式为"tool_name(parameter_JSON)"
+            parent: tool.call span 的父 span，默认为当前 span
             
         Returns:
             如果是流式输出，返回生成器；否则返回字符串结果
         """
+        span = start_span("tool.call", parent=parent)
         try:
-            # 解析工具名称和参数
-            tool_name, params_str = self._parse_function_call(function_str)
-            
-            if tool_name not in self.tools:
-                return f"[Function Call Error: Tool '{tool_name}' not found]"
-            
-            try:
-                params = json.loads(params_str)
-            except Exception as e:
-                return f"[Function Call Error: Parameter parsing failed: {str(e)}]"
+            resolved = self._resolve_function_call(function_str)
+            if isinstance(resolved, str):
+                return self._end_tool_span(span, resolved)
+            tool_name, tool, params, params_str = resolved
             
             # 执行工具调用
-            tool = self.tools[tool_name]
-            result = tool._run(**params)
-            
-            # 记录工具调用
-            self.executed_tools.append({
-                'tool': tool_name,
-                'params': params_str,
-                'result': str(result) if not isinstance(result, Generator) else "streaming..."
-            })
-            
-            # 如果是生成器，直接返回
-            if isinstance(result, Generator):
-                return result
-            
-            # 如果是字符串，包装成结果格式
-            return f"[Function Call: {function_str}, Result: {result}]"
+            if span is None:
+                result = self._invoke_tool(tool, params)
+            else:
+                span.set(tool=tool_name)
+                result = call_in_span(span, self._invoke_tool, tool, params)
+            return self._end_tool_span(span, self._record_function_call(function_str, tool_name, params_str, result))
         
         except Exception as e:
-            return f"[Function Call Error: {str(e)}]"
\ No newline at end of file
+            result = self._end_tool_span(span, f"[Function Call Error: {str(e)}]")
+            # 对话被取消导致的失败不作为工具结果输出
+            check_cancelled()
+            return result
+
+    async def _aexecute_function_call(self, function_str: str) -> AsyncGenerator[str, None] | Generator[str, None, None] | str:
+        """_execute_function_call 的异步版本，通过 BaseTool._arun 执行工具"""
+        span = start_span("tool.call")
+        try:
+            resolved = self._resolve_function_call(function_str)
+            if isinstance(resolved, str):
+                return self._end_tool_span(span, resolved)
+            tool_name, tool, params, params_str = resolved
+
+            if span is None:
+                result = await self._ainvoke_tool(tool, params)
+            else:
+                span.set(tool=tool_name)
+                token = span.activate()
+                try:
+                    result = await self._ainvoke_tool(tool, params)
+                finally:
+                    Span.deactivate(token)
+            return self._end_tool_span(span, self._record_function_call(function_str, tool_name, params_str, result))
+
+        except Exception as e:
+            result = self._end_tool_span(span, f"[Function Call Error: {str(e)}]")
+            # 对话被取消导致的失败不作为工具结果输出
+            check_cancelled()
+            return result
@@ -0,0 +1,339 @@
+"""埋点：请求、流处理和工具调用的 span 事件
+
+注册钩子（add_hook）之后，各处会产生带嵌套 span ID 的事件：
+- agent.chat：Agent.chat / achat
+- llm.chat：LLMBase.chat_with_context / achat_with_context
+- llm.request：OpenAILLM 的一次 HTTP 请求，结束时带 connect_s、ttft_s、chunks、tokens，
+  服务端返回 usage 时还带 prompt_tokens、cached_tokens、completion_tokens
+- function_call.stream：FunctionCall.handle_stream / ahandle_stream
+- tool.call：一次工具调用，生成器结果在读完时结束
+- team.ask：AskTeamMemberTool 把问题转给队友
+
+同一个调用链（包括团队成员之间的转问）中的 span 共享 trace_id。
+没有注册钩子时 start_span 直接返回 None，调用方不做任何额外工作。
+"""
+import contextvars
+import itertools
+import logging
+import threading
+import time
+from typing import Any, AsyncGenerator, AsyncIterable, Callable, Dict, Generator, Iterable, List, NamedTuple, Optional, Tuple, Union
+from .tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class Event(NamedTuple):
+    kind: str  # "start"、"end" 或 "event"
+    name: str  # span 名；kind 为 "event" 时是事件名
+    span_id: int
+    parent_id: Optional[int]
+    trace_id: int
+    time: float  # time.perf_counter()
+    attrs: Dict[str, Any]  # 结束事件中包含 duration 和 span 的全部属性
+
+
+Hook = Callable[[Event], None]
+
+# 已注册的钩子，为空时埋点代码全部跳过
+_hooks: List[Hook] = []
+_ids = itertools.count(1)
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("fastagent_span", default=None)
+
+
+def add_hook(hook: Hook) -> None:
+    """注册钩子，钩子在产生事件的线程上同步调用，应尽快返回"""
+    _hooks.append(hook)
+
+
+def remove_hook(hook: Hook) -> None:
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def enabled() -> bool:
+    return bool(_hooks)
+
+
+def current_span() -> Optional["Span"]:
+    return _current.get()
+
+
+def _emit(event: Event):
+    for hook in list(_hooks):
+        try:
+            hook(event)
+        except Exception:
+            # 钩子出错不影响请求本身
+            logger.exception("instrumentation hook failed")
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "trace_id", "start", "attrs", "_ended")
+
+    def __init__(self, name: str, parent: Optional["Span"], attrs: Dict[str, Any]):
+        self.name = name
+        self.span_id = next(_ids)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.trace_id = parent.trace_id if parent is not None else self.span_id
+        self.start = time.perf_counter()
+        self.attrs = attrs
+        self._ended = False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def event(self, name: str, **attrs):
+        """产生一个属于此 span 的点事件"""
+        _emit(Event("event", name, self.span_id, self.parent_id, self.trace_id, time.perf_counter(), attrs))
+
+    def end(self, error: Union[BaseException, str] = None, **attrs):
+        """结束 span，重复调用只生效一次；error 可以是异常或错误描述"""
+        if self._ended:
+            return
+        self._ended = True
+        now = time.perf_counter()
+        self.attrs.update(attrs)
+        self.attrs["duration"] = now - self.start
+        if error is not None:
+            self.attrs["error"] = error if isinstance(error, str) else type(error).__name__
+        _emit(Event("end", self.name, self.span_id, self.parent_id, self.trace_id, now, self.attrs))
+
+    def activate(self) -> contextvars.Token:
+        """把此 span 设为当前 span，返回用于恢复的 token"""
+        return _current.set(self)
+
+    @staticmethod
+    def deactivate(token: contextvars.Token):
+        _current.reset(token)
+
+
+def start_span(name: str, parent: Optional[Span] = None, **attrs) -> Optional[Span]:
+    """开始一个 span，父 span 默认为当前 span；没有注册钩子时返回 None"""
+    if not _hooks:
+        return None
+    span = Span(name, parent if parent is not None else _current.get(), attrs)
+    _emit(Event("start", name, span.span_id, span.parent_id, span.trace_id, span.start, dict(attrs)))
+    return span
+
+
+def call_in_span(span: Span, func: Callable[..., Any], *args, **kwargs) -> Any:
+    """以 span 为当前 span 调用 func，调用出错时结束 span"""
+    token = _current.set(span)
+    try:
+        return func(*args, **kwargs)
+    except BaseException as e:
+        span.end(e)
+        raise
+    finally:
+        _current.reset(token)
+
+
+def observe_chunk(span: Span, chunk: str):
+    """iter_in_span 的 on_item：记录首个数据块的时间、数据块数和估算的 token 数"""
+    attrs = span.attrs
+    if "ttft_s" not in attrs:
+        attrs["ttft_s"] = time.perf_counter() - span.start
+        attrs["chunks"] = 0
+        attrs["tokens"] = 0
+    attrs["chunks"] += 1
+    attrs["tokens"] += estimate_tokens(chunk)
+
+
+def iter_in_span(span: Span, iterable: Iterable[Any], on_item: Callable[[Span, Any], None] = None) -> Generator[Any, None, None]:
+    """逐项读取 iterable，读取期间 span 是当前 span，读完或出错时结束 span
+
+    生成器在调用方的上下文中运行，因此只在每次取值时切换当前 span，不影响调用方。
+    """
+    iterator = iter(iterable)
+    try:
+        while True:
+            token = _current.set(span)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                _current.reset(token)
+            if on_item is not None:
+                on_item(span, item)
+            yield item
+    except GeneratorExit:
+        span.end(cancelled=True)
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+        raise
+    except BaseException as e:
+        span.end(e)
+        raise
+    span.end()
+
+
+async def aiter_in_span(span: Span, iterable: AsyncIterable[Any], on_item: Callable[[Span, Any], None] = None) -> AsyncGenerator[Any, None]:
+    """iter_in_span 的异步版本"""
+    iterator = iterable.__aiter__()
+    try:
+        while True:
+            token = _current.set(span)
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                _current.reset(token)
+            if on_item is not None:
+                on_item(span, item)
+            yield item
+    except GeneratorExit:
+        span.end(cancelled=True)
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+        raise
+    except BaseException as e:
+        span.end(e)
+        raise
+    span.end()
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{key}="{_escape(value)}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsCollector:
+    """内置的指标汇总钩子，以 Prometheus 文本格式导出
+
+    用法：
+        metrics = MetricsCollector()
+        add_hook(metrics)
+        ...
+        print(metrics.export())
+    """
+
+    HELP = {
+        "fastagent_span_duration_seconds": ("histogram", "Duration of instrumented spans"),
+        "fastagent_llm_requests_total": ("counter", "LLM HTTP requests by model and status"),
+        "fastagent_llm_connect_seconds": ("histogram", "Time until response headers were received"),
+        "fastagent_llm_ttft_seconds": ("histogram", "Time to first streamed token"),
+        "fastagent_llm_output_tokens_total": ("counter", "Estimated streamed output tokens by model"),
+        "fastagent_llm_prompt_tokens_total": ("counter", "Server-reported prompt tokens by model and prefix cache hit/miss"),
+        "fastagent_tool_calls_total": ("counter", "Tool calls by tool and status"),
+        "fastagent_tool_duration_seconds": ("histogram", "Tool call duration including streamed results"),
+        "fastagent_agent_output_tokens_total": ("counter", "Estimated output tokens by agent"),
+        "fastagent_agent_chat_seconds_total": ("counter", "Time spent in Agent.chat by agent"),
+        "fastagent_team_asks_total": ("counter", "Questions forwarded to team members"),
+    }
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], _Histogram] = {}
+
+    def __call__(self, event: Event):
+        if event.kind != "end":
+            return
+        attrs = event.attrs
+        status = "error" if "error" in attrs else "ok"
+        with self._lock:
+            self._observe("fastagent_span_duration_seconds", (("span", event.name),), attrs["duration"])
+            if event.name == "llm.request":
+                model = (("model", attrs.get("model", "")),)
+                self._inc("fastagent_llm_requests_total", model + (("status", status),))
+                if "connect_s" in attrs:
+                    self._observe("fastagent_llm_connect_seconds", model, attrs["connect_s"])
+                if "ttft_s" in attrs:
+                    self._observe("fastagent_llm_ttft_seconds", model, attrs["ttft_s"])
+                self._inc("fastagent_llm_output_tokens_total", model, attrs.get("tokens", 0))
+                if "prompt_tokens" in attrs:
+                    cached = attrs.get("cached_tokens", 0)
+                    self._inc("fastagent_llm_prompt_tokens_total", model + (("cache", "hit"),), cached)
+                    self._inc("fastagent_llm_prompt_tokens_total", model + (("cache", "miss"),), attrs["prompt_tokens"] - cached)
+            elif event.name == "tool.call":
+                tool = (("tool", attrs.get("tool", "")),)
+                self._inc("fastagent_tool_calls_total", tool + (("status", status),))
+                self._observe("fastagent_tool_duration_seconds", tool, attrs["duration"])
+            elif event.name == "agent.chat":
+                agent = (("agent", attrs.get("agent", "")),)
+                self._inc("fastagent_agent_output_tokens_total", agent, attrs.get("tokens", 0))
+                self._inc("fastagent_agent_chat_seconds_total", agent, attrs["duration"])
+            elif event.name == "team.ask":
+                self._inc("fastagent_team_asks_total", (("member", attrs.get("member", "")),))
+
+    def _inc(self, name: str, labels: Tuple[Tuple[str, str], ...], value: float = 1):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def _observe(self, name: str, labels: Tuple[Tuple[str, str], ...], value: float):
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = _Histogram(self.buckets)
+        histogram.observe(value)
+
+    def export(self) -> str:
+        """Prometheus 文本格式"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            histograms = [(key, list(h.counts), h.sum, h.count) for key, h in histograms]
+
+        lines: List[str] = []
+        described = set()
+
+        def describe(name: str):
+            if name not in described:
+                described.add(name)
+                kind, text = self.HELP.get(name, ("untyped", name))
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            describe(name)
+            lines.append(f"{name}{_labels(labels)} {value:g}")
+        for (name, labels), counts, total, count in histograms:
+            describe(name)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{bound:g}"'
+                lines.append(f"{name}_bucket{_labels(labels, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{name}_bucket{_labels(labels, le)} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {total:g}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
@@ -1,18 +1,56 @@
-from typing import Generator, Dict, Any,List,Union
+from typing import Generator, AsyncGenerator, Dict, Any,Iterable,List,Union,TYPE_CHECKING
 import json
+import functools
 from abc import ABC, abstractmethod
+from .instrumentation import start_span, call_in_span, iter_in_span, aiter_in_span
+
+if TYPE_CHECKING:
+    from .batch import BatchRun
+
+try:
+    import orjson
+    _dumps = orjson.dumps
+except ImportError:
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
 
 class LLMMessage:
-    role:str
-    content:str
+    # 使用 __slots__ 减少长会话的内存占用；_json 缓存编码后的 JSON，每条消息只编码一次
+    __slots__ = ("_role", "_content", "_json")
 
     def __init__(self,role:str,content:str):
-        self.role = role
-        self.content = content
+        self._role = role
+        self._content = content
+        self._json = None
+
+    @property
+    def role(self) -> str:
+        return self._role
+
+    @role.setter
+    def role(self, value: str):
+        self._role = value
+        self._json = None
+
+    @property
+    def content(self) -> str:
+        return self._content
+
+    @content.setter
+    def content(self, value: str):
+        self._content = value
+        self._json = None
 
     def to_dict(self):
-        return {'role': self.role, 'content':self.content}
+        return {'role': self._role, 'content':self._content}
 
+    def to_json(self) -> bytes:
+        """编码后的 JSON 字节，首次调用后缓存，修改 role 或 content 时失效"""
+        if self._json is None:
+            self._json = _dumps({'role': self._role, 'content': self._content})
+        return self._json
+
+    @staticmethod
     def from_json(json_str:str):
         return LLMMessage(**json.loads(json_str))
     
@@ -20,17 +58,91 @@ class LLMMessage:
     def __str__(self):
         return str(self.to_dict())
 
+class MessageList(list):
+    """传给 _chat_raw 的消息字典列表，同时保留对应的 LLMMessage
+
+    后端用 encode_request_body 编码请求体时直接拼接每条消息缓存的 JSON 片段，
+    历史消息不会在每一轮被重新编码。
+    """
+
+    def __init__(self, messages: List[LLMMessage]):
+        super().__init__([msg.to_dict() for msg in messages])
+        self.source = list(messages)
+
+    def to_json(self) -> bytes:
+        return b"[" + self._encoded() + b"]"
+
+    def _encoded(self) -> bytes:
+        """不带方括号的消息数组内容"""
+        if len(self) != len(self.source):
+            # 列表被调用方修改过，缓存的片段不再对应
+            return _dumps(list(self))[1:-1]
+        return b",".join([msg.to_json() for msg in self.source])
+
+def encode_request_body(messages: List[Dict[str, str]], **fields) -> bytes:
+    """编码 {"messages": [...], **fields} 请求体，messages 为 MessageList 时复用缓存的片段"""
+    if isinstance(messages, MessageList):
+        encoded = messages._encoded()
+    else:
+        encoded = _dumps(list(messages))[1:-1]
+    rest = json.dumps(fields, ensure_ascii=False).encode("utf-8")[1:] if fields else b"}"
+    # 一次拼接，避免长历史的请求体被多次复制
+    return b"".join((b'{"messages":[', encoded, b"]," if fields else b"]", rest))
+
+class APIError(Exception):
+    """后端返回了非 200 状态码
+
+    Attributes:
+        status_code: HTTP 状态码
+        retry_after: 响应的 Retry-After 头（原始值），没有时为 None
+    """
+
+    def __init__(self, status_code: int, text: str, retry_after: str = None):
+        super().__init__(f"API请求失败，状态码：{status_code}，错误：{text}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
 class LLMBase(ABC):
 
     base_url:str
     api_key:str
 
-    session:List[LLMMessage]
+    # 上下文策略（ContextPolicy），决定 chat_with_context 实际发送哪些历史消息，None 表示全部发送
+    context_policy:Any
+    # 会话存储（SessionStore），None 时会话只保存在 _session 中
+    session_store:Any
+    session_id:str
 
     def __init__(self,base_url:str,api_key:str):
         self.base_url = base_url
         self.api_key = api_key
-        self.session = []
+        self._session = []
+        self.context_policy = None
+        self.session_store = None
+        self.session_id = None
+
+    @property
+    def session(self) -> List[LLMMessage]:
+        if self.session_store is None:
+            return self._session
+        return self.session_store.get(self.session_id)
+
+    @session.setter
+    def session(self, messages: List[LLMMessage]):
+        if self.session_store is None:
+            self._session = messages
+        else:
+            self.session_store.replace(self.session_id, messages)
+
+    def bind_session(self, store: Any, session_id: str):
+        """把会话绑定到存储（SessionStore）
+
+        之后对 session 的读写都经过存储，首次访问时才加载；当前内存中的会话不会被写入存储。
+        """
+        self.session_store = store
+        self.session_id = session_id
+        self._session = []
 
     def dump_session(self):
         return [msg.to_dict() for msg in self.session]
@@ -60,29 +172,64 @@ class LLMBase(ABC):
             raise ValueError(f"Invalid message type: {type(msgs)}")
         return msgs
 
-    def chat(self, msgs: Union[str, Dict[str,str], List[Dict[str,str]], LLMMessage, List[LLMMessage]], 
-             model: str, temperature: float, **kwargs) -> Generator[str, None, None]:
+    def _context_messages(self) -> List[Dict[str, str]]:
+        """根据上下文策略从会话中挑选本次请求发送的消息"""
+        session = self.session
+        if self.context_policy is not None:
+            session = self.context_policy.select(session)
+        return MessageList(session)
+
+    def __prepare_messages(self, msgs: Union[str, Dict[str,str], List[Dict[str,str]], LLMMessage, List[LLMMessage]]) -> List[Dict[str, str]]:
         messages = self.__process_messages(msgs)
 
         # 验证消息格式
         for msg in messages:
-            if not isinstance(msg, dict) or "role" not in msg or "content" not in msg:
-                raise ValueError("Messages must contain 'role' and 'content' fields")
-            if msg["role"] not in ["system", "user", "assistant"]:
-                raise ValueError(f"Invalid role: {msg['role']}")
+            if msg.role not in ["system", "user", "assistant"]:
+                raise ValueError(f"Invalid role: {msg.role}")
+        return MessageList(messages)
+
+    def chat(self, msgs: Union[str, Dict[str,str], List[Dict[str,str]], LLMMessage, List[LLMMessage]], 
+             model: str, temperature: float, **kwargs) -> Generator[str, None, None]:
+        messages = self.__prepare_messages(msgs)
 
         # 调用底层的 chat_raw 方法
         response = self._chat_raw(messages, model, temperature, **kwargs)
         return response
 
+    def achat(self, msgs: Union[str, Dict[str,str], List[Dict[str,str]], LLMMessage, List[LLMMessage]], 
+              model: str, temperature: float, **kwargs) -> AsyncGenerator[str, None]:
+        """chat 的异步版本，返回异步生成器"""
+        messages = self.__prepare_messages(msgs)
+        return self._achat_raw(messages, model, temperature, **kwargs)
+
     @abstractmethod
     def _chat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> Generator[str, None, None]:
         """底层的 chat 实现，子类必须实现此方法"""
         pass
 
+    async def _achat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> AsyncGenerator[str, None]:
+        """底层的异步 chat 实现
+
+        默认在线程池中驱动同步的 _chat_raw，每个流占用一个线程；
+        原生异步的子类（如 AsyncOpenAILLM）应重写此方法。
+        """
+        # asyncio 只在异步路径上用到，只使用同步接口的进程不导入它
+        import asyncio
+        from .async_utils import iterate_in_executor
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(
+            None, functools.partial(self._chat_raw, messages, model, temperature, **kwargs)
+        )
+        async for chunk in iterate_in_executor(response):
+            yield chunk
+
     def chat_with_context(self, msgs: Union[str, LLMMessage, List[LLMMessage], Dict[str,str], List[Dict[str,str]]], 
-                         model: str, temperature: float, **kwargs) -> Generator[str, None, None]:
-        
+                         model: str, temperature: float, save_reply: bool = True, **kwargs) -> Generator[str, None, None]:
+        """发送会话历史并把 msgs 追加到会话中
+
+        Args:
+            save_reply: 流结束后是否把回复追加到会话；调用方需要保存处理后的回复时设为 False，并自行调用 end_turn
+        """
         msgs :List[LLMMessage] = self.__process_messages(msgs)
         
         # 先添加消息到会话历史
@@ -92,21 +239,129 @@ class LLMBase(ABC):
         if not any(msg.role == 'user' for msg in msgs):
             return None
 
-        messages = [msg.to_dict() for msg in self.session]
-        response = self._chat_raw(messages, model, temperature, **kwargs)
+        try:
+            response = self.chat_messages(self._context_messages(), model, temperature, **kwargs)
+        except BaseException:
+            # 请求没有发出或被拒绝，撤销本轮的消息
+            self.end_turn(msgs, '', completed=False)
+            raise
         
+        if not save_reply:
+            return response
+
         # 流式模式：返回生成器
         def stream_generator():
             stream_str_list = []
-            for chunk in response:
-                stream_str_list.append(chunk)
-                yield chunk
-            # 在生成器结束时添加消息到会话
-            n_msg = LLMMessage(role='assistant', content=''.join(stream_str_list))
-            self.session.append(n_msg)
+            completed = False
+            try:
+                for chunk in response:
+                    stream_str_list.append(chunk)
+                    yield chunk
+                completed = True
+            finally:
+                # 在生成器结束（或被提前关闭）时添加消息到会话
+                close = getattr(response, "close", None)
+                if close is not None:
+                    close()
+                self.end_turn(msgs, ''.join(stream_str_list), completed)
         
         return stream_generator()
 
+    def achat_with_context(self, msgs: Union[str, LLMMessage, List[LLMMessage], Dict[str,str], List[Dict[str,str]]], 
+                           model: str, temperature: float, save_reply: bool = True, **kwargs) -> AsyncGenerator[str, None]:
+        """chat_with_context 的异步版本，会话历史的处理方式与同步版本一致"""
+        msgs :List[LLMMessage] = self.__process_messages(msgs)
+
+        # 先添加消息到会话历史
+        self.session.extend(msgs)
+
+        # 如果消息不包含 user 消息，直接返回 None
+        if not any(msg.role == 'user' for msg in msgs):
+            return None
+
+        messages = self._context_messages()
+        response = self._achat_raw(messages, model, temperature, **kwargs)
+        span = start_span("llm.chat", model=model, messages=len(messages))
+        if span is not None:
+            response = aiter_in_span(span, response)
+
+        if not save_reply:
+            return response
+
+        async def stream_generator():
+            stream_str_list = []
+            completed = False
+            try:
+                async for chunk in response:
+                    stream_str_list.append(chunk)
+                    yield chunk
+                completed = True
+            finally:
+                # 在生成器结束（或被提前关闭）时添加消息到会话
+                aclose = getattr(response, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+                self.end_turn(msgs, ''.join(stream_str_list), completed)
+
+        return stream_generator()
+
+    def end_turn(self, msgs: List[LLMMessage], reply: str, completed: bool = True):
+        """结束以 msgs 开始的一轮对话，保证会话以 assistant 消息结尾
+
+        回复完整结束，或被取消时已经产生了部分回复，把回复追加为 assistant 消息；
+        请求失败或在第一个数据块之前被取消时撤销本轮追加的 msgs，会话回到本轮之前的状态。
+        """
+        session = self.session
+        if completed or reply:
+            session.append(LLMMessage(role='assistant', content=reply))
+            return
+        count = len(msgs)
+        if count and len(session) >= count and all(a is b for a, b in zip(session[-count:], msgs)):
+            del session[-count:]
+
+    def chat_messages(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> Generator[str, None, None]:
+        """直接发送 messages，不读写会话"""
+        span = start_span("llm.chat", model=model, messages=len(messages))
+        if span is None:
+            return self._chat_raw(messages, model, temperature, **kwargs)
+        # 请求在 _chat_raw 中发出，llm.request 需要以 llm.chat 为父 span
+        return iter_in_span(span, call_in_span(span, self._chat_raw, messages, model, temperature, **kwargs))
+
+    def has_history(self) -> bool:
+        """会话中是否已有 system 以外的消息，即会话开头的 system 消息已经发送过"""
+        return any(msg.role != "system" for msg in self.session)
+
+    def system_prefix(self) -> List[LLMMessage]:
+        """会话开头连续的 system 消息"""
+        prefix = []
+        for msg in self.session:
+            if msg.role != "system":
+                break
+            prefix.append(msg)
+        return prefix
+
+    def batch(self, inputs: Iterable[Union[str, LLMMessage, List[LLMMessage], Dict[str,str], List[Dict[str,str]]]],
+              model: str, temperature: float, max_concurrency: int = 8, checkpoint: str = None,
+              prefix: List[LLMMessage] = None, **kwargs) -> "BatchRun":
+        """批量发送相互独立的输入，见 batch 模块
+
+        每个输入的消息为 prefix 加上输入本身，prefix 默认为当前会话开头的 system 消息；会话不会被修改。
+
+        Args:
+            inputs: 输入序列，每个元素的格式与 chat 的 msgs 相同
+            max_concurrency: 同时进行的请求数上限
+            checkpoint: 检查点文件路径，中断后重新运行会跳过已完成的输入
+            prefix: 所有输入共享的前缀消息
+        """
+        from .batch import BatchRun
+        prefix = list(self.system_prefix() if prefix is None else prefix)
+
+        def run_one(item) -> str:
+            messages = MessageList(prefix + self.__process_messages(item))
+            return ''.join(self.chat_messages(messages, model, temperature, **kwargs))
+
+        return BatchRun(inputs, run_one, max_concurrency=max_concurrency, checkpoint=checkpoint)
+
     def clear_session(self):
         self.session = []
 
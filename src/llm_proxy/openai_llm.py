@@ -1,11 +1,44 @@
-from .llm_base import LLMBase
-import requests
-import json
-from typing import Generator, Dict, Any,List
+from .llm_base import LLMBase, APIError, encode_request_body
+from .transport import HTTPTransport
+from .sse import iter_deltas, ErrorCallback, UsageCallback
+from .tool_calls import iter_tool_deltas
+from .instrumentation import start_span, iter_in_span, observe_chunk
+from .rate_limiter import RateLimiter
+from .cancellation import on_cancel, remaining_time
+from .usage import Usage, UsageStats, parse_usage
+import time
+from typing import Generator, Dict, Any,List,Optional,TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import requests
+
+def _limit(remaining, timeout):
+    """限流器的等待时间：不超过对话的剩余时间，没有截止时间时使用限流器的默认值"""
+    if remaining is None:
+        return timeout
+    return remaining if timeout is None else min(remaining, timeout)
+
 
 class OpenAILLM(LLMBase):
-    def __init__(self,base_url:str,api_key:str):
+    def __init__(self,base_url:str,api_key:str,transport:HTTPTransport=None,on_sse_error:ErrorCallback=None,
+                 rate_limiter:RateLimiter=None,include_usage:bool=True):
+        """
+        Args:
+            base_url: API 地址
+            api_key: API 密钥
+            transport: HTTP 传输层，默认使用 base_url 对应的共享连接池
+            on_sse_error: 格式错误的 SSE 数据帧的回调 (原始数据, 异常)，默认写入日志
+            rate_limiter: 客户端限流器，通常为 RateLimiter.shared(base_url, api_key, rpm=..., tpm=...)；None 表示不限流
+            include_usage: 请求带 stream_options.include_usage，解析流末尾的 usage，
+                           得到每次请求命中前缀缓存的提示 token 数；服务端不支持该字段时设为 False
+        """
         super().__init__(base_url,api_key)
+        self.transport = transport or HTTPTransport.shared(base_url)
+        self.on_sse_error = on_sse_error
+        self.rate_limiter = rate_limiter
+        self.include_usage = include_usage
+        self.usage = UsageStats()  # 累计用量，见 stats()
+        self.last_usage: Optional[Usage] = None  # 最近一次返回了 usage 的请求
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
@@ -19,53 +52,103 @@ class OpenAILLM(LLMBase):
         **kwargs
     ) -> Generator[str, None, None]:
         url = f"{self.base_url}/chat/completions"
-        data = {
-            "messages": messages,
-            "model": model,
-            "temperature": temperature,
-            "stream": True,
+        self._request_usage(kwargs)
+        # 历史消息使用各自缓存的 JSON 片段，每轮只编码新消息
+        data = encode_request_body(
+            messages,
+            model=model,
+            temperature=temperature,
+            stream=True,
             **kwargs
-        }
-
-        response = requests.post(
-            url,
-            headers=self.headers,
-            json=data,
-            stream=True
         )
 
+        # 对话设置了截止时间时，排队和等待响应头都不超过剩余时间
+        remaining = remaining_time()
+        limiter = self.rate_limiter
+        if limiter is not None:
+            limiter.acquire(limiter.estimate(data, kwargs), timeout=_limit(remaining, limiter.timeout))
+
+        span = start_span("llm.request", model=model, base_url=self.base_url)
+        try:
+            response = self.transport.post(
+                url,
+                headers=self.headers,
+                data=data,
+                stream=True,
+                **({} if remaining is None else {"timeout": self._timeout(remaining)})
+            )
+        except BaseException as e:
+            if span is not None:
+                span.end(e)
+            raise
+
         if response.status_code != 200:
-            raise Exception(f"API请求失败，状态码：{response.status_code}，错误：{response.text}")
+            if limiter is not None:
+                limiter.settle(limiter.reserve_output(kwargs), 0)
+                if response.status_code == 429:
+                    limiter.throttle(response.headers.get("Retry-After"))
+            if span is not None:
+                span.end(f"HTTP {response.status_code}", status=response.status_code)
+            raise APIError(response.status_code, response.text, response.headers.get("Retry-After"))
 
-        return self._handle_stream_response(response)
+        stream = self._handle_stream_response(response, native=bool(kwargs.get("tools")),
+                                              on_usage=self._usage_callback(span))
+        if limiter is not None:
+            stream = limiter.track(stream, limiter.reserve_output(kwargs))
+        if span is None:
+            return stream
+        span.set(connect_s=time.perf_counter() - span.start)
+        return iter_in_span(span, stream, observe_chunk)
 
-    def _handle_stream_response(self, response: requests.Response) -> Generator[str, None, None]:
+    def _handle_stream_response(self, response: "requests.Response", native: bool = False,
+                                on_usage: UsageCallback = None) -> Generator[str, None, None]:
         """
         处理流式响应，生成连续的数据块
+
+        直接按字节增量解码 SSE，格式错误的数据帧交给 on_sse_error 处理；
+        收到结束标志后继续读完响应体，连接才能放回连接池复用。
+        native 为 True（请求带 tools 参数）时同时拼接 delta.tool_calls，完整的调用以 ToolCall 产出；
+        流中的 usage 字段交给 on_usage
         """
-        buffer = ""
-        for chunk in response.iter_lines():
-            if chunk:
-                # 处理数据分片
-                chunk_str = chunk.decode('utf-8')
-                if chunk_str.startswith("data: "):
-                    data = chunk_str[6:]  # 去掉"data: "前缀
-                    
-                    # 处理结束标志
-                    if data.strip() == "[DONE]":
-                        break
-                    
-                    try:
-                        # 解析JSON数据
-                        parsed = json.loads(data)
-                        if "choices" in parsed:
-                            delta = parsed["choices"][0].get("delta", {})
-                            content = delta.get("content", "")
-                            yield content
-                    except json.JSONDecodeError:
-                        print(f"JSON解析错误: {data}")
-                        continue
+        deltas = iter_tool_deltas if native else iter_deltas
+        # 对话被取消时在取消的线程上关闭响应，阻塞中的读取立即返回
+        detach = on_cancel(response.close)
+        try:
+            yield from deltas(response.iter_content(chunk_size=None), on_error=self.on_sse_error, on_usage=on_usage)
+        finally:
+            detach()
+            # 读完时只是释放连接；中途放弃时关闭连接，避免复用读了一半的连接
+            response.close()
+
+    def _request_usage(self, kwargs: Dict[str, Any]):
+        """让服务端在流的最后返回 usage，调用方自己传了 stream_options 时不覆盖"""
+        if self.include_usage and "stream_options" not in kwargs:
+            kwargs["stream_options"] = {"include_usage": True}
+
+    def _usage_callback(self, span) -> UsageCallback:
+        """记录一次请求的用量：累计到 stats()，并写入 llm.request span 的属性"""
+        def on_usage(raw: Dict[str, Any]):
+            usage = parse_usage(raw)
+            if usage is None:
+                return
+            self.last_usage = usage
+            self.usage.add(usage)
+            if span is not None:
+                span.set(prompt_tokens=usage.prompt_tokens, cached_tokens=usage.cached_tokens,
+                         completion_tokens=usage.completion_tokens)
+        return on_usage
+
+    def stats(self) -> Dict[str, Any]:
+        """服务端报告的累计用量：提示 token 中命中和未命中前缀缓存的部分、输出 token 和缓存命中率"""
+        return self.usage.stats()
+
+    def _timeout(self, remaining: float) -> tuple:
+        """不超过 remaining 的 (连接, 读取) 超时"""
+        connect, read = self.transport.timeout
+        return (min(connect, remaining), min(read, remaining))
 
 class DeepSeekLLM(OpenAILLM):
-    def __init__(self,api_key:str):
-        super().__init__(base_url="https://api.deepseek.com/v1",api_key=api_key)
+    def __init__(self,api_key:str,transport:HTTPTransport=None,on_sse_error:ErrorCallback=None,rate_limiter:RateLimiter=None,
+                 include_usage:bool=True):
+        super().__init__(base_url="https://api.deepseek.com/v1",api_key=api_key,transport=transport,on_sse_error=on_sse_error,
+                         rate_limiter=rate_limiter,include_usage=include_usage)
@@ -0,0 +1,370 @@
+"""客户端限流与优先级调度
+
+同一个服务商和 API Key 的所有 LLM 共享一个 RateLimiter（见 RateLimiter.shared）：
+- 每分钟请求数（RPM）和每分钟估算 token 数（TPM）各用一个令牌桶；
+- 等待中的请求按优先级排队，交互式请求先于后台摘要和批量任务；
+- 队列有长度上限，每个请求可以设置最长等待时间；
+- 线程和 asyncio 调用方使用同一个队列。
+
+优先级通过上下文设置，不需要逐层传参：
+    with request_priority(Priority.BACKGROUND):
+        llm.chat(...)
+"""
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from enum import IntEnum
+from typing import Any, AsyncGenerator, Callable, Dict, Generator, Iterator, List, Optional, Tuple
+from src.tools.retry import parse_retry_after
+from .tokens import estimate_tokens
+
+
+class Priority(IntEnum):
+    """请求优先级，数值越小越先放行"""
+    INTERACTIVE = 0
+    NORMAL = 1
+    BACKGROUND = 2
+    BATCH = 3
+
+
+_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar("fastagent_priority", default=Priority.INTERACTIVE)
+
+
+def current_priority() -> Priority:
+    return _priority.get()
+
+
+@contextlib.contextmanager
+def request_priority(priority: Priority):
+    """在此上下文中发出的请求使用 priority 排队"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class RateLimitExceeded(Exception):
+    """等待队列已满"""
+    pass
+
+
+class TokenBucket:
+    """按分钟配额匀速补充的令牌桶，容量为 burst（默认一分钟的配额）"""
+
+    def __init__(self, per_minute: float, burst: float = None):
+        self.capacity = float(burst or per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def available(self, now: float) -> float:
+        if now > self.updated:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+        return self.level
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """取出 amount 个令牌需要等待的时间，超过容量的请求按容量计算"""
+        self.available(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def refund(self, amount: float):
+        """退回（或在 amount 为负时补扣）令牌"""
+        self.level = min(self.capacity, self.level + amount)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "tokens", "enqueued", "deadline", "wake", "wait", "granted", "done")
+
+    def __init__(self, priority: int, seq: int, tokens: float, enqueued: float, deadline: Optional[float],
+                 wake: Callable[[], None]):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.enqueued = enqueued
+        self.deadline = deadline
+        self.wake = wake
+        self.wait = 0.0  # 作为队首时还需要等待的时间
+        self.granted = False
+        self.done = False
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class RateLimiter:
+    """共享的 RPM/TPM 限流器和优先级调度器
+
+    没有排队的请求且配额充足时直接放行，不经过队列。排队时只有队首请求可以取令牌，
+    队首的等待者负责计时，其余等待者在被放行、成为队首或超时之前不会被唤醒。
+    """
+
+    _shared: Dict[Tuple[str, str], "RateLimiter"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None, burst_seconds: float = 60.0,
+                 max_queue: int = 1024, timeout: Optional[float] = None, expected_output_tokens: int = 256,
+                 name: str = ""):
+        """
+        Args:
+            rpm: 每分钟请求数上限，None 表示不限制
+            tpm: 每分钟 token 数上限（输入 + 输出的估算值），None 表示不限制
+            burst_seconds: 令牌桶容量相当于多少秒的配额，默认一分钟；调小可以让请求更均匀
+            max_queue: 等待队列的长度上限，超过时抛出 RateLimitExceeded
+            timeout: 默认的最长等待时间（秒），超过时抛出 TimeoutError；None 表示一直等待
+            expected_output_tokens: 请求没有设置 max_tokens 时预留的输出 token 数，流结束后按实际值结算
+            name: 名称，用于错误信息
+        """
+        self.rpm = TokenBucket(rpm, rpm * burst_seconds / 60) if rpm else None
+        self.tpm = TokenBucket(tpm, tpm * burst_seconds / 60) if tpm else None
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.expected_output_tokens = expected_output_tokens
+        self.name = name
+        self._lock = threading.Lock()
+        self._heap: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._timer: Optional[_Waiter] = None  # 负责计时的队首等待者
+        self._paused_until = 0.0
+
+        self.queued = 0
+        self.max_queued = 0
+        self.granted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.throttled = 0  # 收到 429 的次数
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.granted_by_priority: Dict[str, int] = {}
+
+    @classmethod
+    def shared(cls, base_url: str, api_key: str, **kwargs) -> "RateLimiter":
+        """获取服务商 + API Key 对应的共享限流器，不存在时用 kwargs 创建；kwargs 只在首次创建时生效"""
+        key = (base_url.rstrip('/'), api_key)
+        with cls._shared_lock:
+            limiter = cls._shared.get(key)
+            if limiter is None:
+                limiter = cls._shared[key] = cls(name=key[0], **kwargs)
+            return limiter
+
+    def reserve_output(self, params: Dict[str, Any]) -> int:
+        """为输出预留的 token 数：请求的 max_tokens，没有时使用 expected_output_tokens"""
+        return int(params.get("max_tokens") or self.expected_output_tokens)
+
+    def estimate(self, body: bytes, params: Dict[str, Any]) -> int:
+        """按请求体估算本次请求占用的 token 数：输入约 4 字节一个 token，加上预留的输出"""
+        return len(body) // 4 + self.reserve_output(params)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "queued": self.queued,
+                "max_queued": self.max_queued,
+                "granted": self.granted,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "throttled": self.throttled,
+                "wait_avg_ms": self.wait_total / self.granted * 1000 if self.granted else 0.0,
+                "wait_max_ms": self.wait_max * 1000,
+                "granted_by_priority": dict(self.granted_by_priority),
+                "rpm_available": None if self.rpm is None else self.rpm.available(now),
+                "tpm_available": None if self.tpm is None else self.tpm.available(now),
+            }
+
+    def _ready_in(self, tokens: float, now: float) -> float:
+        wait = self._paused_until - now
+        if self.rpm is not None:
+            wait = max(wait, self.rpm.wait_time(1, now))
+        if self.tpm is not None:
+            wait = max(wait, self.tpm.wait_time(tokens, now))
+        return max(wait, 0.0)
+
+    def _grant(self, tokens: float, priority: int, waited: float):
+        if self.rpm is not None:
+            self.rpm.take(1)
+        if self.tpm is not None:
+            self.tpm.take(tokens)
+        self.granted += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        name = Priority(priority).name.lower() if priority in Priority._value2member_map_ else str(priority)
+        self.granted_by_priority[name] = self.granted_by_priority.get(name, 0) + 1
+
+    def _dispatch(self, now: float):
+        """按优先级放行队首请求；队首需要等待时唤醒它负责计时。调用方持有 _lock"""
+        while self._heap:
+            head = self._heap[0]
+            if head.done:
+                heapq.heappop(self._heap)
+                continue
+            wait = self._ready_in(head.tokens, now)
+            if wait > 0:
+                head.wait = wait
+                if self._timer is not head:
+                    self._timer = head
+                    head.wake()
+                return
+            heapq.heappop(self._heap)
+            head.granted = head.done = True
+            self.queued -= 1
+            self._grant(head.tokens, head.priority, now - head.enqueued)
+            head.wake()
+        self._timer = None
+
+    def _try_fast(self, tokens: float, priority: int, now: float) -> bool:
+        if not self._heap and self._ready_in(tokens, now) <= 0:
+            self._grant(tokens, priority, 0.0)
+            return True
+        return False
+
+    def _enqueue(self, tokens: float, priority: int, timeout: Optional[float], now: float,
+                 wake: Callable[[], None]) -> _Waiter:
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise RateLimitExceeded(f"限流队列已满：{self.name}（{self.max_queue}）")
+        timeout = self.timeout if timeout is None else timeout
+        waiter = _Waiter(int(priority), next(self._seq), tokens, now,
+                         None if timeout is None else now + timeout, wake)
+        heapq.heappush(self._heap, waiter)
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        return waiter
+
+    def _expire(self, waiter: _Waiter, now: float):
+        waiter.done = True
+        self.queued -= 1
+        self.timeouts += 1
+        if self._timer is waiter:
+            self._timer = None
+        self._dispatch(now)
+
+    def _sleep_time(self, waiter: _Waiter, now: float) -> Optional[float]:
+        sleep = waiter.wait if self._timer is waiter else None
+        if waiter.deadline is not None:
+            remaining = waiter.deadline - now
+            sleep = remaining if sleep is None else min(sleep, remaining)
+        return sleep
+
+    def acquire(self, tokens: float = 0, priority: Priority = None, timeout: Optional[float] = None) -> float:
+        """等待配额，返回等待的时间（秒）
+
+        Args:
+            tokens: 本次请求占用的 token 数
+            priority: 优先级，默认取当前上下文的优先级（见 request_priority）
+            timeout: 最长等待时间（秒），默认使用构造时的 timeout
+        """
+        priority = current_priority() if priority is None else priority
+        event = threading.Event()
+        with self._lock:
+            now = time.monotonic()
+            if self._try_fast(tokens, priority, now):
+                return 0.0
+            waiter = self._enqueue(tokens, priority, timeout, now, event.set)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._dispatch(now)
+                event.clear()
+                if waiter.granted:
+                    return now - waiter.enqueued
+                if waiter.deadline is not None and now >= waiter.deadline:
+                    self._expire(waiter, now)
+                    raise TimeoutError(f"等待限流配额超时：{self.name}")
+                sleep = self._sleep_time(waiter, now)
+            event.wait(sleep)
+
+    async def aacquire(self, tokens: float = 0, priority: Priority = None, timeout: Optional[float] = None) -> float:
+        """acquire 的异步版本，等待期间不阻塞事件循环"""
+        priority = current_priority() if priority is None else priority
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+        with self._lock:
+            now = time.monotonic()
+            if self._try_fast(tokens, priority, now):
+                return 0.0
+            waiter = self._enqueue(tokens, priority, timeout, now, wake)
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    self._dispatch(now)
+                    event.clear()
+                    if waiter.granted:
+                        return now - waiter.enqueued
+                    if waiter.deadline is not None and now >= waiter.deadline:
+                        self._expire(waiter, now)
+                        raise TimeoutError(f"等待限流配额超时：{self.name}")
+                    sleep = self._sleep_time(waiter, now)
+                try:
+                    await asyncio.wait_for(event.wait(), sleep)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            with self._lock:
+                if not waiter.done:
+                    self._expire(waiter, time.monotonic())
+                    self.timeouts -= 1
+            raise
+
+    def settle(self, reserved: float, used: float):
+        """按实际用量结算预留的输出 token，多退少补"""
+        if self.tpm is None:
+            return
+        with self._lock:
+            self.tpm.refund(reserved - used)
+            self._dispatch(time.monotonic())
+
+    def pause(self, seconds: float):
+        """收到限流响应后暂停放行 seconds 秒"""
+        with self._lock:
+            self.throttled += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            if self._timer is not None:
+                # 让计时的等待者按新的时间重新计时
+                self._timer.wake()
+                self._timer = None
+
+    def throttle(self, retry_after: Optional[str], default: float = 1.0):
+        """根据 429 响应的 Retry-After 头暂停放行"""
+        seconds = parse_retry_after(retry_after)
+        self.pause(default if seconds is None else seconds)
+
+    def track(self, stream: Iterator[str], reserved: float) -> Generator[str, None, None]:
+        """转发流并在结束时按实际输出结算预留的 token"""
+        used = 0
+        try:
+            for chunk in stream:
+                used += estimate_tokens(chunk)
+                yield chunk
+        finally:
+            self.settle(reserved, used)
+
+    async def atrack(self, stream: AsyncGenerator[str, None], reserved: float) -> AsyncGenerator[str, None]:
+        """track 的异步版本"""
+        used = 0
+        try:
+            async for chunk in stream:
+                used += estimate_tokens(chunk)
+                yield chunk
+        finally:
+            self.settle(reserved, used)
@@ -0,0 +1,374 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Dict, Generator, List, Optional, Tuple
+from .async_utils import iterate_in_executor
+from .llm_base import LLMBase, encode_request_body
+from .tool_calls import ToolCall
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """一次正在进行的请求：负责请求的调用方写入数据块，相同请求的其他调用方同步读取"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+    def put(self, chunk: str):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, error: BaseException = None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+    def replay(self) -> Generator[str, None, None]:
+        """按原始分块逐块读取，已产生的块立即返回，之后的块随请求进度返回"""
+        index = 0
+        while True:
+            with self.cond:
+                while index >= len(self.chunks) and not self.done:
+                    self.cond.wait()
+                chunks = self.chunks[index:]
+                done, error = self.done, self.error
+            index += len(chunks)
+            yield from chunks
+            if done and index >= len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class ResponseCache:
+    """LLM 响应缓存
+
+    以 后端 + 模型 + 消息 + 请求参数 的哈希为键，保存原始的数据块列表，重放时保持相同的分块：
+    - 内存中按 LRU 淘汰，条目数不超过 max_entries，总字符数不超过 max_chars；
+    - 可选 SQLite 文件作为二级存储；
+    - 并发的相同请求只发送一次，其余调用方同步读取同一个流。
+
+    通过 CachedLLM 使用。
+    """
+
+    def __init__(self, max_entries: int = 256, max_chars: int = 16 * 1024 * 1024,
+                 path: Optional[str] = None, max_disk_entries: int = 100000):
+        """
+        Args:
+            max_entries: 内存中最多保留的响应数
+            max_chars: 内存中所有响应的字符总数上限
+            path: SQLite 文件路径，为 None 时只使用内存
+            max_disk_entries: 文件中最多保留的响应数
+        """
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.max_disk_entries = max_disk_entries
+        self._entries: "OrderedDict[str, Tuple[str, ...]]" = OrderedDict()
+        self._chars = 0
+        self._inflight: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # 读取同一个进行中请求的调用数
+        self.disk_hits = 0
+
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, chunks TEXT)")
+            self._db.commit()
+            self._db_lock = threading.Lock()
+            self._writes = 0
+
+    @staticmethod
+    def make_key(backend: str, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> str:
+        """稳定的缓存键，消息部分复用 MessageList 缓存的 JSON 片段"""
+        body = encode_request_body(messages)
+        params = json.dumps(
+            {"backend": backend, "model": model, "temperature": temperature, "kwargs": kwargs},
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        digest = hashlib.sha256(body)
+        digest.update(params.encode("utf-8"))
+        return digest.hexdigest()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "disk_hits": self.disk_hits,
+            "entries": len(self._entries),
+            "chars": self._chars,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._chars = 0
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM llm_cache")
+                self._db.commit()
+
+    def _claim(self, key: str) -> Tuple[Optional[Tuple[str, ...]], Optional[_Flight], bool]:
+        """查找缓存，未命中时登记一次请求
+
+        Returns:
+            (命中的数据块, 进行中的请求, 当前调用是否负责发送请求)
+        """
+        with self._lock:
+            chunks = self._entries.get(key)
+            if chunks is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return chunks, None, False
+            flight = self._inflight.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.coalesced += 1
+                return None, flight, False
+            flight = _Flight()
+            self._inflight[key] = flight
+
+        # 二级存储的查询放在锁外，期间的相同请求会读取这个 flight
+        try:
+            chunks = self._disk_get(key)
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            flight.finish(e)
+            raise
+        if chunks is None:
+            with self._lock:
+                self.misses += 1
+            return None, flight, True
+        with self._lock:
+            self.hits += 1
+            self.disk_hits += 1
+            self._store(key, chunks)
+            del self._inflight[key]
+        with flight.cond:
+            flight.chunks.extend(chunks)
+        flight.finish()
+        return chunks, None, False
+
+    def _finish(self, key: str, flight: _Flight, error: BaseException = None):
+        chunks = tuple(flight.chunks)
+        with self._lock:
+            if error is None:
+                self._store(key, chunks)
+            del self._inflight[key]
+        flight.finish(error)
+        if error is None:
+            self._disk_put(key, chunks)
+
+    def _abandon(self, key: str, flight: _Flight) -> bool:
+        """负责请求的调用方中途放弃读取，没有其他调用方在等待时撤销这次请求并返回 True"""
+        with self._lock:
+            if flight.followers:
+                return False
+            del self._inflight[key]
+        flight.finish(RuntimeError("request abandoned"))
+        return True
+
+    def _store(self, key: str, chunks: Tuple[str, ...]):
+        size = sum(len(chunk) for chunk in chunks)
+        if size > self.max_chars:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._chars -= sum(len(chunk) for chunk in old)
+        self._entries[key] = chunks
+        self._chars += size
+        while len(self._entries) > self.max_entries or self._chars > self.max_chars:
+            _, evicted = self._entries.popitem(last=False)
+            self._chars -= sum(len(chunk) for chunk in evicted)
+
+    def _disk_get(self, key: str) -> Optional[Tuple[str, ...]]:
+        """查询二级存储；读取失败或条目无法解析时视为未命中，并删除损坏的条目"""
+        if self._db is None:
+            return None
+        try:
+            with self._db_lock:
+                row = self._db.execute("SELECT chunks FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("响应缓存读取失败: %s", e)
+            return None
+        if row is None:
+            return None
+        try:
+            return tuple(_decode_chunk(item) for item in json.loads(row[0]))
+        except Exception as e:
+            logger.warning("响应缓存条目损坏，已删除: %s", e)
+            self._disk_delete(key)
+            return None
+
+    def _disk_delete(self, key: str):
+        try:
+            with self._db_lock:
+                self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._db.commit()
+        except sqlite3.Error:
+            pass
+
+    def _disk_put(self, key: str, chunks: Tuple[str, ...]):
+        """写入二级存储；写入失败（例如数据库被锁定）只是少缓存一个响应，不影响已经成功的请求"""
+        if self._db is None:
+            return
+        with self._db_lock:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, chunks) VALUES (?, ?)",
+                    (key, json.dumps([_encode_chunk(chunk) for chunk in chunks], ensure_ascii=False))
+                )
+                self._writes += 1
+                # 定期清理超出容量的条目
+                if self._writes % 1000 == 0:
+                    self._db.execute(
+                        "DELETE FROM llm_cache WHERE rowid NOT IN "
+                        "(SELECT rowid FROM llm_cache ORDER BY rowid DESC LIMIT ?)",
+                        (self.max_disk_entries,)
+                    )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning("响应缓存写入失败: %s", e)
+                try:
+                    self._db.rollback()
+                except sqlite3.Error:
+                    pass
+
+
+def _encode_chunk(chunk: str) -> Any:
+    """文本块原样保存，原生模式的 ToolCall 保存为 ["tool_call", name, arguments, id]，读回时类型不变"""
+    if isinstance(chunk, ToolCall):
+        return ["tool_call", chunk.name, chunk.arguments, chunk.id]
+    return chunk
+
+
+def _decode_chunk(item: Any) -> str:
+    if isinstance(item, list):
+        return ToolCall(*item[1:])
+    return item
+
+
+class CachedLLM(LLMBase):
+    """为任意 LLMBase 加上响应缓存
+
+    只缓存确定性的请求：temperature > 0 的请求直接交给被包装的 LLM，除非设置 cache_sampled=True。
+    会话、上下文策略等由 CachedLLM 自身管理，被包装的 LLM 只负责发送请求。
+    """
+
+    def __init__(self, llm: LLMBase, cache: ResponseCache = None, cache_sampled: bool = False):
+        """
+        Args:
+            llm: 被包装的 LLM
+            cache: 响应缓存，可以在多个 CachedLLM 之间共享
+            cache_sampled: 是否也缓存 temperature > 0 的请求
+        """
+        super().__init__(llm.base_url, llm.api_key)
+        self.llm = llm
+        self.cache = cache or ResponseCache()
+        self.cache_sampled = cache_sampled
+        self._backend = f"{type(llm).__name__}:{llm.base_url}"
+        self._drains = set()  # 放弃读取后仍在为其他调用方读完的异步任务
+
+    def _cacheable(self, temperature: float) -> bool:
+        return self.cache_sampled or not temperature
+
+    def _chat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> Generator[str, None, None]:
+        if not self._cacheable(temperature):
+            return self.llm._chat_raw(messages, model, temperature, **kwargs)
+        key = self.cache.make_key(self._backend, messages, model, temperature, **kwargs)
+        chunks, flight, owner = self.cache._claim(key)
+        if chunks is not None:
+            return iter(chunks)
+        if not owner:
+            return flight.replay()
+        try:
+            response = self.llm._chat_raw(messages, model, temperature, **kwargs)
+        except BaseException as e:
+            self.cache._finish(key, flight, e)
+            raise
+        return self._record(key, flight, response)
+
+    def _record(self, key: str, flight: _Flight, response: Generator[str, None, None]) -> Generator[str, None, None]:
+        try:
+            for chunk in response:
+                flight.put(chunk)
+                yield chunk
+        except GeneratorExit:
+            if self.cache._abandon(key, flight):
+                response.close()
+            else:
+                # 还有调用方在等待同一个响应，在后台读完
+                threading.Thread(target=self._drain, args=(key, flight, response), daemon=True).start()
+            raise
+        except BaseException as e:
+            self.cache._finish(key, flight, e)
+            raise
+        self.cache._finish(key, flight)
+
+    def _drain(self, key: str, flight: _Flight, response: Generator[str, None, None]):
+        try:
+            for chunk in response:
+                flight.put(chunk)
+        except BaseException as e:
+            self.cache._finish(key, flight, e)
+            return
+        self.cache._finish(key, flight)
+
+    async def _achat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> AsyncGenerator[str, None]:
+        if not self._cacheable(temperature):
+            async for chunk in self.llm._achat_raw(messages, model, temperature, **kwargs):
+                yield chunk
+            return
+        key = self.cache.make_key(self._backend, messages, model, temperature, **kwargs)
+        chunks, flight, owner = self.cache._claim(key)
+        if chunks is not None:
+            for chunk in chunks:
+                yield chunk
+            return
+        if not owner:
+            async for chunk in iterate_in_executor(flight.replay()):
+                yield chunk
+            return
+
+        response = self.llm._achat_raw(messages, model, temperature, **kwargs)
+        try:
+            async for chunk in response:
+                flight.put(chunk)
+                yield chunk
+        except GeneratorExit:
+            if self.cache._abandon(key, flight):
+                await response.aclose()
+            else:
+                task = asyncio.ensure_future(self._adrain(key, flight, response))
+                self._drains.add(task)
+                task.add_done_callback(self._drains.discard)
+            raise
+        except BaseException as e:
+            self.cache._finish(key, flight, e)
+            raise
+        self.cache._finish(key, flight)
+
+    async def _adrain(self, key: str, flight: _Flight, response: AsyncGenerator[str, None]):
+        try:
+            async for chunk in response:
+                flight.put(chunk)
+        except BaseException as e:
+            self.cache._finish(key, flight, e)
+            return
+        self.cache._finish(key, flight)
@@ -0,0 +1,298 @@
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+from typing import Any, AsyncGenerator, Dict, Generator, Iterator, List, Optional, Tuple
+from src.tools.retry import RetryPolicy, CircuitBreaker, CircuitOpenError, LatencyTracker
+from .instrumentation import current_span
+from .cancellation import ChatCancelled, check_cancelled, sleep
+from .llm_base import LLMBase
+
+# 流在第一个数据块之前就结束了
+_EMPTY = object()
+
+
+def open_stream(llm: LLMBase, messages: List[Dict[str, str]], model: str, temperature: float,
+                kwargs: Dict[str, Any]) -> Tuple[Iterator[str], Any]:
+    """发送请求并读到第一个数据块，返回 (流, 第一个数据块)；流为空时第一个数据块为 _EMPTY"""
+    stream = iter(llm._chat_raw(messages, model, temperature, **kwargs))
+    return stream, next(stream, _EMPTY)
+
+
+async def aopen_stream(llm: LLMBase, messages: List[Dict[str, str]], model: str, temperature: float,
+                       kwargs: Dict[str, Any]) -> Tuple[AsyncGenerator[str, None], Any]:
+    """open_stream 的异步版本"""
+    stream = llm._achat_raw(messages, model, temperature, **kwargs)
+    try:
+        first = await stream.__anext__()
+    except StopAsyncIteration:
+        first = _EMPTY
+    return stream, first
+
+
+class RetryingLLM(LLMBase):
+    """为任意 LLMBase 加上重试、熔断和对冲请求
+
+    - 收到第一个数据块之前的失败（连接错误、可重试的状态码、空读）按 RetryPolicy 透明重试，
+      退避使用全抖动，服务端给出 Retry-After 时按其等待；第一个数据块之后的错误直接抛给调用方，
+      避免重复输出；
+    - 每个端点共享一个 CircuitBreaker，服务端持续失败时直接抛出 CircuitOpenError；
+    - 设置 hedge_quantile 后，首包时间超过最近样本的该分位数时再发送一个相同请求，
+      先收到第一个数据块的请求胜出，另一个被关闭。
+
+    会话、上下文策略等由 RetryingLLM 自身管理，被包装的 LLM 只负责发送请求。
+    """
+
+    def __init__(self, llm: LLMBase, policy: RetryPolicy = None, breaker: CircuitBreaker = None,
+                 hedge_quantile: Optional[float] = None, hedge_min_samples: int = 20,
+                 hedge_min_delay: float = 0.0, latency: LatencyTracker = None):
+        """
+        Args:
+            llm: 被包装的 LLM
+            policy: 重试策略，默认 RetryPolicy()
+            breaker: 熔断器，默认使用 llm.base_url 对应的共享熔断器
+            hedge_quantile: 对冲请求的首包时间分位数，例如 0.95；None 表示不发送对冲请求
+            hedge_min_samples: 首包时间样本数达到此值后才开始对冲
+            hedge_min_delay: 对冲截止时间的下限（秒）
+            latency: 首包时间样本，可以在多个 RetryingLLM 之间共享
+        """
+        super().__init__(llm.base_url, llm.api_key)
+        self.llm = llm
+        self.policy = policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker.shared(llm.base_url)
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.latency = latency or LatencyTracker()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.hedges = 0  # 发出的对冲请求数
+        self.hedge_wins = 0  # 对冲请求先返回的次数
+        self.rejected = 0  # 被熔断器拒绝的请求数
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "rejected": self.rejected,
+            "breaker": self.breaker.state,
+        }
+
+    def hedge_delay(self) -> Optional[float]:
+        """当前的对冲截止时间，样本不足或未启用时返回 None"""
+        if self.hedge_quantile is None or len(self.latency) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, self.latency.quantile(self.hedge_quantile))
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _check_breaker(self):
+        try:
+            self.breaker.check()
+        except CircuitOpenError:
+            self._count("rejected")
+            raise
+
+    def _check_cancelled(self):
+        """对话已被取消时抛出 ChatCancelled；被取消的请求既不算成功也不算失败，熔断器的探测机会交还给下一个请求"""
+        try:
+            check_cancelled()
+        except ChatCancelled:
+            self.breaker.release_probe()
+            raise
+
+    def _failed(self, error: BaseException, attempt: int) -> Optional[float]:
+        """记录一次失败，返回重试前的等待时间；不应重试时返回 None"""
+        if self.policy.is_server_failure(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        if not self.policy.is_retryable(error):
+            return None
+        delay = self.policy.delay(attempt, error)
+        if delay is None:
+            return None
+        self._count("retries")
+        span = current_span()
+        if span is not None:
+            span.event("llm.retry", attempt=attempt + 1, delay=delay, error=type(error).__name__)
+        return delay
+
+    def _chat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> Generator[str, None, None]:
+        self._count("requests")
+        attempt = 0
+        while True:
+            self._check_breaker()
+            try:
+                stream, first = self._first_chunk(messages, model, temperature, kwargs)
+                break
+            except Exception as e:
+                # 对话已被取消时不再重试
+                self._check_cancelled()
+                delay = self._failed(e, attempt)
+                if delay is None:
+                    raise
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+            sleep(delay)
+            attempt += 1
+        self.breaker.record_success()
+        return self._resume(stream, first)
+
+    def _resume(self, stream: Iterator[str], first: Any) -> Generator[str, None, None]:
+        try:
+            if first is not _EMPTY:
+                yield first
+            yield from stream
+        finally:
+            self._close(stream)
+
+    def _open(self, messages: List[Dict[str, str]], model: str, temperature: float, kwargs: Dict[str, Any]) -> Tuple[Iterator[str], Any]:
+        start = time.perf_counter()
+        opened = open_stream(self.llm, messages, model, temperature, kwargs)
+        self.latency.observe(time.perf_counter() - start)
+        return opened
+
+    def _first_chunk(self, messages: List[Dict[str, str]], model: str, temperature: float, kwargs: Dict[str, Any]) -> Tuple[Iterator[str], Any]:
+        deadline = self.hedge_delay()
+        if deadline is None:
+            return self._open(messages, model, temperature, kwargs)
+
+        # 请求在后台线程中发送，调用方按截止时间等待；落选的请求读到第一个数据块后自行关闭
+        results: "queue.Queue[Tuple[int, Any, Optional[BaseException]]]" = queue.Queue()
+        lock = threading.Lock()
+        decided = False
+
+        def run(index: int):
+            try:
+                opened = self._open(messages, model, temperature, kwargs)
+            except BaseException as e:
+                results.put((index, None, e))
+                return
+            with lock:
+                if not decided:
+                    results.put((index, opened, None))
+                    return
+            self._close(opened[0])
+
+        def launch(index: int):
+            # 复制上下文，请求的 span 仍然挂在当前 span 下
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(run, index), daemon=True, name="llm-hedge").start()
+
+        launch(0)
+        launched = 1
+        try:
+            item = results.get(timeout=deadline)
+        except queue.Empty:
+            self._count("hedges")
+            launch(1)
+            launched = 2
+            item = results.get()
+
+        failures = 0
+        while item[2] is not None:
+            failures += 1
+            if failures == launched:
+                raise item[2]
+            item = results.get()
+
+        with lock:
+            decided = True
+        # 同时返回的另一个请求
+        while True:
+            try:
+                _, other, _ = results.get_nowait()
+            except queue.Empty:
+                break
+            if other is not None:
+                self._close(other[0])
+        if item[0] == 1:
+            self._count("hedge_wins")
+        return item[1]
+
+    @staticmethod
+    def _close(stream: Iterator[str]):
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+
+    async def _achat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> AsyncGenerator[str, None]:
+        self._count("requests")
+        attempt = 0
+        while True:
+            self._check_breaker()
+            try:
+                stream, first = await self._afirst_chunk(messages, model, temperature, kwargs)
+                break
+            except Exception as e:
+                self._check_cancelled()
+                delay = self._failed(e, attempt)
+                if delay is None:
+                    raise
+            except BaseException:
+                # 包括 asyncio.CancelledError
+                self.breaker.release_probe()
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+        self.breaker.record_success()
+        try:
+            if first is not _EMPTY:
+                yield first
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    async def _aopen(self, messages: List[Dict[str, str]], model: str, temperature: float, kwargs: Dict[str, Any]) -> Tuple[AsyncGenerator[str, None], Any]:
+        start = time.perf_counter()
+        opened = await aopen_stream(self.llm, messages, model, temperature, kwargs)
+        self.latency.observe(time.perf_counter() - start)
+        return opened
+
+    async def _afirst_chunk(self, messages: List[Dict[str, str]], model: str, temperature: float, kwargs: Dict[str, Any]) -> Tuple[AsyncGenerator[str, None], Any]:
+        deadline = self.hedge_delay()
+        if deadline is None:
+            return await self._aopen(messages, model, temperature, kwargs)
+
+        tasks = [asyncio.ensure_future(self._aopen(messages, model, temperature, kwargs))]
+        winner = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=deadline)
+            if not done:
+                self._count("hedges")
+                tasks.append(asyncio.ensure_future(self._aopen(messages, model, temperature, kwargs)))
+            pending = set(tasks)
+            error = None
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in tasks:
+                    if task in done:
+                        if task.exception() is None:
+                            winner = task
+                            break
+                        error = task.exception()
+            if winner is None:
+                raise error
+            if winner is not tasks[0]:
+                self._count("hedge_wins")
+            return winner.result()
+        finally:
+            # 取消落选的请求，已经返回的关闭其流
+            losers = [task for task in tasks if task is not winner]
+            for task in losers:
+                task.cancel()
+            for task in losers:
+                try:
+                    stream, _ = await task
+                except BaseException:
+                    continue
+                await stream.aclose()
@@ -0,0 +1,269 @@
+import random
+import threading
+import time
+from typing import Any, AsyncGenerator, Callable, Dict, Generator, Iterator, List, Optional, Sequence, Tuple, Union
+from src.tools.retry import RetryPolicy
+from .instrumentation import current_span
+from .cancellation import check_cancelled
+from .llm_base import LLMBase
+from .retrying_llm import open_stream, aopen_stream, _EMPTY
+
+
+class Backend:
+    """路由器中的一个后端及其统计"""
+
+    def __init__(self, llm: LLMBase, weight: float = 1.0, name: str = None):
+        self.llm = llm
+        self.weight = weight
+        self.name = name or llm.base_url
+        self.inflight = 0  # 尚未读完的流
+        self.ttft: Optional[float] = None  # 首包时间的指数移动平均（秒）
+        self.failures = 0  # 连续失败次数
+        self.down_until = 0.0  # 在此时间（time.monotonic）之前视为不健康
+        self.requests = 0
+        self.errors = 0
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.down_until
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "weight": self.weight,
+            "inflight": self.inflight,
+            "ttft_ms": None if self.ttft is None else self.ttft * 1000,
+            "healthy": self.healthy(time.monotonic()),
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+def default_health_check(llm: LLMBase) -> bool:
+    """对 OpenAI 兼容后端请求 GET {base_url}/models，5xx 或连接失败视为不健康"""
+    transport = getattr(llm, "transport", None)
+    if transport is None:
+        return True
+    try:
+        response = transport.session.get(f"{llm.base_url}/models", headers=getattr(llm, "headers", None),
+                                         timeout=transport.timeout)
+        response.close()
+    except Exception:
+        return False
+    return response.status_code < 500
+
+
+class RouterLLM(LLMBase):
+    """在多个后端（不同部署或不同 API Key）之间分配请求的 LLM
+
+    - 每个请求选择健康后端中 (进行中的流 + 1) * 平均首包时间 / 权重 最小的一个；
+    - 收到第一个数据块之前失败时换下一个后端重试，之后的错误直接抛给调用方；
+    - 连续失败 failure_threshold 次的后端在 cooldown 秒内不再被选中；
+      设置 health_check_interval 后在后台定期检查所有后端，检查通过的后端立即恢复。
+
+    对 Agent 来说与其他 LLMBase 没有区别，会话由 RouterLLM 自身管理。
+    """
+
+    def __init__(self, backends: Sequence[Union[LLMBase, Tuple[LLMBase, float], Backend]],
+                 policy: RetryPolicy = None, ttft_alpha: float = 0.2, failure_threshold: int = 3,
+                 cooldown: float = 30.0, health_check_interval: Optional[float] = None,
+                 health_check: Callable[[LLMBase], bool] = default_health_check, seed: int = None):
+        """
+        Args:
+            backends: 后端列表，元素可以是 LLM、(LLM, 权重) 或 Backend
+            policy: 判断哪些错误可以换后端重试，默认 RetryPolicy()
+            ttft_alpha: 首包时间移动平均的平滑系数
+            failure_threshold: 连续失败多少次后暂停使用该后端
+            cooldown: 暂停使用的时间（秒）
+            health_check_interval: 后台健康检查的间隔（秒），None 表示只根据请求结果判断
+            health_check: 健康检查函数，返回 False 表示不健康
+            seed: 打破平局时使用的随机数种子
+        """
+        self.backends: List[Backend] = []
+        for i, backend in enumerate(backends):
+            if isinstance(backend, tuple):
+                backend = Backend(backend[0], backend[1])
+            elif not isinstance(backend, Backend):
+                backend = Backend(backend)
+            if any(b.name == backend.name for b in self.backends):
+                backend.name = f"{backend.name}#{i}"
+            self.backends.append(backend)
+        if not self.backends:
+            raise ValueError("RouterLLM 至少需要一个后端")
+        super().__init__("router:" + ",".join(b.name for b in self.backends), "")
+        self.policy = policy or RetryPolicy()
+        self.ttft_alpha = ttft_alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.health_check = health_check
+        self.failovers = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self._closed = threading.Event()
+        self._checker = None
+        if health_check_interval is not None:
+            self._checker = threading.Thread(target=self._check_loop, args=(health_check_interval,),
+                                             daemon=True, name="router-health")
+            self._checker.start()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"failovers": self.failovers, "backends": [b.stats() for b in self.backends]}
+
+    def close(self):
+        """停止后台健康检查"""
+        self._closed.set()
+
+    def _select(self, tried: List[Backend]) -> Optional[Backend]:
+        """选择一个后端并把它的进行中计数加一，所有后端都试过时返回 None"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [b for b in self.backends if b not in tried]
+            if not candidates:
+                return None
+            healthy = [b for b in candidates if b.healthy(now)]
+            if healthy:
+                # 没有样本的后端按当前最快的后端估计
+                known = [b.ttft for b in healthy if b.ttft is not None]
+                default = min(known) if known else 1.0
+                backend = min(healthy, key=lambda b: (
+                    (b.inflight + 1) * (default if b.ttft is None else b.ttft) / b.weight,
+                    self._random.random()
+                ))
+            else:
+                # 全部不健康时选择最早恢复的后端，而不是直接失败
+                backend = min(candidates, key=lambda b: b.down_until)
+            backend.inflight += 1
+            backend.requests += 1
+            return backend
+
+    def _succeeded(self, backend: Backend, ttft: float):
+        with self._lock:
+            backend.failures = 0
+            backend.down_until = 0.0
+            if backend.ttft is None:
+                backend.ttft = ttft
+            else:
+                backend.ttft += self.ttft_alpha * (ttft - backend.ttft)
+
+    def _failed(self, backend: Backend, error: BaseException) -> bool:
+        """记录失败并结束这次占用，返回是否应换一个后端重试"""
+        with self._lock:
+            backend.inflight -= 1
+            backend.errors += 1
+            if self.policy.is_server_failure(error):
+                backend.failures += 1
+                if backend.failures >= self.failure_threshold:
+                    backend.down_until = time.monotonic() + self.cooldown
+            retry = self.policy.is_retryable(error)
+            if retry:
+                self.failovers += 1
+        span = current_span()
+        if retry and span is not None:
+            span.event("llm.failover", backend=backend.name, error=type(error).__name__)
+        return retry
+
+    @staticmethod
+    def _exhausted(error: Optional[BaseException]) -> BaseException:
+        """所有后端都试过时抛出的异常：最后一个后端的错误，一个后端都没有试过时为 RuntimeError"""
+        if error is None:
+            return RuntimeError("RouterLLM 没有可用的后端")
+        return error
+
+    def _release(self, backend: Backend):
+        with self._lock:
+            backend.inflight -= 1
+
+    def _chat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> Generator[str, None, None]:
+        tried: List[Backend] = []
+        error: Optional[BaseException] = None
+        while True:
+            backend = self._select(tried)
+            if backend is None:
+                raise self._exhausted(error)
+            tried.append(backend)
+            start = time.perf_counter()
+            try:
+                stream, first = open_stream(backend.llm, messages, model, temperature, kwargs)
+            except Exception as e:
+                if not self._failed(backend, e):
+                    raise
+                # 对话已被取消时不再换后端
+                check_cancelled()
+                error = e
+                continue
+            except BaseException:
+                # 例如任务被取消（asyncio.CancelledError），不计入失败，但要结束这次占用
+                self._release(backend)
+                raise
+            self._succeeded(backend, time.perf_counter() - start)
+            result = self._stream(backend, stream, first)
+            # 先启动生成器，调用方没有读取就关闭或丢弃时 finally 也会执行，进行中计数不会泄漏
+            next(result)
+            return result
+
+    def _stream(self, backend: Backend, stream: Iterator[str], first: Any) -> Generator[str, None, None]:
+        try:
+            yield
+            if first is not _EMPTY:
+                yield first
+            yield from stream
+        finally:
+            self._release(backend)
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+
+    async def _achat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> AsyncGenerator[str, None]:
+        tried: List[Backend] = []
+        error: Optional[BaseException] = None
+        while True:
+            backend = self._select(tried)
+            if backend is None:
+                raise self._exhausted(error)
+            tried.append(backend)
+            start = time.perf_counter()
+            try:
+                stream, first = await aopen_stream(backend.llm, messages, model, temperature, kwargs)
+            except Exception as e:
+                if not self._failed(backend, e):
+                    raise
+                # 对话已被取消时不再换后端
+                check_cancelled()
+                error = e
+                continue
+            except BaseException:
+                # 例如任务被取消（asyncio.CancelledError），不计入失败，但要结束这次占用
+                self._release(backend)
+                raise
+            self._succeeded(backend, time.perf_counter() - start)
+            break
+        try:
+            if first is not _EMPTY:
+                yield first
+            async for chunk in stream:
+                yield chunk
+        finally:
+            self._release(backend)
+            await stream.aclose()
+
+    def check_health(self) -> Dict[str, bool]:
+        """立即检查所有后端，返回 后端名 -> 是否健康"""
+        results = {}
+        for backend in self.backends:
+            ok = self.health_check(backend.llm)
+            with self._lock:
+                if ok:
+                    backend.failures = 0
+                    backend.down_until = 0.0
+                else:
+                    backend.down_until = time.monotonic() + self.cooldown
+            results[backend.name] = ok
+        return results
+
+    def _check_loop(self, interval: float):
+        while not self._closed.wait(interval):
+            try:
+                self.check_health()
+            except Exception:
+                pass
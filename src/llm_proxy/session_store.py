@@ -0,0 +1,285 @@
+import atexit
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Set
+from .llm_base import LLMMessage
+
+
+class SessionStore(ABC):
+    """会话存储后端
+
+    LLMBase.bind_session 之后，llm.session 的读写都经过存储：
+    - get 返回可以直接修改的消息列表，首次访问时加载；
+    - replace 整体替换会话（clear_session、clear_context 等）。
+    """
+
+    @abstractmethod
+    def get(self, session_id: str) -> List[LLMMessage]:
+        """获取会话的消息列表"""
+        pass
+
+    @abstractmethod
+    def replace(self, session_id: str, messages: List[LLMMessage]) -> None:
+        """用 messages 替换整个会话"""
+        pass
+
+    def delete(self, session_id: str) -> None:
+        self.replace(session_id, [])
+
+    def flush(self) -> None:
+        """把尚未写入的修改写入后端"""
+        pass
+
+    def close(self) -> None:
+        self.flush()
+
+
+class MemorySessionStore(SessionStore):
+    """进程内存储，与不绑定存储时的行为一致，便于在多个 LLM 之间按 ID 共享会话"""
+
+    def __init__(self):
+        self._sessions: Dict[str, List[LLMMessage]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> List[LLMMessage]:
+        session = self._sessions.get(session_id)
+        if session is None:
+            with self._lock:
+                session = self._sessions.setdefault(session_id, [])
+        return session
+
+    def replace(self, session_id: str, messages: List[LLMMessage]) -> None:
+        self._sessions[session_id] = messages if type(messages) is list else list(messages)
+
+    def delete(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+
+class PersistentSession(list):
+    """记录修改的会话列表：追加的消息只写入新增部分，其他修改在下次写入时整体重写"""
+
+    def __init__(self, store: "SQLiteSessionStore", session_id: str, messages: List[LLMMessage] = ()):
+        super().__init__(messages)
+        self._store = store
+        self._session_id = session_id
+
+    def append(self, msg: LLMMessage):
+        with self._store._lock:
+            super().append(msg)
+            self._store._appended(self._session_id, (msg,))
+
+    def extend(self, msgs):
+        msgs = list(msgs)
+        with self._store._lock:
+            super().extend(msgs)
+            self._store._appended(self._session_id, msgs)
+
+    def __iadd__(self, msgs):
+        self.extend(msgs)
+        return self
+
+    def _rewrite(name):
+        method = getattr(list, name)
+
+        def wrapper(self, *args, **kwargs):
+            with self._store._lock:
+                result = method(self, *args, **kwargs)
+                self._store._rewritten(self._session_id)
+            return result
+        wrapper.__name__ = name
+        return wrapper
+
+    insert = _rewrite("insert")
+    pop = _rewrite("pop")
+    remove = _rewrite("remove")
+    clear = _rewrite("clear")
+    sort = _rewrite("sort")
+    reverse = _rewrite("reverse")
+    __setitem__ = _rewrite("__setitem__")
+    __delitem__ = _rewrite("__delitem__")
+    del _rewrite
+
+
+class SQLiteSessionStore(SessionStore):
+    """SQLite 文件存储
+
+    - 会话在首次访问时从文件加载，之后常驻内存；
+    - 追加的消息先写入内存，由后台线程每 flush_interval 秒或积累 batch_size 条后批量写入；
+    - 超过 idle_timeout 秒未访问的会话写入后从内存中移除，下次访问时重新加载。
+
+    进程退出时会自动写入剩余的修改，也可以手动调用 flush 或 close。
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0, batch_size: int = 256,
+                 idle_timeout: Optional[float] = 600.0):
+        """
+        Args:
+            path: SQLite 文件路径
+            flush_interval: 后台写入的间隔（秒）
+            batch_size: 未写入的消息达到此数量时立即写入
+            idle_timeout: 会话在内存中的最长空闲时间（秒），None 表示不移出内存
+        """
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS session_messages ("
+            "session_id TEXT, seq INTEGER, role TEXT, content TEXT, PRIMARY KEY (session_id, seq))"
+        )
+        self._db.commit()
+        self._db_lock = threading.Lock()
+
+        self._lock = threading.RLock()
+        self._resident: Dict[str, PersistentSession] = {}
+        self._last_access: Dict[str, float] = {}
+        self._stored: Dict[str, int] = {}  # 已写入文件的消息数
+        self._pending: Dict[str, List[LLMMessage]] = {}  # 等待追加写入的消息
+        self._pending_count = 0
+        self._rewrites: Set[str] = set()  # 需要整体重写的会话
+
+        self._flush_lock = threading.Lock()  # 保证多次写入按顺序落盘
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._writer, daemon=True, name="session-writer")
+        self._thread.start()
+        atexit.register(self.close)
+
+    def get(self, session_id: str) -> List[LLMMessage]:
+        session = self._resident.get(session_id)
+        if session is None:
+            session = self._load(session_id)
+        self._last_access[session_id] = time.monotonic()
+        return session
+
+    def replace(self, session_id: str, messages: List[LLMMessage]) -> None:
+        with self._lock:
+            self._resident[session_id] = PersistentSession(self, session_id, messages)
+            self._last_access[session_id] = time.monotonic()
+            self._rewritten(session_id)
+        self._wakeup.set()
+
+    def delete(self, session_id: str) -> None:
+        with self._flush_lock:
+            with self._lock:
+                self._resident.pop(session_id, None)
+                self._last_access.pop(session_id, None)
+                self._pending_count -= len(self._pending.pop(session_id, ()))
+                self._rewrites.discard(session_id)
+                self._stored.pop(session_id, None)
+            with self._db_lock:
+                self._db.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+                self._db.commit()
+
+    def resident_sessions(self) -> List[str]:
+        """当前在内存中的会话 ID"""
+        return list(self._resident)
+
+    def evict(self, session_id: str) -> None:
+        """写入并从内存中移除会话，下次访问时重新加载"""
+        self.flush()
+        with self._lock:
+            if session_id not in self._pending and session_id not in self._rewrites:
+                self._resident.pop(session_id, None)
+                self._last_access.pop(session_id, None)
+
+    def evict_idle(self) -> int:
+        """移除空闲超过 idle_timeout 的会话，返回移除的数量"""
+        if self.idle_timeout is None:
+            return 0
+        deadline = time.monotonic() - self.idle_timeout
+        idle = [sid for sid, last in list(self._last_access.items()) if last < deadline]
+        if not idle:
+            return 0
+        self.flush()
+        evicted = 0
+        with self._lock:
+            for sid in idle:
+                last = self._last_access.get(sid)
+                if last is None or last >= deadline or sid in self._pending or sid in self._rewrites:
+                    continue
+                self._resident.pop(sid, None)
+                del self._last_access[sid]
+                evicted += 1
+        return evicted
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            if not self._pending and not self._rewrites:
+                return
+            rewrites = {sid: list(self._resident.get(sid, ())) for sid in self._rewrites}
+            appends = {sid: msgs for sid, msgs in self._pending.items() if sid not in rewrites}
+            self._pending = {}
+            self._pending_count = 0
+            self._rewrites = set()
+            starts = {sid: self._stored.get(sid, 0) for sid in appends}
+            for sid, msgs in rewrites.items():
+                self._stored[sid] = len(msgs)
+            for sid, msgs in appends.items():
+                self._stored[sid] = starts[sid] + len(msgs)
+
+        rows = []
+        for sid, msgs in appends.items():
+            rows.extend((sid, starts[sid] + i, msg.role, msg.content) for i, msg in enumerate(msgs))
+        with self._db_lock:
+            for sid, msgs in rewrites.items():
+                self._db.execute("DELETE FROM session_messages WHERE session_id = ?", (sid,))
+                rows.extend((sid, i, msg.role, msg.content) for i, msg in enumerate(msgs))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO session_messages (session_id, seq, role, content) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._db.commit()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        atexit.unregister(self.close)
+
+    def _load(self, session_id: str) -> PersistentSession:
+        with self._lock:
+            session = self._resident.get(session_id)
+            if session is not None:
+                return session
+            with self._db_lock:
+                rows = self._db.execute(
+                    "SELECT role, content FROM session_messages WHERE session_id = ? ORDER BY seq",
+                    (session_id,)
+                ).fetchall()
+            session = PersistentSession(self, session_id, [LLMMessage(role, content) for role, content in rows])
+            self._resident[session_id] = session
+            self._stored[session_id] = len(rows)
+            return session
+
+    # 以下两个方法由 PersistentSession 在持有 _lock 时调用
+    def _appended(self, session_id: str, msgs):
+        if session_id in self._rewrites:
+            return
+        self._pending.setdefault(session_id, []).extend(msgs)
+        self._pending_count += len(msgs)
+        if self._pending_count >= self.batch_size:
+            self._wakeup.set()
+
+    def _rewritten(self, session_id: str):
+        self._pending_count -= len(self._pending.pop(session_id, ()))
+        self._rewrites.add(session_id)
+
+    def _writer(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._closed:
+                return
+            self.flush()
+            self.evict_idle()
@@ -0,0 +1,262 @@
+import json
+import logging
+from typing import Any, AsyncGenerator, AsyncIterable, Callable, Dict, Generator, Iterable, List, Optional
+
+try:
+    import orjson
+    _fast_loads = orjson.loads
+except ImportError:
+    _fast_loads = None
+
+_json_decoder = json.JSONDecoder()
+_scan_once = _json_decoder.scan_once
+
+logger = logging.getLogger(__name__)
+
+# 处理格式错误的数据帧：(原始数据, 异常)
+ErrorCallback = Callable[[bytes, Exception], None]
+# 处理流中的 usage 字段（请求带 stream_options.include_usage 时最后一个数据帧返回）
+UsageCallback = Callable[[Dict[str, Any]], None]
+
+DONE = b"[DONE]"
+
+
+def json_loads(data: bytes) -> Any:
+    """标准库后端
+
+    直接调用 C 实现的扫描器，省去 json.loads 的编码探测和两层 Python 包装；
+    扫描失败或有多余内容时退回完整的 decode，以得到准确的错误信息。
+    """
+    text = data.decode("utf-8")
+    try:
+        obj, end = _scan_once(text, 0)
+    except StopIteration:
+        return _json_decoder.decode(text)
+    if end != len(text):
+        return _json_decoder.decode(text)
+    return obj
+
+
+def default_loads() -> Callable[[bytes], Any]:
+    """返回可用的最快 JSON 解析函数，安装了 orjson 时使用 orjson"""
+    return _fast_loads or json_loads
+
+
+def _log_error(data: bytes, error: Exception) -> None:
+    logger.warning("SSE 数据帧解析失败: %r (%s)", data[:200], error)
+
+
+class SSEDecoder:
+    """字节级增量 SSE 解码器
+
+    直接在字节上按事件边界切分，不逐行解码字符串；支持多行 data 事件、
+    \\r\\n / \\r / \\n 三种换行，以及跨越多次读取的数据帧。
+    缓冲区只保留尚未结束的最后一个事件。
+    """
+
+    def __init__(self):
+        self._tail = b""
+        self._pending_cr = False
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """输入一段原始字节，返回其中已完整的事件的 data 字段"""
+        if self._pending_cr:
+            chunk = b"\r" + chunk
+            self._pending_cr = False
+        if b"\r" in chunk:
+            # \r\n 可能被拆到两次读取中，末尾的 \r 留到下一次处理
+            if chunk.endswith(b"\r"):
+                chunk = chunk[:-1]
+                self._pending_cr = True
+            chunk = chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+        if self._tail:
+            chunk = self._tail + chunk
+        blocks = chunk.split(b"\n\n")
+        # 最后一段是尚未结束的事件
+        self._tail = blocks.pop()
+
+        events = []
+        for block in blocks:
+            # 最常见的情况：单行 data 事件
+            if block[:6] == b"data: " and b"\n" not in block:
+                events.append(block[6:])
+            elif block:
+                data = self._parse_event(block)
+                if data is not None:
+                    events.append(data)
+        return events
+
+    def flush(self) -> List[bytes]:
+        """流结束时处理缓冲区中没有以空行结尾的最后一个事件"""
+        self._pending_cr = False
+        tail, self._tail = self._tail.strip(b"\r\n"), b""
+        data = self._parse_event(tail) if tail else None
+        return [data] if data is not None else []
+
+    @staticmethod
+    def _parse_event(block: bytes) -> Optional[bytes]:
+        data_lines = []
+        for line in block.split(b"\n"):
+            # 注释行和 event/id/retry 字段对补全流没有意义，直接忽略
+            if line.startswith(b"data:"):
+                value = line[5:]
+                if value[:1] == b" ":
+                    value = value[1:]
+                data_lines.append(value)
+        if not data_lines:
+            return None
+        return b"\n".join(data_lines)
+
+
+def _decode_events(events: List[bytes], loads: Callable[[bytes], Any], on_error: ErrorCallback) -> tuple[List[Any], bool]:
+    """解析一批 data 字段，返回 (JSON 事件列表, 是否收到 [DONE])"""
+    parsed = []
+    for data in events:
+        if data == DONE:
+            return parsed, True
+        try:
+            parsed.append(loads(data))
+        except ValueError as e:
+            if data.strip() == DONE:
+                return parsed, True
+            on_error(data, e)
+    return parsed, False
+
+
+def _decode_deltas(events: List[bytes], loads: Callable[[bytes], Any], on_error: ErrorCallback,
+                   on_usage: Optional[UsageCallback] = None) -> tuple[List[str], bool]:
+    """解析一批 data 字段并直接取出文本增量，返回 (非空文本列表, 是否收到 [DONE])
+
+    热路径，按批处理以减少每帧的函数调用和生成器开销。
+    """
+    contents = []
+    for data in events:
+        if data == DONE:
+            return contents, True
+        try:
+            event = loads(data)
+        except ValueError as e:
+            if data.strip() == DONE:
+                return contents, True
+            on_error(data, e)
+            continue
+        if on_usage is not None:
+            report_usage(event, on_usage)
+        try:
+            content = event["choices"][0]["delta"].get("content")
+        except (KeyError, IndexError, TypeError, AttributeError):
+            continue
+        if content:
+            contents.append(content)
+    return contents, False
+
+
+def report_usage(event: Any, on_usage: UsageCallback):
+    """事件带非空的 usage 字段时交给 on_usage；包含 usage 的数据帧的 choices 通常为空"""
+    if type(event) is dict:
+        usage = event.get("usage")
+        if usage:
+            on_usage(usage)
+
+
+def iter_sse_json(
+    chunks: Iterable[bytes],
+    on_error: Optional[ErrorCallback] = None,
+    loads: Optional[Callable[[bytes], Any]] = None
+) -> Generator[Dict[str, Any], None, None]:
+    """把原始字节流解码为 JSON 事件
+
+    收到 [DONE] 后停止产出，但会继续读完输入，HTTP 连接才能放回连接池。
+
+    Args:
+        chunks: 原始字节块，块边界可以落在任意位置
+        on_error: 格式错误的数据帧的回调，默认写入日志
+        loads: JSON 解析函数，默认使用 default_loads()
+    """
+    decoder = SSEDecoder()
+    loads = loads or default_loads()
+    on_error = on_error or _log_error
+    done = False
+    for chunk in chunks:
+        if done:
+            continue
+        parsed, done = _decode_events(decoder.feed(chunk), loads, on_error)
+        yield from parsed
+    if not done:
+        parsed, _ = _decode_events(decoder.flush(), loads, on_error)
+        yield from parsed
+
+
+async def aiter_sse_json(
+    chunks: AsyncIterable[bytes],
+    on_error: Optional[ErrorCallback] = None,
+    loads: Optional[Callable[[bytes], Any]] = None
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """iter_sse_json 的异步版本"""
+    decoder = SSEDecoder()
+    loads = loads or default_loads()
+    on_error = on_error or _log_error
+    done = False
+    async for chunk in chunks:
+        if done:
+            continue
+        parsed, done = _decode_events(decoder.feed(chunk), loads, on_error)
+        for event in parsed:
+            yield event
+    if not done:
+        parsed, _ = _decode_events(decoder.flush(), loads, on_error)
+        for event in parsed:
+            yield event
+
+
+def delta_content(event: Dict[str, Any]) -> str:
+    """取出补全事件中 choices[0].delta.content，没有内容时返回空字符串"""
+    try:
+        return event["choices"][0]["delta"].get("content") or ""
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return ""
+
+
+def iter_deltas(
+    chunks: Iterable[bytes],
+    on_error: Optional[ErrorCallback] = None,
+    loads: Optional[Callable[[bytes], Any]] = None,
+    on_usage: Optional[UsageCallback] = None
+) -> Generator[str, None, None]:
+    """把原始字节流解码为文本增量，跳过空内容，参数同 iter_sse_json；on_usage 接收流中的 usage 字段"""
+    decoder = SSEDecoder()
+    loads = loads or default_loads()
+    on_error = on_error or _log_error
+    done = False
+    for chunk in chunks:
+        if done:
+            continue
+        contents, done = _decode_deltas(decoder.feed(chunk), loads, on_error, on_usage)
+        yield from contents
+    if not done:
+        contents, _ = _decode_deltas(decoder.flush(), loads, on_error, on_usage)
+        yield from contents
+
+
+async def aiter_deltas(
+    chunks: AsyncIterable[bytes],
+    on_error: Optional[ErrorCallback] = None,
+    loads: Optional[Callable[[bytes], Any]] = None,
+    on_usage: Optional[UsageCallback] = None
+) -> AsyncGenerator[str, None]:
+    """iter_deltas 的异步版本"""
+    decoder = SSEDecoder()
+    loads = loads or default_loads()
+    on_error = on_error or _log_error
+    done = False
+    async for chunk in chunks:
+        if done:
+            continue
+        contents, done = _decode_deltas(decoder.feed(chunk), loads, on_error, on_usage)
+        for content in contents:
+            yield content
+    if not done:
+        contents, _ = _decode_deltas(decoder.flush(), loads, on_error, on_usage)
+        for content in contents:
+            yield content
@@ -0,0 +1,147 @@
+import re
+from typing import List, NamedTuple, Sequence, Tuple
+
+
+class TagDialect(NamedTuple):
+    """函数调用的定界符"""
+    start: str
+    end: str
+
+
+# <function_call>tool_name(parameter_JSON)</function_call>
+FUNCTION_CALL_TAG = TagDialect("<function_call>", "</function_call>")
+# <tool_call>{"name": ..., "arguments": {...}}</tool_call>，Hermes/Qwen 等模型的常见格式
+TOOL_CALL_TAG = TagDialect("<tool_call>", "</tool_call>")
+
+# 扫描结果：('text', 普通文本) 或 ('call', 定界符之间的内容)
+ScanEvent = Tuple[str, str]
+
+
+class TagScanner:
+    """增量的函数调用标签扫描器
+
+    按状态机逐块扫描，每个字符只被检查常数次，总开销与流长度成线性关系：
+    - 标签外只保留可能是开始标签前缀的末尾几个字符，内存有上界；
+    - 不含标签的数据块原样输出，不做切片；
+    - 标签内的内容按块追加，只在结束标签出现时拼接一次，
+      查找结束标签时只回看上一块末尾 len(end)-1 个字符。
+
+    每个流使用独立的实例。
+    """
+
+    def __init__(self, dialects: Sequence[TagDialect] = (FUNCTION_CALL_TAG,)):
+        if not dialects:
+            raise ValueError("至少需要一种定界符")
+        self.dialects = list(dialects)
+        self._start_re = re.compile("|".join(re.escape(d.start) for d in self.dialects))
+        self._end_by_start = {d.start: d.end for d in self.dialects}
+        self._start_chars = frozenset(d.start[0] for d in self.dialects)
+        self._max_held = max(len(d.start) for d in self.dialects) - 1
+        # 所有开始标签的真前缀，用于判断块末尾是否可能是被截断的标签
+        self._prefixes = frozenset(d.start[:k] for d in self.dialects for k in range(1, len(d.start)))
+
+        self._held = ""         # 标签外：块末尾可能是开始标签前缀的部分
+        self._start = None      # 标签内：当前开始标签
+        self._end = None        # 标签内：当前结束标签
+        self._parts: List[str] = []  # 标签内：已收到的内容
+        self._tail = ""         # 标签内：内容末尾 len(end)-1 个字符
+
+    @property
+    def in_call(self) -> bool:
+        """是否处于未闭合的函数调用中"""
+        return self._end is not None
+
+    def feed(self, chunk: str) -> List[ScanEvent]:
+        """输入一个数据块，返回按文档顺序排列的扫描结果"""
+        events: List[ScanEvent] = []
+        if not chunk:
+            return events
+
+        if self._end is None and not self._held:
+            # 快速路径：没有任何开始标签的首字符，整块原样输出
+            for c in self._start_chars:
+                if c in chunk:
+                    break
+            else:
+                events.append(('text', chunk))
+                return events
+
+        data = self._held + chunk if self._held else chunk
+        self._held = ""
+        pos = 0
+        n = len(data)
+        while pos < n:
+            if self._end is None:
+                pos = self._scan_text(data, pos, events)
+            else:
+                pos = self._scan_call(data, pos, events)
+        return events
+
+    def flush(self) -> List[ScanEvent]:
+        """流结束时调用，把剩余内容（被截断的标签前缀、未闭合的调用）作为普通文本返回"""
+        events: List[ScanEvent] = []
+        if self._end is not None:
+            events.append(('text', self._start + ''.join(self._parts)))
+        elif self._held:
+            events.append(('text', self._held))
+        self._reset()
+        return events
+
+    def _reset(self):
+        self._held = ""
+        self._start = None
+        self._end = None
+        self._parts = []
+        self._tail = ""
+
+    def _scan_text(self, data: str, pos: int, events: List[ScanEvent]) -> int:
+        match = self._start_re.search(data, pos)
+        if match is not None:
+            idx = match.start()
+            if idx > pos:
+                events.append(('text', data[pos:idx]))
+            self._start = match.group()
+            self._end = self._end_by_start[self._start]
+            return match.end()
+
+        # 没有完整的开始标签，保留可能是标签前缀的末尾；前缀只能从开始标签的首字符开始
+        n = len(data)
+        held_at = n
+        lo = max(pos, n - self._max_held)
+        for c in self._start_chars:
+            i = data.find(c, lo)
+            while i != -1 and i < held_at:
+                if data[i:] in self._prefixes:
+                    held_at = i
+                    break
+                i = data.find(c, i + 1)
+        if held_at < n:
+            self._held = data[held_at:]
+        if held_at > pos:
+            events.append(('text', data if pos == 0 and held_at == n else data[pos:held_at]))
+        return n
+
+    def _scan_call(self, data: str, pos: int, events: List[ScanEvent]) -> int:
+        end = self._end
+        tail = self._tail
+        window = tail + data[pos:] if tail else data[pos:] if pos else data
+        idx = window.find(end)
+        if idx == -1:
+            self._parts.append(data[pos:] if pos else data)
+            self._tail = window[-(len(end) - 1):] if len(end) > 1 else ""
+            return len(data)
+
+        # 结束标签可能从上一块末尾开始
+        cut = idx - len(tail)
+        if cut >= 0:
+            self._parts.append(data[pos:pos + cut])
+            content = ''.join(self._parts)
+        else:
+            content = ''.join(self._parts)
+            content = content[:len(content) + cut]
+        events.append(('call', content))
+        self._start = None
+        self._end = None
+        self._parts = []
+        self._tail = ""
+        return pos + cut + len(end)
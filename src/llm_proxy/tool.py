@@ -1,5 +1,8 @@
-from typing import Dict, Any, Generator, Union
+from typing import ClassVar, Dict, Any, Generator, AsyncGenerator, Optional, Tuple, Union
 from abc import ABC, abstractmethod
+import asyncio
+import functools
+import inspect
 import json
 from pydantic import BaseModel
 
@@ -7,6 +10,23 @@ class BaseTool:
     name: str
     description: str
     argSchema: type[BaseModel]
+    # 并发执行（ToolExecutor）时的同时执行上限，None 表示不限制
+    max_concurrency: Optional[int] = None
+    # 单次调用的超时时间（秒）：并发执行（ToolExecutor）时 None 表示使用执行器的默认值；
+    # execution 为 thread/process 时 None 表示不限制，process 模式超时会终止工作进程
+    timeout: Optional[float] = None
+    # 执行方式：inline 在读取 LLM 流的线程上执行，thread 在共享线程池中执行，
+    # process 在常驻的工作进程中执行（CPU 密集或不可信的工具），见 tool_workers
+    execution: str = "inline"
+    # 工具专用的结果缓存（ToolCache），None 时使用 FunctionCall 上的缓存
+    cache: Optional[Any] = None
+    # 有副作用的工具应设为 False，不使用任何缓存
+    cacheable: bool = True
+
+    # 类级别缓存：argSchema -> JSON Schema，(name, description, argSchema) -> 提示片段
+    # 同一个类的工具只生成一次 Schema，实例修改 name/description 后会生成新的片段
+    _schema_cache: ClassVar[Dict[type, Dict[str, Any]]] = {}
+    _prompt_cache: ClassVar[Dict[Tuple[str, str, type], str]] = {}
 
     def _parse_args(self, args: str):
         return self.argSchema.model_validate_json(args)
@@ -19,11 +39,37 @@ class BaseTool:
             Union[Any, Generator[str, None, None]]: 可以返回单个结果或生成器
         """
         pass
-    
+
+    async def _arun(self, **kwargs) -> Union[Any, Generator[str, None, None], AsyncGenerator[str, None]]:
+        """异步运行工具
+
+        _run 为协程函数时直接 await，为异步生成器函数时直接返回异步生成器；
+        普通同步工具在线程池中执行，避免阻塞事件循环。原生异步工具也可以直接重写此方法。
+        """
+        if inspect.iscoroutinefunction(self._run):
+            return await self._run(**kwargs)
+        if inspect.isasyncgenfunction(self._run):
+            return self._run(**kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(self._run, **kwargs))
+
+    def get_arg_schema(self) -> Dict[str, Any]:
+        """参数的 JSON Schema，按 argSchema 缓存，调用方不应修改返回值"""
+        schema = BaseTool._schema_cache.get(self.argSchema)
+        if schema is None:
+            schema = self.argSchema.model_json_schema()
+            BaseTool._schema_cache[self.argSchema] = schema
+        return schema
+
     def __str__(self):
-        return json.dumps({
-            "name": self.name,
-            "description": self.description,
-            "argSchema": self.argSchema.model_json_schema()
-        })
+        key = (self.name, self.description, self.argSchema)
+        prompt = BaseTool._prompt_cache.get(key)
+        if prompt is None:
+            prompt = json.dumps({
+                "name": self.name,
+                "description": self.description,
+                "argSchema": self.get_arg_schema()
+            })
+            BaseTool._prompt_cache[key] = prompt
+        return prompt
 
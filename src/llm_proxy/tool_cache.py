@@ -0,0 +1,256 @@
+import asyncio
+import functools
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+from pydantic import ValidationError
+
+# 结果不可缓存（如生成器）时交给等待者的标记，等待者需要自己执行
+_UNCACHEABLE = object()
+
+
+class ToolCache:
+    """工具调用结果缓存
+
+    以 工具名 + 经 argSchema 校验、规范化后的参数 为键，相同调用直接复用结果：
+    - 内存中按 LRU 淘汰，条目数不超过 max_entries，可设置 ttl 过期时间；
+    - 可选 SQLite 文件作为二级存储，进程重启后仍然有效；
+    - 并发的相同调用只执行一次，其余调用等待并共享结果；
+    - 生成器结果和执行出错不会被缓存。
+
+    有副作用的工具应设置 cacheable = False。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None,
+                 path: Optional[str] = None, max_disk_entries: int = 100000):
+        """
+        Args:
+            max_entries: 内存中最多保留的条目数
+            ttl: 条目的有效期（秒），None 表示不过期
+            path: SQLite 文件路径，为 None 时只使用内存
+            max_disk_entries: 文件中最多保留的条目数
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self._entries: "OrderedDict[str, Tuple[Optional[float], Any]]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # 等待同一次执行的调用数
+        self.disk_hits = 0
+
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS tool_cache (key TEXT PRIMARY KEY, expires REAL, value BLOB)"
+            )
+            self._db.commit()
+            self._db_lock = threading.Lock()
+            self._writes = 0
+
+    def make_key(self, tool: Any, params: Dict[str, Any]) -> Optional[str]:
+        """生成缓存键，参数无法通过 argSchema 校验时返回 None"""
+        try:
+            canonical = tool.argSchema.model_validate(params).model_dump_json()
+        except ValidationError:
+            return None
+        return f"{tool.name}:{canonical}"
+
+    def call(self, tool: Any, params: Dict[str, Any], run: Callable[[], Any] = None) -> Any:
+        """带缓存地执行 tool._run(**params)
+
+        Args:
+            run: 代替 tool._run(**params) 执行调用，例如在工作进程中执行
+        """
+        if run is None:
+            run = functools.partial(tool._run, **params)
+        key = self.make_key(tool, params)
+        if key is None:
+            return run()
+
+        found, value, future, owner = self._claim(key)
+        if found:
+            return value
+        if not owner:
+            value = future.result()
+            return run() if value is _UNCACHEABLE else value
+
+        try:
+            value = run()
+        except BaseException as e:
+            self._resolve(key, future, error=e)
+            raise
+        self._resolve(key, future, value)
+        return value
+
+    async def acall(self, tool: Any, params: Dict[str, Any]) -> Any:
+        """call 的异步版本，通过 tool._arun 执行"""
+        key = self.make_key(tool, params)
+        if key is None:
+            return await tool._arun(**params)
+
+        found, value, future, owner = self._claim(key)
+        if found:
+            return value
+        if not owner:
+            value = await asyncio.wrap_future(future)
+            return await tool._arun(**params) if value is _UNCACHEABLE else value
+
+        try:
+            value = await tool._arun(**params)
+        except BaseException as e:
+            self._resolve(key, future, error=e)
+            raise
+        self._resolve(key, future, value)
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        """命中统计，用于调整容量和有效期"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "disk_hits": self.disk_hits,
+            "entries": len(self._entries),
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM tool_cache")
+                self._db.commit()
+
+    def _claim(self, key: str) -> Tuple[bool, Any, Optional[Future], bool]:
+        """查找缓存，未命中时登记一次执行
+
+        Returns:
+            (是否命中, 命中的值, 执行中的 Future, 当前调用是否负责执行)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires is None or expires > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value, None, False
+                del self._entries[key]
+
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return False, None, future, False
+
+            future = Future()
+            self._inflight[key] = future
+
+        # 二级存储的查询放在锁外，期间的相同调用会等待这个 Future
+        try:
+            found, value, expires = self._disk_get(key)
+        except BaseException as e:
+            self._resolve(key, future, error=e)
+            raise
+        if found:
+            with self._lock:
+                self.hits += 1
+                self.disk_hits += 1
+                self._store(key, expires, value)
+                del self._inflight[key]
+            future.set_result(value)
+            return True, value, None, False
+
+        with self._lock:
+            self.misses += 1
+        return False, None, future, True
+
+    def _resolve(self, key: str, future: Future, value: Any = None, error: BaseException = None):
+        cacheable = error is None and not _is_stream(value)
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if cacheable:
+                self._store(key, expires, value)
+            del self._inflight[key]
+        if error is not None:
+            future.set_exception(error)
+            return
+        future.set_result(value if cacheable else _UNCACHEABLE)
+        if cacheable:
+            self._disk_put(key, expires, value)
+
+    def _store(self, key: str, expires: Optional[float], value: Any):
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_get(self, key: str) -> Tuple[bool, Any, Optional[float]]:
+        """查询二级存储；读取失败或条目无法反序列化时视为未命中，并删除损坏的条目"""
+        if self._db is None:
+            return False, None, None
+        try:
+            with self._db_lock:
+                row = self._db.execute("SELECT expires, value FROM tool_cache WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            return False, None, None
+        if row is None:
+            return False, None, None
+        expires, blob = row
+        if expires is not None and expires <= time.time():
+            return False, None, None
+        try:
+            return True, pickle.loads(blob), expires
+        except Exception:
+            self._disk_delete(key)
+            return False, None, None
+
+    def _disk_delete(self, key: str):
+        try:
+            with self._db_lock:
+                self._db.execute("DELETE FROM tool_cache WHERE key = ?", (key,))
+                self._db.commit()
+        except sqlite3.Error:
+            pass
+
+    def _disk_put(self, key: str, expires: Optional[float], value: Any):
+        """写入二级存储；写入失败（例如数据库被锁定）只是少缓存一个结果，不影响这次调用"""
+        if self._db is None:
+            return
+        try:
+            blob = pickle.dumps(value)
+        except Exception:
+            return
+        with self._db_lock:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO tool_cache (key, expires, value) VALUES (?, ?, ?)",
+                    (key, expires, blob)
+                )
+                self._writes += 1
+                # 定期清理过期和超出容量的条目
+                if self._writes % 1000 == 0:
+                    self._db.execute("DELETE FROM tool_cache WHERE expires IS NOT NULL AND expires <= ?", (time.time(),))
+                    self._db.execute(
+                        "DELETE FROM tool_cache WHERE rowid NOT IN "
+                        "(SELECT rowid FROM tool_cache ORDER BY rowid DESC LIMIT ?)",
+                        (self.max_disk_entries,)
+                    )
+                self._db.commit()
+            except sqlite3.Error:
+                try:
+                    self._db.rollback()
+                except sqlite3.Error:
+                    pass
+
+
+def _is_stream(value: Any) -> bool:
+    return hasattr(value, "__next__") or hasattr(value, "__anext__")
@@ -0,0 +1,214 @@
+"""原生工具调用（OpenAI tools 参数）
+
+文本模式下工具的 JSON Schema 写在系统提示里，模型输出 <function_call>name(json)</function_call>，
+由 TagScanner 在每个数据块中查找。原生模式下工具通过请求的 tools 参数发送，
+模型以 choices[0].delta.tool_calls 增量返回调用，这里把增量拼成完整的 ToolCall：
+- 后端的流中文本增量照常以 str 产出，完整的调用以 ToolCall（str 的子类）产出，
+  对只处理文本的中间层（重试、路由、限流、span）透明；
+- FunctionCall.handle_stream(native=True) 用 NativeScanner 按类型区分两者，不扫描文本；
+- 参数用工具的 argSchema 校验一次，JSON 格式错误时用 json-repair 修复后重试。
+"""
+import json
+from typing import Any, AsyncGenerator, AsyncIterable, Callable, Dict, Generator, Iterable, List, Optional
+from .sse import SSEDecoder, default_loads, report_usage, _decode_events, _log_error, ErrorCallback, UsageCallback
+
+
+class ToolCall(str):
+    """模型返回的一次完整工具调用
+
+    字符串值为文本模式下定界符之间的写法 name(arguments)，结果中显示的调用与文本模式一致。
+    """
+
+    def __new__(cls, name: str, arguments: str, id: str = ""):
+        call = super().__new__(cls, f"{name}({arguments})")
+        call.name = name
+        call.arguments = arguments
+        call.id = id
+        return call
+
+    def __reduce__(self):
+        return ToolCall, (self.name, self.arguments, self.id)
+
+
+class ToolCallAssembler:
+    """把 delta.tool_calls 增量拼成完整的 ToolCall
+
+    同一个调用的增量按 index 归并：第一个增量带 id 和 name，之后的增量只带 arguments 片段。
+    出现下一个 index 的调用、新的文本或 finish_reason 时，之前的调用视为完整。
+    """
+
+    def __init__(self):
+        self._calls: Dict[int, List[Any]] = {}  # index -> [id, name, 参数片段列表]
+
+    def feed(self, event: Dict[str, Any]) -> List[str]:
+        """处理一个补全事件，返回其中的文本增量和已完整的调用"""
+        try:
+            choice = event["choices"][0]
+            delta = choice.get("delta") or {}
+        except (KeyError, IndexError, TypeError, AttributeError):
+            return []
+        out = []
+        content = delta.get("content")
+        if content:
+            # 调用之后又出现文本，说明之前的调用都已完整
+            out.extend(self.flush())
+            out.append(content)
+        for part in delta.get("tool_calls") or ():
+            index = part.get("index", 0)
+            if index not in self._calls:
+                # 新的调用开始，之前的调用都已完整
+                out.extend(self._complete(lambda i: i < index))
+                self._calls[index] = ["", "", []]
+            call = self._calls[index]
+            if part.get("id"):
+                call[0] = part["id"]
+            function = part.get("function") or {}
+            if function.get("name"):
+                call[1] += function["name"]
+            if function.get("arguments"):
+                call[2].append(function["arguments"])
+        if choice.get("finish_reason"):
+            out.extend(self.flush())
+        return out
+
+    def flush(self) -> List[ToolCall]:
+        """流结束时返回所有尚未返回的调用"""
+        return self._complete(lambda i: True)
+
+    def _complete(self, selected: Callable[[int], bool]) -> List[ToolCall]:
+        done = sorted(i for i in self._calls if selected(i))
+        return [self._build(self._calls.pop(i)) for i in done]
+
+    @staticmethod
+    def _build(call: List[Any]) -> ToolCall:
+        return ToolCall(call[1], "".join(call[2]) or "{}", call[0])
+
+
+def iter_tool_deltas(
+    chunks: Iterable[bytes],
+    on_error: Optional[ErrorCallback] = None,
+    loads: Optional[Callable[[bytes], Any]] = None,
+    on_usage: Optional[UsageCallback] = None
+) -> Generator[str, None, None]:
+    """iter_deltas 的原生工具调用版本：产出文本增量和 ToolCall"""
+    decoder = SSEDecoder()
+    assembler = ToolCallAssembler()
+    loads = loads or default_loads()
+    on_error = on_error or _log_error
+    done = False
+    for chunk in chunks:
+        if done:
+            continue
+        events, done = _decode_events(decoder.feed(chunk), loads, on_error)
+        for event in events:
+            if on_usage is not None:
+                report_usage(event, on_usage)
+            yield from assembler.feed(event)
+    if not done:
+        events, _ = _decode_events(decoder.flush(), loads, on_error)
+        for event in events:
+            if on_usage is not None:
+                report_usage(event, on_usage)
+            yield from assembler.feed(event)
+    yield from assembler.flush()
+
+
+async def aiter_tool_deltas(
+    chunks: AsyncIterable[bytes],
+    on_error: Optional[ErrorCallback] = None,
+    loads: Optional[Callable[[bytes], Any]] = None,
+    on_usage: Optional[UsageCallback] = None
+) -> AsyncGenerator[str, None]:
+    """iter_tool_deltas 的异步版本"""
+    decoder = SSEDecoder()
+    assembler = ToolCallAssembler()
+    loads = loads or default_loads()
+    on_error = on_error or _log_error
+    done = False
+    async for chunk in chunks:
+        if done:
+            continue
+        events, done = _decode_events(decoder.feed(chunk), loads, on_error)
+        for event in events:
+            if on_usage is not None:
+                report_usage(event, on_usage)
+            for item in assembler.feed(event):
+                yield item
+    if not done:
+        events, _ = _decode_events(decoder.flush(), loads, on_error)
+        for event in events:
+            if on_usage is not None:
+                report_usage(event, on_usage)
+            for item in assembler.feed(event):
+                yield item
+    for item in assembler.flush():
+        yield item
+
+
+class NativeScanner:
+    """与 TagScanner 接口相同，按类型区分文本和 ToolCall，不扫描文本内容"""
+
+    def feed(self, chunk: str) -> List[tuple]:
+        return [('call', chunk)] if isinstance(chunk, ToolCall) else [('text', chunk)]
+
+    def flush(self) -> List[tuple]:
+        return []
+
+
+def parse_arguments(tool: Any, arguments: str) -> Dict[str, Any]:
+    """用工具的 argSchema 校验参数，返回校验后的参数字典
+
+    JSON 格式错误（例如被截断、单引号、多余的逗号）时用 json-repair 修复后再校验一次；
+    修复后仍不合法时抛出原来的错误。
+    """
+    try:
+        return tool._parse_args(arguments).model_dump()
+    except ValueError as e:
+        if not _is_json_error(e):
+            raise
+        # json-repair 只在参数格式错误时用到，用到时才导入
+        from json_repair import repair_json
+        repaired = repair_json(arguments)
+        if not repaired:
+            raise
+        try:
+            return tool._parse_args(repaired).model_dump()
+        except ValueError:
+            raise e
+
+
+def _is_json_error(error: ValueError) -> bool:
+    errors = getattr(error, "errors", None)
+    if errors is None:
+        return isinstance(error, json.JSONDecodeError)
+    return any(item.get("type") == "json_invalid" for item in errors())
+
+
+def tool_spec(tool: Any) -> Dict[str, Any]:
+    """工具在 tools 参数中的描述"""
+    return {
+        "type": "function",
+        "function": {
+            "name": tool.name,
+            "description": tool.description,
+            "parameters": compact_schema(tool.get_arg_schema()),
+        },
+    }
+
+
+def compact_schema(schema: Any) -> Any:
+    """去掉 pydantic 为每个模型和字段生成的 title，它们只是名字的重复，对模型没有信息量"""
+    if isinstance(schema, list):
+        return [compact_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    compact = {}
+    for key, value in schema.items():
+        if key == "title" and isinstance(value, str):
+            continue
+        if key in ("properties", "$defs", "definitions") and isinstance(value, dict):
+            # 这里的键是字段名或模型名，可能恰好叫 title
+            compact[key] = {name: compact_schema(item) for name, item in value.items()}
+        else:
+            compact[key] = compact_schema(value)
+    return compact
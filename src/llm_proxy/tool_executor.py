@@ -0,0 +1,172 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Generator, List, Optional, Tuple
+
+
+class ToolCallResult:
+    """一次函数调用的结果通道：工作线程写入，消费者按文档顺序读取
+
+    超时从工具真正开始执行时计算，不包括因并发限制而排队的时间。
+    """
+
+    def __init__(self, tool_name: str, timeout: Optional[float] = None):
+        self.tool_name = tool_name
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._chunks: Deque[str] = deque()
+        self._done = False
+        self._deadline: Optional[float] = None
+        self.cancelled = False
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def poll(self) -> Tuple[List[str], bool]:
+        """不阻塞地取出已产生的结果，返回 (结果块列表, 是否已结束)"""
+        with self._cond:
+            if not self._done and self._deadline is not None and time.monotonic() >= self._deadline:
+                self._expire()
+            chunks = list(self._chunks)
+            self._chunks.clear()
+            return chunks, self._done
+
+    def __iter__(self) -> Generator[str, None, None]:
+        """阻塞地逐块读取结果，超时后产出错误信息并结束"""
+        while True:
+            with self._cond:
+                while not self._chunks and not self._done:
+                    remaining = None if self._deadline is None else self._deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self._expire()
+                        break
+                    self._cond.wait(remaining)
+                chunks = list(self._chunks)
+                self._chunks.clear()
+                done = self._done
+            yield from chunks
+            if done:
+                return
+
+    def cancel(self):
+        """放弃这次调用：通知工作线程停止读取生成器，等待中的读取立即结束"""
+        with self._cond:
+            self.cancelled = True
+            self._done = True
+            self._chunks.clear()
+            self._cond.notify_all()
+
+    def _expire(self):
+        # 线程无法被强制终止，只能通知工作线程停止读取生成器，并丢弃之后的结果
+        self.cancelled = True
+        self._done = True
+        self._chunks.append(f"[Function Call Error: Tool '{self.tool_name}' timed out after {self.timeout}s]")
+
+    def _start(self):
+        with self._cond:
+            if self.timeout:
+                self._deadline = time.monotonic() + self.timeout
+            self._cond.notify_all()
+
+    def _put(self, chunk: str):
+        with self._cond:
+            if not self.cancelled:
+                self._chunks.append(chunk)
+                self._cond.notify_all()
+
+    def _finish(self):
+        with self._cond:
+            self._done = True
+            self._cond.notify_all()
+
+
+class ToolExecutor:
+    """有界线程池，用于并发执行同一响应中的多个函数调用
+
+    FunctionCall 在解析出函数调用后立即提交，LLM 流继续被读取，结果仍按文档顺序输出。
+    可以在多个 Agent 之间共享。
+
+    工具可以通过类属性限制自身：
+    - max_concurrency: 该工具同时执行的最大数量，超出的调用排队等待
+    - timeout: 单次调用的超时时间（秒）
+    """
+
+    def __init__(self, max_workers: int = 8, default_timeout: Optional[float] = None):
+        """
+        Args:
+            max_workers: 线程池大小
+            default_timeout: 工具未设置 timeout 时使用的超时时间（秒），None 表示不限制
+        """
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+        self._lock = threading.Lock()
+        # 工具名 -> [正在执行的数量, 排队的任务]
+        self._limits: Dict[str, List[Any]] = {}
+
+    def submit(
+        self,
+        tool_name: str,
+        fn: Callable[[], Any],
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None
+    ) -> ToolCallResult:
+        """提交一次函数调用
+
+        Args:
+            tool_name: 工具名，用于并发限制和错误信息
+            fn: 执行调用的函数，可以返回结果或生成器
+            max_concurrency: 该工具的并发上限，None 表示不限制
+            timeout: 超时时间（秒），None 时使用 default_timeout
+        """
+        result = ToolCallResult(tool_name, timeout if timeout is not None else self.default_timeout)
+        limited = bool(max_concurrency)
+        task = (result, fn, limited)
+        with self._lock:
+            if limited:
+                state = self._limits.setdefault(tool_name, [0, deque()])
+                if state[0] >= max_concurrency:
+                    state[1].append(task)
+                    return result
+                state[0] += 1
+        self._pool.submit(self._run, *task)
+        return result
+
+    def _run(self, result: ToolCallResult, fn: Callable[[], Any], limited: bool):
+        try:
+            # 在线程池或并发限制的队列中等待时已被取消的调用不再执行
+            if result.cancelled:
+                return
+            result._start()
+            try:
+                output = fn()
+                if isinstance(output, Generator):
+                    for chunk in output:
+                        if result.cancelled:
+                            output.close()
+                            break
+                        result._put(chunk)
+                else:
+                    result._put(output)
+            except Exception as e:
+                result._put(f"[Function Call Error: {str(e)}]")
+        finally:
+            result._finish()
+            if limited:
+                self._release(result.tool_name)
+
+    def _release(self, tool_name: str):
+        with self._lock:
+            state = self._limits[tool_name]
+            if state[1]:
+                # 名额直接交给排队的下一个调用
+                task = state[1].popleft()
+            else:
+                state[0] -= 1
+                return
+        self._pool.submit(self._run, *task)
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,419 @@
+"""工具的线程池和进程池执行
+
+BaseTool.execution 决定工具在哪里运行：
+- "inline"：在读取 LLM 流的线程上直接调用 _run（默认）；
+- "thread"：在共享线程池中运行，调用方可以按 timeout 放弃等待，但线程无法被终止；
+- "process"：在常驻的工作进程中运行，不占用当前进程的 GIL，超时后直接终止工作进程，
+  适合 CPU 密集、可能卡死或不可信的工具。工具实例和参数需要可以 pickle。
+
+两种池的工作者都会被复用：生成器结果逐块从工作者传回，结果读完或调用方提前关闭后，
+工作者回到池中等待下一次调用；只有超时或异常退出的进程会被替换。
+"""
+import atexit
+import contextvars
+import inspect
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Generator, List, Optional, Tuple
+from .cancellation import on_cancel, check_cancelled
+
+EXECUTION_MODES = ("inline", "thread", "process")
+
+# 工作者发回的消息：("result", 值)、("chunk", 结果块)、("done", None)、("error", 错误信息)，
+# 以及对话被取消时 _interrupt 放入的 ("cancelled", None)
+Message = Tuple[str, Any]
+
+
+class ToolTimeoutError(Exception):
+    """工具执行超时"""
+
+    def __init__(self, tool_name: str, timeout: float):
+        super().__init__(f"Tool '{tool_name}' timed out after {timeout}s")
+        self.tool_name = tool_name
+        self.timeout = timeout
+
+
+class ToolWorkerError(Exception):
+    """工具在工作者中抛出了异常，或工作进程意外退出"""
+    pass
+
+
+def validate_params(tool: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    """按 argSchema 校验参数，交给工作者的只有校验后的普通数据"""
+    return tool.argSchema.model_validate(params).model_dump()
+
+
+class _ToolPool:
+    """线程池和进程池共用的调用流程，子类实现具体的收发方式"""
+
+    def call(self, tool: Any, params: Dict[str, Any], timeout: Optional[float] = None) -> Any:
+        """执行 tool._run(**params)
+
+        Returns:
+            _run 返回普通值时返回该值；返回生成器时返回一个逐块读取工作者结果的生成器
+        Raises:
+            ToolTimeoutError: 超时，进程池中的工作者已被终止
+            ToolWorkerError: 工具抛出了异常
+        """
+        params = validate_params(tool, params)
+        deadline = None if not timeout else time.monotonic() + timeout
+        handle = self._start(tool, params)
+        # 对话被取消时中断工作者，阻塞中的读取立即返回
+        detach = on_cancel(lambda: self._interrupt(handle))
+        try:
+            kind, value = self._next(handle, deadline, tool.name, timeout)
+        except BaseException:
+            detach()
+            self._release(handle)
+            raise
+        if kind == "chunk":
+            return self._stream(handle, value, deadline, tool.name, timeout, detach)
+        detach()
+        self._release(handle)
+        if kind == "cancelled":
+            check_cancelled()
+            raise ToolWorkerError("Tool call cancelled")
+        if kind == "error":
+            raise ToolWorkerError(value)
+        return value
+
+    def _next(self, handle: Any, deadline: Optional[float], tool_name: str, timeout: Optional[float]) -> Message:
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        message = self._recv(handle, remaining)
+        if message is None:
+            self._abort(handle)
+            raise ToolTimeoutError(tool_name, timeout)
+        return message
+
+    def _stream(self, handle: Any, first: Any, deadline: Optional[float], tool_name: str,
+                timeout: Optional[float], detach: Callable[[], None]) -> Generator[Any, None, None]:
+        finished = False
+        try:
+            yield first
+            while True:
+                try:
+                    kind, value = self._next(handle, deadline, tool_name, timeout)
+                except (ToolTimeoutError, ToolWorkerError) as e:
+                    finished = True
+                    # 工作者因对话被取消而中断时不产出错误信息
+                    check_cancelled()
+                    yield f"[Function Call Error: {str(e)}]"
+                    return
+                if kind == "chunk":
+                    yield value
+                    continue
+                finished = True
+                if kind == "cancelled":
+                    # 取消不是工具的错误，不把错误信息写进回复
+                    check_cancelled()
+                elif kind == "error":
+                    yield f"[Function Call Error: {value}]"
+                return
+        finally:
+            detach()
+            if not finished:
+                # 调用方提前关闭：通知工作者停止读取生成器
+                self._cancel(handle)
+            self._release(handle)
+
+    def _start(self, tool: Any, params: Dict[str, Any]) -> Any:
+        raise NotImplementedError
+
+    def _recv(self, handle: Any, timeout: Optional[float]) -> Optional[Message]:
+        """读取下一条消息，超时返回 None"""
+        raise NotImplementedError
+
+    def _cancel(self, handle: Any):
+        raise NotImplementedError
+
+    def _abort(self, handle: Any):
+        """超时后的处理"""
+        raise NotImplementedError
+
+    def _interrupt(self, handle: Any):
+        """对话被取消时由取消的线程调用，使阻塞在 _recv 上的调用方立即返回"""
+        raise NotImplementedError
+
+    def _release(self, handle: Any):
+        raise NotImplementedError
+
+
+def _run_tool(tool: Any, params: Dict[str, Any], send, cancelled) -> None:
+    """在工作者中执行工具并通过 send 发回结果，cancelled() 为 True 时停止读取生成器"""
+    try:
+        result = tool._run(**params)
+        if inspect.isgenerator(result):
+            for chunk in result:
+                send(("chunk", chunk))
+                if cancelled():
+                    result.close()
+                    break
+            send(("done", None))
+        else:
+            send(("result", result))
+    except Exception as e:
+        send(("error", str(e)))
+
+
+class ThreadToolPool(_ToolPool):
+    """共享线程池；超时后调用方不再等待，工作线程在下一个结果块时停止"""
+
+    _shared: Optional["ThreadToolPool"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_workers: int = 8):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool-thread")
+
+    @classmethod
+    def shared(cls, **kwargs) -> "ThreadToolPool":
+        """进程内共享的线程池，kwargs 只在首次创建时生效"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(**kwargs)
+            return cls._shared
+
+    def _start(self, tool: Any, params: Dict[str, Any]) -> Tuple["queue.Queue[Message]", threading.Event]:
+        channel: "queue.Queue[Message]" = queue.Queue()
+        cancel = threading.Event()
+        # 复制上下文，工具中的 span 仍然挂在 tool.call 下
+        self._pool.submit(contextvars.copy_context().run, _run_tool, tool, params, channel.put, cancel.is_set)
+        return channel, cancel
+
+    def _recv(self, handle, timeout: Optional[float]) -> Optional[Message]:
+        try:
+            return handle[0].get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _cancel(self, handle):
+        handle[1].set()
+
+    def _abort(self, handle):
+        # 线程无法被强制终止，只能让它在下一个结果块时停止
+        handle[1].set()
+
+    def _interrupt(self, handle):
+        handle[1].set()
+        handle[0].put(("cancelled", None))
+
+    def _release(self, handle):
+        pass
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+
+def _worker_main(conn) -> None:
+    """工作进程的主循环：逐个接收 (工具, 参数) 并执行"""
+    def send(message: Message):
+        try:
+            conn.send(message)
+        except Exception:
+            # 结果无法 pickle 时退回字符串
+            kind, value = message
+            conn.send((kind, str(value)))
+
+    def cancelled() -> bool:
+        return conn.poll() and conn.recv() == "cancel"
+
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            return
+        if task is None:
+            return
+        if task == "cancel":
+            # 生成器已经结束后才收到的取消
+            continue
+        tool, params = task
+        _run_tool(tool, params, send, cancelled)
+
+
+class _ProcessWorker:
+    def __init__(self, context):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child,), daemon=True, name="tool-worker")
+        self.process.start()
+        child.close()
+        self.broken = False
+        self.killed = False  # 已被池终止，超时和取消可能同时发生，只终止一次
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    def alive(self) -> bool:
+        return not self.broken and self.process.is_alive()
+
+    def kill(self):
+        self.broken = True
+        self.process.kill()
+        self.process.join(5)
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+class ProcessToolPool(_ToolPool):
+    """常驻工作进程池
+
+    最多 max_workers 个进程同时执行工具，超出的调用等待空闲进程。
+    进程在首次需要时启动（或调用 warm 预先启动），执行完后留在池中复用；
+    超时的调用会终止对应进程，下一次调用时再补充新进程。
+    """
+
+    _shared: Optional["ProcessToolPool"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_workers: int = None, start_method: str = "spawn", cancel_grace: float = 1.0):
+        """
+        Args:
+            max_workers: 工作进程数上限，默认为 CPU 核数
+            start_method: multiprocessing 的启动方式；spawn 不继承父进程的线程和锁，最安全
+            cancel_grace: 提前关闭生成器结果时等待工作者停止的时间（秒），超过后终止进程
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.cancel_grace = cancel_grace
+        # 没有进程执行的工具时不导入 multiprocessing
+        import multiprocessing
+        self._context = multiprocessing.get_context(start_method)
+        self._slots = threading.BoundedSemaphore(self.max_workers)
+        self._idle: List[_ProcessWorker] = []
+        self._all: List[_ProcessWorker] = []
+        self._lock = threading.Lock()
+        self.started = 0  # 启动过的进程数
+        self.killed = 0  # 因超时、停止生成器失败或对话被取消而终止的进程数
+
+    @classmethod
+    def shared(cls, **kwargs) -> "ProcessToolPool":
+        """进程内共享的工作进程池，kwargs 只在首次创建时生效"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(**kwargs)
+                atexit.register(cls._shared.close)
+            return cls._shared
+
+    def warm(self, count: int = None) -> None:
+        """预先启动 count 个（默认 max_workers 个）空闲进程，避免第一次调用承担启动开销"""
+        count = min(self.max_workers, count or self.max_workers)
+        with self._lock:
+            missing = count - len(self._idle)
+        for _ in range(max(0, missing)):
+            worker = self._spawn()
+            with self._lock:
+                self._idle.append(worker)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"idle": len(self._idle), "started": self.started, "killed": self.killed}
+
+    def _spawn(self) -> _ProcessWorker:
+        worker = _ProcessWorker(self._context)
+        with self._lock:
+            self.started += 1
+            self._all.append(worker)
+        return worker
+
+    def _start(self, tool: Any, params: Dict[str, Any]) -> _ProcessWorker:
+        self._slots.acquire()
+        worker = None
+        with self._lock:
+            while self._idle and worker is None:
+                candidate = self._idle.pop()
+                if candidate.alive():
+                    worker = candidate
+        try:
+            if worker is None:
+                worker = self._spawn()
+        except BaseException:
+            self._slots.release()
+            raise
+        try:
+            worker.conn.send((tool, params))
+        except BaseException:
+            # 工具或参数无法 pickle 时什么都没有写入管道，进程仍然可用
+            self._release(worker)
+            raise
+        return worker
+
+    def _recv(self, worker: _ProcessWorker, timeout: Optional[float]) -> Optional[Message]:
+        try:
+            if timeout is not None and not worker.conn.poll(timeout):
+                return None
+            return worker.conn.recv()
+        except (EOFError, OSError):
+            worker.broken = True
+            raise ToolWorkerError(f"Tool worker exited unexpectedly (exit code {worker.process.exitcode})")
+
+    def _cancel(self, worker: _ProcessWorker):
+        if not worker.alive():
+            return
+        try:
+            worker.conn.send("cancel")
+            deadline = time.monotonic() + self.cancel_grace
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not worker.conn.poll(remaining):
+                    break
+                if worker.conn.recv()[0] in ("done", "error"):
+                    return
+        except (EOFError, OSError):
+            pass
+        self._kill(worker)
+
+    def _abort(self, worker: _ProcessWorker):
+        self._kill(worker)
+
+    def _interrupt(self, worker: _ProcessWorker):
+        # 无法确认工具何时停止，直接终止进程，阻塞在管道上的读取随之返回
+        self._kill(worker)
+
+    def _kill(self, worker: _ProcessWorker):
+        with self._lock:
+            if worker.killed:
+                return
+            worker.killed = True
+            self.killed += 1
+        worker.kill()
+
+    def _release(self, worker: _ProcessWorker):
+        with self._lock:
+            if worker.alive():
+                self._idle.append(worker)
+            elif worker in self._all:
+                self._all.remove(worker)
+        self._slots.release()
+
+    def close(self):
+        """停止所有工作进程"""
+        with self._lock:
+            workers, self._all, self._idle = self._all, [], []
+        for worker in workers:
+            if worker.alive():
+                worker.stop()
+
+
+def run_tool(tool: Any, params: Dict[str, Any]) -> Any:
+    """按 tool.execution 执行工具，返回值与 tool._run 相同（普通值或生成器）"""
+    execution = getattr(tool, "execution", "inline")
+    if execution == "inline":
+        return tool._run(**params)
+    if execution == "thread":
+        return ThreadToolPool.shared().call(tool, params, tool.timeout)
+    if execution == "process":
+        return ProcessToolPool.shared().call(tool, params, tool.timeout)
+    raise ValueError(f"未知的执行方式：{execution}，可选 {', '.join(EXECUTION_MODES)}")
@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import requests
+
+
+class HTTPTransport:
+    """带连接池和 keep-alive 的 HTTP 传输层
+
+    同一个 base_url 的所有 OpenAILLM/DeepSeekLLM 实例默认共享同一个传输层（见 shared），
+    每轮对话和每次 ask_team_member 都可以复用已建立的 TCP/TLS 连接，
+    首 token 延迟中不再包含握手时间。
+
+    同步请求使用 requests.Session + urllib3 连接池；异步请求使用 aiohttp（可选依赖），
+    每个事件循环一个 ClientSession。
+    """
+
+    _shared: Dict[str, "HTTPTransport"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(
+        self,
+        base_url: str,
+        pool_size: int = 32,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 300.0,
+        async_limit: int = 1000,
+        keepalive_timeout: float = 60.0,
+        prewarm: int = 0
+    ):
+        """
+        Args:
+            base_url: API 地址
+            pool_size: 同步连接池保留的最大连接数，应不小于并发流的线程数
+            connect_timeout: 建立连接的超时时间（秒）
+            read_timeout: 两次读取之间的最大间隔（秒），流式响应按每次读取计算
+            async_limit: 异步请求的最大并发连接数，0 表示不限制
+            keepalive_timeout: 异步连接空闲多久后关闭（秒）
+            prewarm: 创建后在后台预先建立的连接数，0 表示不预热
+        """
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.async_limit = async_limit
+        self.keepalive_timeout = keepalive_timeout
+
+        # requests 的导入时间较长，创建第一个传输层时才导入
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # aiohttp 会话与事件循环绑定，每个事件循环单独维护一个
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = weakref.WeakKeyDictionary()
+
+        if prewarm > 0:
+            threading.Thread(target=self.prewarm, args=(prewarm,), daemon=True).start()
+
+    @classmethod
+    def shared(cls, base_url: str, **kwargs) -> "HTTPTransport":
+        """获取 base_url 对应的共享传输层，不存在时用 kwargs 创建
+
+        kwargs 只在首次创建时生效。
+        """
+        key = base_url.rstrip('/')
+        with cls._shared_lock:
+            transport = cls._shared.get(key)
+            if transport is None:
+                transport = cls(base_url, **kwargs)
+                cls._shared[key] = transport
+            return transport
+
+    @property
+    def timeout(self) -> tuple[float, float]:
+        return (self.connect_timeout, self.read_timeout)
+
+    def post(self, url: str, headers: Dict[str, str], json: Any = None, stream: bool = True, **kwargs) -> "requests.Response":
+        """通过连接池发送 POST 请求"""
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.post(url, headers=headers, json=json, stream=stream, **kwargs)
+
+    def prewarm(self, connections: int = 1) -> None:
+        """预先建立连接并放回连接池
+
+        使用 HEAD 请求完成 TCP/TLS 握手，响应状态码不影响连接复用，失败会被忽略。
+        """
+        import requests
+
+        def _open(_):
+            try:
+                self.session.head(self.base_url, timeout=self.timeout).close()
+            except requests.RequestException:
+                pass
+
+        connections = min(connections, self.pool_size)
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            list(executor.map(_open, range(connections)))
+
+    def get_async_client(self):
+        """获取当前事件循环上的 aiohttp 会话，不存在时创建"""
+        try:
+            import aiohttp
+        except ImportError as e:
+            raise ImportError("异步请求需要 aiohttp，请先安装：pip install aiohttp") from e
+
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None or client.closed:
+            connector = aiohttp.TCPConnector(limit=self.async_limit, keepalive_timeout=self.keepalive_timeout)
+            client = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(
+                    total=None,
+                    sock_connect=self.connect_timeout,
+                    sock_read=self.read_timeout
+                )
+            )
+            self._async_clients[loop] = client
+        return client
+
+    async def aprewarm(self, connections: int = 1) -> None:
+        """prewarm 的异步版本，在当前事件循环的连接池中预先建立连接"""
+        import aiohttp
+
+        client = self.get_async_client()
+
+        async def _open():
+            try:
+                async with client.head(self.base_url):
+                    pass
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+
+        await asyncio.gather(*[_open() for _ in range(connections)])
+
+    def close(self) -> None:
+        """关闭同步连接池"""
+        self.session.close()
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环上的异步连接池"""
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None and not client.closed:
+            await client.close()
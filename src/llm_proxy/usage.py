@@ -0,0 +1,71 @@
+"""流式响应的用量统计
+
+请求带 stream_options={"include_usage": true} 时，服务端在流的最后一个数据帧中返回 usage：
+- OpenAI：prompt_tokens_details.cached_tokens 为命中前缀缓存的提示 token 数；
+- DeepSeek：prompt_cache_hit_tokens / prompt_cache_miss_tokens。
+两种格式都解析为 Usage，命中缓存的提示 token 计费更低、首 token 延迟更短。
+"""
+import threading
+from typing import Any, Dict, NamedTuple, Optional
+
+
+class Usage(NamedTuple):
+    """一次请求的 token 用量"""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0  # 命中服务端前缀缓存的提示 token 数
+
+    @property
+    def uncached_tokens(self) -> int:
+        return max(0, self.prompt_tokens - self.cached_tokens)
+
+    @property
+    def cache_hit_rate(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+
+def _int(value: Any) -> int:
+    return value if isinstance(value, int) else 0
+
+
+def parse_usage(raw: Any) -> Optional[Usage]:
+    """解析 usage 字段，格式不对时返回 None"""
+    if not isinstance(raw, dict):
+        return None
+    details = raw.get("prompt_tokens_details")
+    cached = _int(details.get("cached_tokens")) if isinstance(details, dict) else 0
+    if not cached:
+        cached = _int(raw.get("prompt_cache_hit_tokens"))
+    prompt = _int(raw.get("prompt_tokens"))
+    if not prompt:
+        prompt = cached + _int(raw.get("prompt_cache_miss_tokens"))
+    return Usage(prompt, _int(raw.get("completion_tokens")), cached)
+
+
+class UsageStats:
+    """累计多次请求的用量，可以在多个线程中更新"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0  # 返回了 usage 的请求数
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+
+    def add(self, usage: Usage):
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += usage.prompt_tokens
+            self.cached_tokens += usage.cached_tokens
+            self.completion_tokens += usage.completion_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "uncached_tokens": self.prompt_tokens - self.cached_tokens,
+                "completion_tokens": self.completion_tokens,
+                "cache_hit_rate": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            }
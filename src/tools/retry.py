@@ -1,30 +1,268 @@
+import asyncio
+import email.utils
+import random
+import sys
+import threading
 import time
+from collections import deque
 from functools import wraps
-from typing import Any, Callable, Type, Union, Tuple
+from typing import Any, Callable, Dict, FrozenSet, Optional, Type, Union, Tuple
+
+# 可以重试的 HTTP 状态码：超时、冲突、限流和服务端临时错误
+RETRYABLE_STATUS: FrozenSet[int] = frozenset({408, 409, 425, 429, 500, 502, 503, 504})
+
+
+_network_errors: Dict[Tuple[bool, bool], Tuple[Type[BaseException], ...]] = {}
+
+
+def network_errors() -> Tuple[Type[BaseException], ...]:
+    """可以重试的网络错误类型
+
+    只包含已经导入的 HTTP 库的异常：没有导入的库不会抛出自己的异常，
+    导入本模块时不需要加载 requests 和 aiohttp（两者的导入时间占冷启动的大部分）。
+    """
+    key = (sys.modules.get("requests") is not None, sys.modules.get("aiohttp") is not None)
+    errors = _network_errors.get(key)
+    if errors is None:
+        found = [ConnectionError, TimeoutError, asyncio.TimeoutError]
+        if key[0]:
+            import requests
+            found += [requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError]
+        if key[1]:
+            import aiohttp
+            found += [aiohttp.ClientConnectionError, aiohttp.ClientPayloadError]
+        errors = _network_errors[key] = tuple(found)
+    return errors
+
+
+def __getattr__(name: str):
+    # 兼容原来的模块常量 NETWORK_ERRORS
+    if name == "NETWORK_ERRORS":
+        return network_errors()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def full_jitter(attempt: int, base: float, cap: float, rng: random.Random = None) -> float:
+    """指数退避加全抖动：在 [0, min(cap, base * 2^attempt)] 内均匀取值，避免大量客户端同时重试"""
+    return (rng or random).uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头，支持秒数和 HTTP 日期，无法解析时返回 None"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class RetryPolicy:
+    """重试策略：哪些错误可以重试，以及每次重试前等待多久
+
+    错误带 status_code 属性时按状态码判断（见 RETRYABLE_STATUS），否则只重试网络错误。
+    错误带 retry_after 属性（Retry-After 头的原始值）时优先使用服务端给出的等待时间。
+    """
+
+    def __init__(self, max_retries: int = 3, base_delay: float = 0.5, max_delay: float = 30.0,
+                 retry_statuses: FrozenSet[int] = RETRYABLE_STATUS, max_retry_after: float = 60.0,
+                 rng: random.Random = None):
+        """
+        Args:
+            max_retries: 最多重试次数，不含第一次请求
+            base_delay: 退避的初始上限（秒）
+            max_delay: 退避的最大上限（秒）
+            retry_statuses: 可以重试的状态码
+            max_retry_after: Retry-After 超过此值（秒）时不再重试
+            rng: 抖动使用的随机数生成器，便于测试
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = frozenset(retry_statuses)
+        self.max_retry_after = max_retry_after
+        self.rng = rng
+
+    def is_retryable(self, error: BaseException) -> bool:
+        status = getattr(error, "status_code", None)
+        if status is not None:
+            return status in self.retry_statuses
+        return isinstance(error, network_errors())
+
+    @staticmethod
+    def is_server_failure(error: BaseException) -> bool:
+        """是否说明服务端不可用（5xx 或网络错误），用于熔断统计；4xx 说明服务端仍在正常响应"""
+        status = getattr(error, "status_code", None)
+        if status is not None:
+            return status >= 500
+        return isinstance(error, network_errors())
+
+    def delay(self, attempt: int, error: BaseException = None) -> Optional[float]:
+        """第 attempt 次重试（从 0 开始）前的等待时间，返回 None 表示不应再重试"""
+        if attempt >= self.max_retries:
+            return None
+        retry_after = parse_retry_after(getattr(error, "retry_after", None))
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_retry_after else None
+        return full_jitter(attempt, self.base_delay, self.max_delay, self.rng)
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被直接拒绝"""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"熔断器已打开：{name}，{retry_in:.1f} 秒后重试")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """按端点的熔断器
+
+    - closed：正常放行，连续失败 failure_threshold 次后打开；
+    - open：直接拒绝，recovery_timeout 秒后进入 half_open；
+    - half_open：只放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    _shared: Dict[str, "CircuitBreaker"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, name: str = "", failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, name: str, **kwargs) -> "CircuitBreaker":
+        """获取端点对应的共享熔断器，不存在时用 kwargs 创建；kwargs 只在首次创建时生效"""
+        key = name.rstrip('/')
+        with cls._shared_lock:
+            breaker = cls._shared.get(key)
+            if breaker is None:
+                breaker = cls._shared[key] = cls(key, **kwargs)
+            return breaker
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.recovery_timeout:
+                    return False
+                self.state = "half_open"
+                self._probing = False
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def check(self) -> None:
+        """不放行时抛出 CircuitOpenError"""
+        if not self.allow():
+            retry_in = max(0.0, self.recovery_timeout - (time.monotonic() - self.opened_at))
+            raise CircuitOpenError(self.name, retry_in)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def release_probe(self) -> None:
+        """放行的请求没有结果就结束了（例如被取消），不记录成功或失败，下一个请求重新探测"""
+        with self._lock:
+            self._probing = False
+
+    def reset(self) -> None:
+        self.record_success()
+
+
+class LatencyTracker:
+    """最近 window 个延迟样本的滑动窗口，用于计算对冲请求的分位数截止时间"""
+
+    def __init__(self, window: int = 256):
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if not self._samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
 
 def retry(
     max_retries: int = 3,
     delay: float = 1.0,
     backoff: float = 2.0,
-    exceptions: Union[Type[Exception], Tuple[Type[Exception], ...]] = Exception
+    exceptions: Union[Type[Exception], Tuple[Type[Exception], ...]] = Exception,
+    jitter: bool = False
 ) -> Callable:
-    """重试装饰器
-    
+    """重试装饰器，同时支持普通函数和协程函数
+
     Args:
-        max_retries: 最大重试次数
+        max_retries: 最大尝试次数
         delay: 初始延迟时间（秒）
         backoff: 延迟时间的增长因子
         exceptions: 需要重试的异常类型
-        
+        jitter: 是否在 [0, 当前延迟] 内随机取等待时间（全抖动）
+
     Returns:
         Callable: 装饰器函数
     """
+    def wait_time(current_delay: float) -> float:
+        return random.uniform(0, current_delay) if jitter else current_delay
+
     def decorator(func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                current_delay = delay
+                for retries in range(1, max_retries + 1):
+                    try:
+                        return await func(*args, **kwargs)
+                    except exceptions:
+                        if retries >= max_retries:
+                            raise
+                    await asyncio.sleep(wait_time(current_delay))
+                    current_delay *= backoff
+                return await func(*args, **kwargs)
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args: Any, **kwargs: Any) -> Any:
             retries = 0
             current_delay = delay
-            
+
             while retries < max_retries:
                 try:
                     return func(*args, **kwargs)
@@ -32,10 +270,10 @@ def retry(
                     retries += 1
                     if retries == max_retries:
                         raise e
-                    
-                    time.sleep(current_delay)
+
+                    time.sleep(wait_time(current_delay))
                     current_delay *= backoff
-                    
+
             return func(*args, **kwargs)
         return wrapper
-    return decorator 
\ No newline at end of file
+    return decorator
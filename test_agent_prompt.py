@@ -0,0 +1,74 @@
+from typing import ClassVar, Dict, Generator, List
+from pydantic import BaseModel
+from src.llm_proxy import LLMBase, BaseTool
+from src.agent import Agent
+from src.agent.team import Team
+
+
+class ScriptedLLM(LLMBase):
+    def __init__(self, chunks: List[str]):
+        super().__init__(base_url="", api_key="")
+        self.chunks = chunks
+
+    def _chat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> Generator[str, None, None]:
+        yield from self.chunks
+
+
+class QuerySchema(BaseModel):
+    query: str
+
+
+class CountingSchema(BaseModel):
+    query: str
+    renders: ClassVar[int] = 0
+
+    @classmethod
+    def model_json_schema(cls, *args, **kwargs):
+        CountingSchema.renders += 1
+        return super().model_json_schema(*args, **kwargs)
+
+
+def make_tool(name: str, schema=QuerySchema) -> BaseTool:
+    return type(f"Tool_{name}", (BaseTool,), {
+        "name": name, "description": f"tool {name}", "argSchema": schema, "_run": lambda self, query: query
+    })()
+
+
+def test_schema_rendered_once_and_prompt_built_lazily():
+    agent = Agent("a", "b", "c", ScriptedLLM(["ok"]), "m")
+    for i in range(50):
+        agent.add_tool(make_tool(f"t{i}", CountingSchema))
+    assert CountingSchema.renders == 0  # 只标记，尚未生成
+    assert "t49" in agent.system_message.content
+    assert CountingSchema.renders == 1
+    agent.remove_tool("t0")
+    agent.update_identity(goal="new goal")
+    content = agent.system_message.content
+    assert "t0" not in content and "new goal" in content
+    assert CountingSchema.renders == 1
+
+
+def test_system_message_stays_at_first_slot():
+    llm = ScriptedLLM(["hi"])
+    agent = Agent("a", "b", "c", llm, "m", allow_ask_other=True)
+    Team("team", "goal", "story", [agent])
+    team_prompt = llm.session[1]
+    system_message = agent.system_message
+    assert llm.session[0] is system_message and "ask_team_member" in system_message.content
+    assert team_prompt.role == "system"
+
+    "".join(agent.chat_default("hello"))
+    agent.add_tool(make_tool("late"))
+    "".join(agent.chat_default("again"))
+    # 对话开始后新工具以 system 消息追加在会话末尾，已经发送过的前缀不变
+    assert llm.session[0] is system_message and "late" not in system_message.content
+    assert llm.session[1] is team_prompt
+    assert [msg.role for msg in llm.session[2:]] == ["user", "assistant", "system", "user", "assistant"]
+    assert "tool late" in llm.session[4].content
+
+    # 清空会话后更新合并进新的系统提示
+    llm.clear_session()
+    "".join(agent.chat_default("hello"))
+    system_message = llm.session[0]
+    assert system_message is agent.system_message and "tool late" in system_message.content
+    assert llm.session[1].role == "user"
@@ -0,0 +1,76 @@
+import asyncio
+from typing import AsyncGenerator, Dict, Generator, List
+from pydantic import BaseModel
+from src.llm_proxy import LLMBase, BaseTool
+from src.agent import Agent
+
+
+class ScriptedLLM(LLMBase):
+    """按固定分块回放回复的离线 LLM"""
+
+    def __init__(self, chunks: List[str]):
+        super().__init__(base_url="", api_key="")
+        self.chunks = chunks
+
+    def _chat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> Generator[str, None, None]:
+        yield from self.chunks
+
+
+class AsyncScriptedLLM(ScriptedLLM):
+    async def _achat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> AsyncGenerator[str, None]:
+        for chunk in self.chunks:
+            await asyncio.sleep(0)
+            yield chunk
+
+
+class EchoSchema(BaseModel):
+    text: str
+
+
+class EchoTool(BaseTool):
+    name = "echo"
+    description = "原样返回输入"
+    argSchema = EchoSchema
+
+    def _run(self, text: str) -> str:
+        return text.upper()
+
+
+class AsyncEchoTool(EchoTool):
+    name = "aecho"
+
+    async def _run(self, text: str) -> str:
+        await asyncio.sleep(0)
+        return text[::-1]
+
+
+CHUNKS = ["Hi <func", 'tion_call>echo({"text": "ab"})</function_call> and ',
+          '<function_call>aecho({"text": "xy"})</function_', "call> done"]
+EXPECTED = 'Hi [Function Call: echo({"text": "ab"}), Result: AB] and [Function Call: aecho({"text": "xy"}), Result: yx] done'
+
+
+def make_agent(llm: LLMBase) -> Agent:
+    return Agent(name="a", backstory="b", goal="c", llm=llm, default_model="m",
+                 tools=[EchoTool(), AsyncEchoTool()])
+
+
+async def collect(agent: Agent) -> str:
+    return "".join([chunk async for chunk in agent.achat_default("hello")])
+
+
+def test_achat_matches_sync_chat():
+    sync_agent = make_agent(ScriptedLLM(CHUNKS[:2] + [" done"]))
+    assert "".join(sync_agent.chat_default("hello")) == 'Hi [Function Call: echo({"text": "ab"}), Result: AB] and  done'
+
+    agent = make_agent(ScriptedLLM(CHUNKS))
+    assert asyncio.run(collect(agent)) == EXPECTED
+
+
+def test_achat_many_concurrent_streams():
+    agents = [make_agent(AsyncScriptedLLM(CHUNKS)) for _ in range(500)]
+
+    async def run_all():
+        return await asyncio.gather(*[collect(agent) for agent in agents])
+
+    assert asyncio.run(run_all()) == [EXPECTED] * len(agents)
+    assert agents[0].llm.session[-1].content == EXPECTED
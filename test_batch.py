@@ -0,0 +1,110 @@
+import json
+import time
+from typing import Dict, Generator, List
+from src.llm_proxy import LLMBase, LLMMessage, OpenAILLM, HTTPTransport, BaseTool, BaseModel
+from src.agent import Agent
+from benchmarks.fake_server import FakeOpenAIServer, Script
+
+
+class EchoLLM(LLMBase):
+    """回复最后一条消息，内容含 fail 时报错"""
+
+    def __init__(self):
+        super().__init__(base_url="", api_key="")
+        self.sent: List[List[Dict[str, str]]] = []
+
+    def _chat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> Generator[str, None, None]:
+        self.sent.append(list(messages))
+        content = messages[-1]["content"]
+        if "fail" in content:
+            raise RuntimeError("boom")
+        yield "echo:"
+        yield content
+
+
+class UpperInput(BaseModel):
+    text: str
+
+
+class UpperTool(BaseTool):
+    name: str = "upper"
+    description: str = "Upper case the text"
+    argSchema: BaseModel = UpperInput
+
+    def _run(self, text: str) -> str:
+        return text.upper()
+
+
+def test_llm_batch_runs_concurrently_and_keeps_indices():
+    with FakeOpenAIServer(Script(reply_tokens=3, ttft=0.1)) as server:
+        llm = OpenAILLM(server.base_url, "key", transport=HTTPTransport(server.base_url))
+        llm.session.append(LLMMessage(role="system", content="sys"))
+        start = time.perf_counter()
+        run = llm.batch([f"q{i}" for i in range(16)], "m", 0, max_concurrency=8)
+        results = list(run)
+        elapsed = time.perf_counter() - start
+    assert sorted(r.index for r in results) == list(range(16))
+    assert all(r.output == "t0 t1 t2 " for r in results)
+    assert elapsed < 16 * 0.1 / 2
+    assert len(llm.session) == 1
+    summary = run.summary
+    assert (summary.total, summary.succeeded, summary.failed, summary.resumed) == (16, 16, 0, 0)
+    assert summary.items_per_sec > 0 and summary.output_tokens > 0
+
+
+def test_failures_are_reported_and_checkpoint_resumes(tmp_path):
+    path = str(tmp_path / "batch.jsonl")
+    inputs = ["a", "fail", "b", "c", "d"]
+    llm = EchoLLM()
+    run = llm.batch(inputs, "m", 0, max_concurrency=1, checkpoint=path)
+    # 运行到一半中断
+    for result in run:
+        if result.index == 2:
+            break
+    assert run.summary.failed == 1 and run.summary.succeeded == 2
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"index": 3, "key"')  # 崩溃时写了一半的行
+
+    llm.sent.clear()
+    run = llm.batch(inputs, "m", 0, max_concurrency=2, checkpoint=path)
+    results = run.results()
+    assert [r.output for r in results] == ["echo:a", None, "echo:b", "echo:c", "echo:d"]
+    assert [r.resumed for r in results] == [True, False, True, False, False]
+    assert "RuntimeError: boom" in results[1].error
+    # 只重新执行了失败和未完成的输入
+    assert sorted(m[-1]["content"] for m in llm.sent) == ["c", "d", "fail"]
+    summary = run.summary
+    assert (summary.total, summary.succeeded, summary.failed, summary.resumed) == (5, 4, 1, 2)
+    # 输入变化的下标不使用检查点中的记录
+    results = EchoLLM().batch(["x", "fail", "b", "c", "d"], "m", 0, checkpoint=path).results()
+    assert results[0].output == "echo:x" and not results[0].resumed
+    lines = open(path, encoding="utf-8").read().splitlines()
+    assert lines.count('{"index": 3, "key"') == 1
+    assert all(json.loads(line)["index"] >= 0 for line in lines if line != '{"index": 3, "key"')
+
+
+def test_agent_run_batch_uses_isolated_sessions_and_tools():
+    llm = EchoLLM()
+    agent = Agent("agent", "backstory", "goal", llm, "model", tools=[UpperTool()])
+    "".join(agent.chat_default("first"))
+    session = list(llm.session)
+    inputs = ['<function_call>upper({"text": "hi"})</function_call>', "plain"]
+    results = agent.run_batch(inputs, max_concurrency=2).results()
+    assert "Result: HI" in results[0].output
+    assert results[1].output == "echo:plain"
+    assert llm.session == session
+    # 并发的输入各自记录函数调用，不覆盖 agent 自己的记录
+    assert all("Result: HI" in r.output for r in agent.run_batch([inputs[0]] * 4, max_concurrency=4).results())
+    assert agent.function_call.executed_tools == []
+    forked = agent.function_call.fork()
+    assert forked.tools is agent.function_call.tools and forked.executed_tools is not agent.function_call.executed_tools
+    # 每个输入只带系统提示，不带已有的对话
+    batch_requests = llm.sent[1:]
+    assert all([m["role"] for m in messages] == ["system", "user"] for messages in batch_requests)
+    assert run_summary_ok(agent)
+
+
+def run_summary_ok(agent: Agent) -> bool:
+    run = agent.run_batch(iter(["x", "fail"]))
+    list(run)
+    return run.summary.total == 2 and run.summary.failed == 1
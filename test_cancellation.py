@@ -0,0 +1,171 @@
+import asyncio
+import threading
+import time
+from typing import Generator
+import pytest
+from src.llm_proxy import (OpenAILLM, AsyncOpenAILLM, HTTPTransport, RetryingLLM, BaseTool, BaseModel,
+                           CancelToken, ChatCancelled, DeadlineExceeded, ProcessToolPool)
+from src.tools.retry import RetryPolicy, CircuitBreaker
+from src.agent import Agent
+from src.agent.team import Team
+from benchmarks.fake_server import FakeOpenAIServer, Script
+
+SLOW = Script(reply_tokens=200, tokens_per_sec=20)
+
+
+def make_agent(server: FakeOpenAIServer, name: str = "a", cls=OpenAILLM, **kwargs) -> Agent:
+    llm = cls(server.base_url, "key", transport=HTTPTransport(server.base_url))
+    return Agent(name, "b", "g", llm, name, **kwargs)
+
+
+def roles(agent: Agent) -> list:
+    return [m.role for m in agent.llm.session]
+
+
+def wait_for(predicate, timeout: float = 2.0) -> bool:
+    end = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < end:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_deadline_and_cancel_token_interrupt_a_blocked_read():
+    with FakeOpenAIServer(SLOW) as server:
+        agent = make_agent(server)
+        chunks = []
+        start = time.perf_counter()
+        with pytest.raises(DeadlineExceeded):
+            for chunk in agent.chat_default("hi", deadline=0.3):
+                chunks.append(chunk)
+        assert time.perf_counter() - start < 0.5
+        # 已经输出的部分回复保存在会话中，连接被关闭
+        assert roles(agent) == ["system", "user", "assistant"]
+        assert agent.llm.session[-1].content == "".join(chunks) != ""
+        assert wait_for(lambda: server.aborted == 1)
+
+        token = CancelToken()
+        threading.Timer(0.2, token.cancel).start()
+        start = time.perf_counter()
+        with pytest.raises(ChatCancelled) as info:
+            "".join(agent.chat_default("again", cancel_token=token))
+        assert not isinstance(info.value, DeadlineExceeded)
+        assert time.perf_counter() - start < 0.4
+
+        # 第一个数据块之前被取消时撤销本轮的 user 消息
+        server.script = Script(reply_tokens=3, ttft=2.0)
+        with pytest.raises(DeadlineExceeded):
+            "".join(agent.chat_default("late", deadline=0.2))
+        assert roles(agent) == ["system", "user", "assistant", "user", "assistant"]
+        assert "".join(agent.chat_default("ok", deadline=5)) == "t0 t1 t2 "
+
+
+def test_closing_the_reply_closes_nested_member_streams():
+    ask = '<function_call>ask_team_member({"name": "member", "question": "q"})</function_call>'
+    scenarios = {"leader": SLOW._replace(inject=ask, inject_at=1), "member": SLOW}
+    with FakeOpenAIServer(scenarios=scenarios) as server:
+        leader = make_agent(server, "leader", allow_ask_other=True)
+        member = make_agent(server, "member")
+        Team("team", "g", "b", agents=[leader, member])
+        stream = leader.chat_default("hi")
+        text = ""
+        while "t2 " not in text.split("Result:")[-1]:
+            text += next(stream)
+        stream.close()
+        # 外层和成员的两个流都被关闭，两个会话都以 assistant 消息结尾
+        assert wait_for(lambda: server.aborted == 2)
+        assert roles(leader)[-1] == roles(member)[-1] == "assistant"
+        assert member.llm.session[-1].content.startswith("t0 t1 t2 ")
+
+
+def test_cancel_reaches_members_in_other_threads():
+    broadcast = '<function_call>ask_team_members({"question": "q"})</function_call>'
+    scenarios = {"leader": Script(reply_tokens=4, inject=broadcast, inject_at=1),
+                 "m1": SLOW, "m2": Script(reply_tokens=3, ttft=5.0)}
+    with FakeOpenAIServer(scenarios=scenarios) as server:
+        leader = make_agent(server, "leader", allow_ask_other=True)
+        members = [make_agent(server, name) for name in ("m1", "m2")]
+        Team("team", "g", "b", agents=[leader, *members])
+        start = time.perf_counter()
+        with pytest.raises(DeadlineExceeded):
+            "".join(leader.chat_default("hi", deadline=0.5))
+        assert time.perf_counter() - start < 0.8
+        # 成员对话的令牌是外层令牌的子令牌，截止时间一到各自的请求都被关闭
+        assert wait_for(lambda: roles(members[0])[-1] == "assistant")
+        assert server._served["m2"] == 1
+        assert wait_for(lambda: "user" not in roles(members[1]))
+        assert roles(leader)[-2:] == ["user", "assistant"]
+
+
+class SlowCountInput(BaseModel):
+    n: int
+
+
+class SlowCountTool(BaseTool):
+    name: str = "slow_count"
+    description: str = "Count slowly"
+    argSchema: BaseModel = SlowCountInput
+    execution: str = "process"
+    cacheable: bool = False
+
+    def _run(self, n: int) -> Generator[str, None, None]:
+        for i in range(n):
+            time.sleep(0.1)
+            yield f"{i} "
+
+
+class ThreadCountTool(SlowCountTool):
+    execution: str = "thread"
+
+
+def test_cancel_kills_process_tool_and_stops_retries():
+    call = '<function_call>slow_count({"n": 100})</function_call>'
+    scenarios = {"a": Script(reply_tokens=3, inject=call, inject_at=1),
+                 "limited": Script(fail_first=100, error_status=429, retry_after="10")}
+    with FakeOpenAIServer(scenarios=scenarios) as server:
+        agent = make_agent(server, tools=[SlowCountTool()])
+        pool = ProcessToolPool.shared()
+        killed = pool.stats()["killed"]
+        start = time.perf_counter()
+        with pytest.raises(DeadlineExceeded):
+            "".join(agent.chat_default("hi", deadline=1.0))
+        assert time.perf_counter() - start < 1.5
+        assert pool.stats()["killed"] == killed + 1
+
+        # 线程中的工具无法终止，调用方不再等待，取消也不会作为工具错误写进回复
+        thread_agent = make_agent(server, tools=[ThreadCountTool()])
+        chunks = []
+        with pytest.raises(DeadlineExceeded):
+            for chunk in thread_agent.chat_default("hi", deadline=1.0):
+                chunks.append(chunk)
+        assert chunks and "Function Call Error" not in "".join(chunks)
+        assert thread_agent.llm.session[-1].content == "".join(chunks)
+
+        llm = RetryingLLM(agent.llm, policy=RetryPolicy(max_retry_after=60), breaker=CircuitBreaker("limited"))
+        retrying = Agent("r", "b", "g", llm, "limited")
+        start = time.perf_counter()
+        with pytest.raises(DeadlineExceeded):
+            "".join(retrying.chat_default("hi", deadline=0.3))
+        # Retry-After 为 10 秒，截止时间到达时不再等待
+        assert time.perf_counter() - start < 0.6
+        assert llm.stats()["retries"] == 1 and roles(retrying) == ["system"]
+
+
+def test_async_deadline_and_close():
+    with FakeOpenAIServer(SLOW) as server:
+        async def main():
+            agent = make_agent(server, cls=AsyncOpenAILLM)
+            start = time.perf_counter()
+            with pytest.raises(DeadlineExceeded):
+                async for _ in agent.achat_default("hi", deadline=0.3):
+                    pass
+            elapsed = time.perf_counter() - start
+
+            stream = agent.achat_default("again")
+            await stream.__anext__()
+            await stream.aclose()
+            await agent.llm.aclose()
+            return agent, elapsed
+        agent, elapsed = asyncio.run(main())
+        assert elapsed < 0.5
+        assert roles(agent) == ["system", "user", "assistant", "user", "assistant"]
+        assert wait_for(lambda: server.aborted == 2)
@@ -0,0 +1,140 @@
+import asyncio
+import threading
+import time
+import pytest
+from src.llm_proxy import OpenAILLM, AsyncOpenAILLM, HTTPTransport, ChunkCoalescer, DeadlineExceeded
+from src.agent import Agent
+from benchmarks.fake_server import FakeOpenAIServer, Script
+
+
+def pieces(text: str, size: int = 1):
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+        yield ""
+
+
+def test_size_and_word_boundary():
+    text = "alpha beta gamma delta epsilon"
+    chunks = list(ChunkCoalescer(min_chars=8, max_delay=None).coalesce(pieces(text)))
+    assert "".join(chunks) == text
+    # 除了最后一块，每块都在空白处结束，不完整的单词留到下一块
+    assert chunks == ["alpha ", "beta ", "gamma ", "delta ", "epsilon"]
+
+    chunks = list(ChunkCoalescer(min_chars=8, max_delay=None, word_boundary=False).coalesce(pieces(text)))
+    assert "".join(chunks) == text and all(len(c) == 8 for c in chunks[:-1])
+
+    # 没有空白的长文本不会被无限扣住
+    chunks = list(ChunkCoalescer(min_chars=4, max_delay=None).coalesce(pieces("你好世界今天天气很好")))
+    assert chunks == ["你好世界", "今天天气", "很好"]
+
+    with pytest.raises(ValueError):
+        ChunkCoalescer(min_chars=0)
+
+
+def test_time_flush_and_tail_on_error():
+    def stalled():
+        yield "partial "
+        time.sleep(0.3)
+        yield "rest"
+
+    coalescer = ChunkCoalescer(min_chars=1000, max_delay=0.02)
+    start = time.perf_counter()
+    stream = coalescer.coalesce(stalled())
+    # 上游停顿时已产生的文本在 max_delay 后输出
+    assert next(stream) == "partial "
+    assert time.perf_counter() - start < 0.2
+    assert list(stream) == ["rest"]
+
+    def failing():
+        yield "a b c"
+        raise RuntimeError("boom")
+
+    for coalescer in (ChunkCoalescer(min_chars=100, max_delay=None), ChunkCoalescer(min_chars=100)):
+        chunks = []
+        with pytest.raises(RuntimeError):
+            for chunk in coalescer.coalesce(failing()):
+                chunks.append(chunk)
+        assert chunks == ["a b c"]
+
+
+def test_slow_consumer_applies_backpressure():
+    produced = []
+
+    def fast():
+        for i in range(200):
+            produced.append(i)
+            yield f"w{i} "
+
+    stream = ChunkCoalescer(min_chars=4, max_delay=0.01, max_buffer=64).coalesce(fast())
+    first = next(stream)
+    time.sleep(0.1)
+    # 读取者在累积 max_buffer 个字符后停止读取上游
+    assert len(produced) < 40
+    second = next(stream)
+    assert len(second) >= 32
+    assert first + second + "".join(stream) == "".join(f"w{i} " for i in range(200))
+
+
+def test_closing_early_closes_the_upstream():
+    closed = threading.Event()
+
+    def upstream():
+        try:
+            while True:
+                yield "x "
+                time.sleep(0.001)
+        finally:
+            closed.set()
+
+    for coalescer in (ChunkCoalescer(min_chars=8, max_delay=None), ChunkCoalescer(min_chars=8)):
+        closed.clear()
+        stream = coalescer.coalesce(upstream())
+        next(stream)
+        stream.close()
+        assert closed.is_set()
+
+
+def test_agent_and_raw_llm_streams():
+    with FakeOpenAIServer(Script(reply_tokens=40)) as server:
+        llm = OpenAILLM(server.base_url, "key", transport=HTTPTransport(server.base_url))
+        agent = Agent("a", "b", "g", llm, "m", coalescer=ChunkCoalescer(min_chars=32))
+        expected = "".join(f"t{i} " for i in range(40))
+        chunks = list(agent.chat_default("hi"))
+        assert "".join(chunks) == expected and len(chunks) < 10
+        assert agent.llm.session[-1].content == expected
+
+        # 提前关闭时会话保存已经输出的部分，读取者线程已经结束
+        stream = agent.chat_default("again")
+        first = next(stream)
+        stream.close()
+        assert agent.llm.session[-1].role == "assistant"
+        assert agent.llm.session[-1].content.startswith(first)
+
+        raw = ChunkCoalescer(min_chars=32).coalesce(llm.chat("hi", "m", 0))
+        assert "".join(raw) == expected
+
+        server.script = Script(reply_tokens=200, tokens_per_sec=20)
+        with pytest.raises(DeadlineExceeded):
+            list(agent.chat_default("slow", deadline=0.3))
+
+
+def test_async_streams():
+    with FakeOpenAIServer(Script(reply_tokens=40)) as server:
+        expected = "".join(f"t{i} " for i in range(40))
+
+        async def main():
+            llm = AsyncOpenAILLM(server.base_url, "key", transport=HTTPTransport(server.base_url))
+            agent = Agent("a", "b", "g", llm, "m", coalescer=ChunkCoalescer(min_chars=32))
+            chunks = [chunk async for chunk in agent.achat_default("hi")]
+            assert "".join(chunks) == expected and len(chunks) < 10
+
+            stream = agent.achat_default("again")
+            first = await stream.__anext__()
+            await stream.aclose()
+            assert agent.llm.session[-1].content.startswith(first)
+
+            raw = ChunkCoalescer(min_chars=32).acoalesce(llm.achat("hi", "m", 0))
+            assert "".join([chunk async for chunk in raw]) == expected
+            await llm.aclose()
+
+        asyncio.run(main())
@@ -0,0 +1,85 @@
+from typing import Dict, Generator, List
+from src.llm_proxy import LLMBase, LLMMessage, TokenBudgetPolicy, SummarizingPolicy, estimate_tokens
+
+
+class RecordingLLM(LLMBase):
+    """记录每次请求发送的消息，回复固定内容"""
+
+    def __init__(self, reply: str = "ok"):
+        super().__init__(base_url="", api_key="")
+        self.reply = reply
+        self.requests: List[List[Dict[str, str]]] = []
+
+    def _chat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> Generator[str, None, None]:
+        self.requests.append(messages)
+        yield self.reply
+
+
+def talk(llm: LLMBase, turns: int, text: str = "word " * 20):
+    for i in range(turns):
+        "".join(llm.chat_with_context(f"{i} {text}", "m", 0))
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd" * 100) == 100
+    assert estimate_tokens("流式响应" * 25) == 100
+    assert 100 <= estimate_tokens("abcd" * 50 + "中文" * 25) <= 110
+
+
+def test_budget_window_pins_system_messages():
+    llm = RecordingLLM()
+    llm.session = [LLMMessage("system", "identity"), LLMMessage("system", "team")]
+    llm.context_policy = TokenBudgetPolicy(max_tokens=200)
+    talk(llm, 20)
+
+    last = llm.requests[-1]
+    assert [m["content"] for m in last[:2]] == ["identity", "team"]
+    assert last[-1]["content"].startswith("19 ")
+    assert last[2]["role"] == "user"
+    assert sum(estimate_tokens(m["content"]) + 4 for m in last) <= 200
+    assert len(last) < len(llm.session)
+    assert len(llm.session) == 42  # 会话保留完整历史
+
+    # 单条消息超出预算时仍然发送最新消息
+    llm.context_policy = TokenBudgetPolicy(max_tokens=10)
+    talk(llm, 1)
+    assert [m["content"] for m in llm.requests[-1][:2]] == ["identity", "team"]
+    assert len(llm.requests[-1]) == 3
+
+
+def test_summary_replaces_dropped_turns():
+    llm = RecordingLLM()
+    summarizer = RecordingLLM(reply="user counted from 0")
+    policy = SummarizingPolicy(max_tokens=200, llm=summarizer, model="cheap")
+    llm.session = [LLMMessage("system", "identity")]
+    llm.context_policy = policy
+    talk(llm, 10)
+    policy.wait(5)
+    talk(llm, 1)
+
+    assert summarizer.requests
+    assert "0 word" in summarizer.requests[0][1]["content"]
+    last = llm.requests[-1]
+    assert last[0]["content"] == "identity"
+    assert last[1]["role"] == "system" and "user counted from 0" in last[1]["content"]
+    assert sum(estimate_tokens(m["content"]) + 4 for m in last) <= 200
+
+    llm.clear_session()
+    talk(llm, 1)
+    assert len(llm.requests[-1]) == 1
+
+
+def test_budget_window_keeps_system_updates():
+    llm = RecordingLLM()
+    llm.session = [LLMMessage("system", "identity")]
+    llm.context_policy = TokenBudgetPolicy(max_tokens=200)
+    talk(llm, 3)
+    llm.session.append(LLMMessage("system", "update: new tool"))
+    talk(llm, 20)
+
+    last = llm.requests[-1]
+    # 移出窗口的更新放在开头的 system 消息之后，预算包含它
+    assert [m["content"] for m in last[:2]] == ["identity", "update: new tool"]
+    assert last[2]["role"] == "user" and last[-1]["content"].startswith("19 ")
+    assert sum(estimate_tokens(m["content"]) + 4 for m in last) <= 200
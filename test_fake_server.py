@@ -0,0 +1,58 @@
+import asyncio
+import pytest
+from pydantic import BaseModel
+from src.llm_proxy import OpenAILLM, AsyncOpenAILLM, BaseTool, HTTPTransport
+from src.agent import Agent
+from benchmarks.fake_server import FakeOpenAIServer, Script
+
+
+class GreetingSchema(BaseModel):
+    name: str
+
+
+class GreetingTool(BaseTool):
+    name = "greeting"
+    description = "问候"
+    argSchema = GreetingSchema
+
+    def _run(self, name: str) -> str:
+        return f"你好，{name}！"
+
+
+def make_llm(server: FakeOpenAIServer, cls=OpenAILLM):
+    return cls(server.base_url, "key", transport=HTTPTransport(server.base_url))
+
+
+def test_stream_reuses_one_connection():
+    with FakeOpenAIServer(Script(reply_tokens=20, chunk_tokens=3)) as server:
+        llm = make_llm(server)
+        for _ in range(3):
+            assert "".join(llm.chat("hi", "m", 0)) == "".join(f"t{i} " for i in range(20))
+        assert server.stats() == {"requests": 3, "errors": 0, "tokens": 60, "connections": 1}
+
+
+def test_agent_executes_injected_function_call():
+    call = '<function_call>greeting({"name": "小明"})</function_call>'
+    with FakeOpenAIServer(scenarios={"tools": Script(reply_tokens=10, inject=call, inject_at=2)}) as server:
+        agent = Agent("a", "b", "c", make_llm(server), "tools", tools=[GreetingTool()])
+        text = "".join(agent.chat_default("hi"))
+        assert text.startswith("t0 t1 [Function Call: greeting")
+        assert "你好，小明！" in text and text.endswith("t9 ")
+
+
+def test_error_injection_and_dropped_stream():
+    with FakeOpenAIServer(scenarios={"fail": Script(error_rate=1.0, error_status=503),
+                                     "drop": Script(drop_after=2)}) as server:
+        llm = make_llm(server)
+        with pytest.raises(Exception, match="503"):
+            llm.chat("hi", "fail", 0)
+        with pytest.raises(Exception):
+            "".join(llm.chat("hi", "drop", 0))
+        assert server.stats()["errors"] == 2
+
+        async def main():
+            async_llm = make_llm(server, AsyncOpenAILLM)
+            text = "".join([chunk async for chunk in async_llm.achat("hi", "m", 0)])
+            await async_llm.aclose()
+            return text
+        assert asyncio.run(main()).startswith("t0 t1 ")
@@ -0,0 +1,77 @@
+import subprocess
+import sys
+import pytest
+from benchmarks.bench_import import ROOT, SCENARIOS, profile_import, parse_importtime
+
+# 每个场景不应加载的依赖
+FORBIDDEN = {
+    "package": ("requests", "aiohttp", "pydantic", "asyncio"),
+    "agent_package": ("requests", "aiohttp", "pydantic", "asyncio"),
+    "message": ("requests", "aiohttp", "pydantic", "asyncio", "sqlite3"),
+    "session_store": ("requests", "aiohttp", "pydantic", "asyncio"),
+    "sync_backend": ("requests", "aiohttp", "pydantic", "json_repair", "multiprocessing"),
+    "async_backend": ("requests", "aiohttp", "pydantic", "json_repair", "multiprocessing"),
+    "agent": ("requests", "aiohttp", "json_repair", "multiprocessing"),
+}
+
+# 导入时间的回归阈值（毫秒），约为当前耗时的 3 倍，eager 导入所有模块时每个场景都超过 400ms
+THRESHOLD_MS = {
+    "package": 30,
+    "agent_package": 30,
+    "message": 100,
+    "session_store": 100,
+    "sync_backend": 250,
+    "async_backend": 250,
+    "agent": 400,
+}
+
+
+def test_parse_importtime():
+    stderr = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       100 |        100 | site\n"
+        "import time:        20 |         20 |   src.tokens\n"
+        "import time:        30 |         50 | src.llm_base\n"
+        "import time:        10 |         10 | json\n"
+    )
+    profile = parse_importtime(stderr, exclude=["site"])
+    assert profile.total_us == 60
+    assert profile.modules == {"src.tokens": 20, "src.llm_base": 50, "json": 10}
+
+
+@pytest.mark.parametrize("scenario", list(SCENARIOS))
+def test_import_does_not_load_unused_dependencies(scenario):
+    profile = profile_import(SCENARIOS[scenario])
+    loaded = [name for name in FORBIDDEN[scenario] if name in profile.modules]
+    assert loaded == []
+
+
+@pytest.mark.parametrize("scenario", list(SCENARIOS))
+def test_import_time_regression(scenario):
+    profile_import(SCENARIOS[scenario])  # 预热 .pyc
+    best = min(profile_import(SCENARIOS[scenario]).total_us for _ in range(3)) / 1000
+    assert best < THRESHOLD_MS[scenario], f"{SCENARIOS[scenario]} took {best:.1f}ms"
+
+
+def test_lazy_exports_behave_like_eager_ones():
+    code = (
+        "import src.llm_proxy as p, src.agent as a\n"
+        "assert 'OpenAILLM' in dir(p) and 'Agent' in dir(a)\n"
+        "from src.llm_proxy.openai_llm import OpenAILLM\n"
+        "assert p.OpenAILLM is OpenAILLM and 'OpenAILLM' in vars(p)\n"
+        "from src.llm_proxy import *\n"
+        "assert BaseModel.__module__.startswith('pydantic') and callable(estimate_tokens)\n"
+        "from src.agent.agent import Agent as A\n"
+        "assert a.Agent is A\n"
+        "from src.tools.retry import NETWORK_ERRORS, network_errors\n"
+        "import requests\n"
+        "assert requests.ConnectionError in network_errors() and ConnectionError in NETWORK_ERRORS\n"
+        "try:\n"
+        "    p.Missing\n"
+        "except AttributeError:\n"
+        "    pass\n"
+        "else:\n"
+        "    raise AssertionError\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,90 @@
+import asyncio
+from src.llm_proxy import OpenAILLM, AsyncOpenAILLM, HTTPTransport, add_hook, remove_hook, start_span, MetricsCollector
+from src.agent import Agent
+from src.agent.team import Team
+from benchmarks.fake_server import FakeOpenAIServer, Script
+
+ASK_CALL = '<function_call>ask_team_member({"name": "member", "question": "help"})</function_call>'
+
+
+def make_team(server: FakeOpenAIServer, cls=OpenAILLM):
+    transport = HTTPTransport(server.base_url)
+    leader = Agent("leader", "b", "g", cls(server.base_url, "key", transport=transport), "leader", allow_ask_other=True)
+    member = Agent("member", "b", "g", cls(server.base_url, "key", transport=transport), "plain")
+    Team("team", "g", "b", agents=[leader, member])
+    return leader
+
+
+def check_trace(events):
+    ends = [e for e in events if e.kind == "end"]
+    spans = {e.span_id: e for e in ends}
+    # 所有 span 属于同一个 trace，并且父 span 都已结束
+    assert len({e.trace_id for e in ends}) == 1
+    assert all(e.parent_id is None or e.parent_id in spans for e in ends)
+
+    def chain(event):
+        names = []
+        while event is not None:
+            names.append(event.name)
+            event = spans.get(event.parent_id)
+        return names
+
+    member_chat = next(e for e in ends if e.name == "agent.chat" and e.attrs["agent"] == "member")
+    assert chain(member_chat) == ["agent.chat", "team.ask", "tool.call", "function_call.stream", "agent.chat"]
+    requests = [e for e in ends if e.name == "llm.request"]
+    assert len(requests) == 2
+    assert all(chain(e)[1] == "llm.chat" for e in requests)
+    assert all(e.attrs["ttft_s"] <= e.attrs["duration"] and e.attrs["chunks"] > 0 for e in requests)
+    tool = next(e for e in ends if e.name == "tool.call")
+    assert tool.attrs["tool"] == "ask_team_member" and "error" not in tool.attrs
+
+
+def test_spans_nest_across_team_delegation():
+    assert start_span("unused") is None
+    events = []
+    metrics = MetricsCollector()
+    add_hook(events.append)
+    add_hook(metrics)
+    try:
+        scenarios = {"leader": Script(reply_tokens=6, inject=ASK_CALL, inject_at=2), "plain": Script(reply_tokens=4)}
+        with FakeOpenAIServer(scenarios=scenarios) as server:
+            text = "".join(make_team(server).chat_default("hi"))
+    finally:
+        remove_hook(events.append)
+        remove_hook(metrics)
+    assert "t0 t1 t2 t3 " in text
+    check_trace(events)
+
+    exported = metrics.export()
+    assert 'fastagent_llm_requests_total{model="leader",status="ok"} 1' in exported
+    assert 'fastagent_tool_calls_total{tool="ask_team_member",status="ok"} 1' in exported
+    assert 'fastagent_team_asks_total{member="member"} 1' in exported
+    assert 'fastagent_llm_ttft_seconds_bucket{model="plain",le="+Inf"} 1' in exported
+    assert "# TYPE fastagent_span_duration_seconds histogram" in exported
+
+
+def test_async_spans_and_errors():
+    events = []
+    add_hook(events.append)
+    try:
+        scenarios = {"leader": Script(reply_tokens=6, inject=ASK_CALL, inject_at=2), "plain": Script(reply_tokens=4),
+                     "fail": Script(error_rate=1.0, error_status=503)}
+        with FakeOpenAIServer(scenarios=scenarios) as server:
+            async def main():
+                leader = make_team(server, AsyncOpenAILLM)
+                text = "".join([chunk async for chunk in leader.achat_default("hi")])
+                await leader.llm.aclose()
+                return text
+            assert "t0 t1 t2 t3 " in asyncio.run(main())
+            check_trace(events)
+
+            events.clear()
+            llm = OpenAILLM(server.base_url, "key")
+            try:
+                llm.chat("hi", "fail", 0)
+            except Exception:
+                pass
+    finally:
+        remove_hook(events.append)
+    failed = next(e for e in events if e.kind == "end" and e.name == "llm.request")
+    assert failed.attrs["status"] == 503 and failed.attrs["error"] == "HTTP 503"
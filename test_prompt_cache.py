@@ -0,0 +1,96 @@
+import asyncio
+from typing import Generator
+from src.llm_proxy import OpenAILLM, AsyncOpenAILLM, HTTPTransport, BaseTool, BaseModel, MetricsCollector, add_hook, remove_hook
+from src.llm_proxy.usage import Usage, parse_usage
+from src.agent import Agent
+from src.agent.team import Team
+from benchmarks.fake_server import FakeOpenAIServer, Script
+
+
+class EchoInput(BaseModel):
+    text: str
+
+
+class EchoTool(BaseTool):
+    name: str = "echo"
+    description: str = "Echo the text"
+    argSchema: BaseModel = EchoInput
+
+    def _run(self, text: str) -> Generator[str, None, None]:
+        yield text
+
+
+def make_agent(server: FakeOpenAIServer, name: str = "a", **kwargs) -> Agent:
+    llm = OpenAILLM(server.base_url, "key", transport=HTTPTransport(server.base_url))
+    return Agent(name, "backstory " * 50, "goal", llm, "m", **kwargs)
+
+
+def test_parse_usage_formats():
+    openai = {"prompt_tokens": 100, "completion_tokens": 5, "prompt_tokens_details": {"cached_tokens": 64}}
+    deepseek = {"prompt_cache_hit_tokens": 64, "prompt_cache_miss_tokens": 36, "completion_tokens": 5}
+    assert parse_usage(openai) == parse_usage(deepseek) == Usage(100, 5, 64)
+    assert Usage(100, 5, 64).uncached_tokens == 36
+    assert parse_usage({"prompt_tokens": 10}) == Usage(10, 0, 0)
+    assert parse_usage(None) is None
+
+
+def test_usage_is_reported_per_call():
+    metrics = MetricsCollector()
+    add_hook(metrics)
+    try:
+        with FakeOpenAIServer(Script(reply_tokens=4)) as server:
+            agent = make_agent(server)
+            "".join(agent.chat_default("one"))
+            first = agent.llm.last_usage
+            "".join(agent.chat_default("two"))
+            second = agent.llm.last_usage
+    finally:
+        remove_hook(metrics)
+    assert first.cached_tokens == 0 and first.completion_tokens == 4
+    # 第二轮的前缀（系统提示、第一轮的问答）与第一轮相同
+    assert second.cached_tokens >= first.prompt_tokens and second.uncached_tokens > 0
+    stats = agent.llm.stats()
+    assert stats["requests"] == 2 and stats["cached_tokens"] == second.cached_tokens
+    assert stats["prompt_tokens"] == first.prompt_tokens + second.prompt_tokens == server.prompt_tokens
+    text = metrics.export()
+    assert f'fastagent_llm_prompt_tokens_total{{model="m",cache="hit"}} {second.cached_tokens}' in text
+
+    with FakeOpenAIServer(Script(reply_tokens=4)) as server:
+        llm = OpenAILLM(server.base_url, "key", transport=HTTPTransport(server.base_url), include_usage=False)
+        "".join(llm.chat_with_context("hi", "m", 0))
+        assert llm.last_usage is None and llm.stats()["requests"] == 0
+
+
+def test_async_and_native_streams_report_usage():
+    script = Script(reply_tokens=3, tool_call='echo({"text": "x"})', inject_at=1)
+    with FakeOpenAIServer(script) as server:
+        agent = make_agent(server, tools=[EchoTool()], tool_mode="native")
+        assert "".join(agent.chat_default("hi")) == "t0 xt1 t2 "
+        assert agent.llm.last_usage.prompt_tokens > 0
+
+        llm = AsyncOpenAILLM(server.base_url, "key", transport=HTTPTransport(server.base_url))
+
+        async def main():
+            "".join([chunk async for chunk in llm.achat_with_context("hi", "m", 0)])
+            await llm.aclose()
+        asyncio.run(main())
+        assert llm.last_usage.completion_tokens == 3
+
+
+def test_tool_and_team_changes_keep_the_prefix_cached():
+    with FakeOpenAIServer(Script(reply_tokens=4)) as server:
+        agent = make_agent(server, allow_ask_other=True)
+        team = Team("team", "goal", "story", [agent, make_agent(server, "b")])
+        for question in ("one", "two"):
+            "".join(agent.chat_default(question))
+        previous = agent.llm.last_usage
+        agent.add_tool(EchoTool())
+        team.add_agent(make_agent(server, "c"))
+        agent.update_identity(goal="new goal")
+        "".join(agent.chat_default("three"))
+        usage = agent.llm.last_usage
+        # 整个上一轮请求仍然命中缓存，只有追加的更新和新消息未命中
+        assert usage.cached_tokens >= previous.prompt_tokens
+        updates = [msg.content for msg in agent.llm.session if msg.role == "system"][2:]
+        assert "Member name: c" in updates[0]
+        assert "new goal" in updates[1] and "echo" in updates[1]
@@ -0,0 +1,80 @@
+import asyncio
+import threading
+import time
+import pytest
+from src.llm_proxy import OpenAILLM, HTTPTransport, RateLimiter, RateLimitExceeded, Priority, request_priority
+from benchmarks.fake_server import FakeOpenAIServer, Script
+
+
+def test_priority_order_and_wait_stats():
+    # 每秒 10 个请求，桶里只有 1 个令牌
+    limiter = RateLimiter(rpm=600, burst_seconds=0.1)
+    assert limiter.acquire() == 0.0
+    order = []
+
+    def worker(name, priority):
+        with request_priority(priority):
+            limiter.acquire()
+        order.append(name)
+
+    threads = []
+    for name, priority in (("batch", Priority.BATCH), ("background", Priority.BACKGROUND), ("chat", Priority.INTERACTIVE)):
+        thread = threading.Thread(target=worker, args=(name, priority))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.01)
+    assert limiter.stats()["queued"] == 3
+    for thread in threads:
+        thread.join()
+    assert order == ["chat", "background", "batch"]
+    stats = limiter.stats()
+    assert stats["queued"] == 0 and stats["max_queued"] == 3 and stats["granted"] == 4
+    assert stats["granted_by_priority"] == {"interactive": 2, "background": 1, "batch": 1}
+    assert 250 <= stats["wait_max_ms"] < 600
+
+
+def test_deadline_and_bounded_queue():
+    limiter = RateLimiter(rpm=60, burst_seconds=1, max_queue=1)
+    limiter.acquire()
+    with pytest.raises(TimeoutError):
+        limiter.acquire(timeout=0.05)
+    waiter = threading.Thread(target=lambda: pytest.raises(TimeoutError, limiter.acquire, timeout=0.2))
+    waiter.start()
+    time.sleep(0.05)
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire(timeout=0.05)
+    waiter.join()
+    stats = limiter.stats()
+    assert stats["timeouts"] == 2 and stats["rejected"] == 1 and stats["queued"] == 0
+
+
+def test_async_and_threaded_callers_share_tokens_per_minute():
+    limiter = RateLimiter(tpm=6000, burst_seconds=1)  # 每秒 100 个 token
+    limiter.acquire(100)
+
+    async def main():
+        start = time.perf_counter()
+        waits = await asyncio.gather(limiter.aacquire(20), limiter.aacquire(20, priority=Priority.BATCH))
+        return time.perf_counter() - start, waits
+    thread = threading.Thread(target=limiter.acquire, args=(20,))
+    thread.start()
+    elapsed, waits = asyncio.run(main())
+    thread.join()
+    assert 0.5 <= elapsed < 1.0 and max(waits) == pytest.approx(elapsed, abs=0.05)
+
+    # 结算时退回未使用的预留
+    level = limiter.stats()["tpm_available"]
+    limiter.settle(50, 10)
+    assert limiter.stats()["tpm_available"] >= level + 40
+
+
+def test_llm_pauses_after_429():
+    with FakeOpenAIServer(scenarios={"limited": Script(fail_first=1, error_status=429, retry_after="0.3")}) as server:
+        limiter = RateLimiter(rpm=6000)
+        llm = OpenAILLM(server.base_url, "key", transport=HTTPTransport(server.base_url), rate_limiter=limiter)
+        with pytest.raises(Exception, match="429"):
+            llm.chat("hi", "limited", 0)
+        start = time.perf_counter()
+        assert "".join(llm.chat("hi", "limited", 0)).startswith("t0 ")
+        assert time.perf_counter() - start >= 0.25
+        assert limiter.stats()["throttled"] == 1 and limiter.stats()["granted"] == 2
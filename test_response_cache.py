@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import time
+from typing import AsyncGenerator, Dict, Generator, List
+from src.llm_proxy import LLMBase, CachedLLM, ResponseCache, ToolCall
+
+
+class CountingLLM(LLMBase):
+    """按固定分块回复，记录实际请求次数"""
+
+    def __init__(self, delay: float = 0.0):
+        super().__init__(base_url="http://fake", api_key="")
+        self.calls = 0
+        self.delay = delay
+        self._lock = threading.Lock()
+
+    def _chat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> Generator[str, None, None]:
+        with self._lock:
+            self.calls += 1
+        return self._stream(messages[-1]["content"])
+
+    def _stream(self, text: str):
+        for chunk in ("echo", ": ", text, "!"):
+            time.sleep(self.delay)
+            yield chunk
+
+    async def _achat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> AsyncGenerator[str, None]:
+        self.calls += 1
+        for chunk in ("echo", ": ", messages[-1]["content"], "!"):
+            await asyncio.sleep(self.delay)
+            yield chunk
+
+
+def test_replays_same_chunks_and_skips_sampled_requests():
+    backend = CountingLLM()
+    llm = CachedLLM(backend)
+    first = list(llm.chat("hi", "m", 0))
+    second = list(llm.chat("hi", "m", 0))
+    assert first == second == ["echo", ": ", "hi", "!"]
+    assert backend.calls == 1
+    list(llm.chat("hi", "other-model", 0))
+    list(llm.chat("hi", "m", 0, max_tokens=10))
+    assert backend.calls == 3
+
+    list(llm.chat("hi", "m", 0.7))
+    list(llm.chat("hi", "m", 0.7))
+    assert backend.calls == 5
+    sampled = CachedLLM(backend, llm.cache, cache_sampled=True)
+    list(sampled.chat("hi", "m", 0.7))
+    list(sampled.chat("hi", "m", 0.7))
+    assert backend.calls == 6
+
+
+def test_concurrent_identical_requests_share_one_stream():
+    backend = CountingLLM(delay=0.02)
+    llm = CachedLLM(backend)
+    results = []
+
+    def worker():
+        results.append(list(llm.chat("hi", "m", 0)))
+
+    threads = [threading.Thread(target=worker) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.calls == 1
+    assert results == [["echo", ": ", "hi", "!"]] * 5
+    assert llm.cache.stats()["coalesced"] == 4
+
+
+def test_abandoned_stream_is_not_cached_and_lru_bounds(tmp_path):
+    backend = CountingLLM()
+    llm = CachedLLM(backend, ResponseCache(max_entries=1, path=str(tmp_path / "llm.db")))
+    stream = llm.chat("hi", "m", 0)
+    next(stream)
+    stream.close()
+    list(llm.chat("hi", "m", 0))
+    assert backend.calls == 2
+
+    list(llm.chat("other", "m", 0))
+    assert llm.cache.stats()["entries"] == 1
+    assert list(llm.chat("hi", "m", 0)) == ["echo", ": ", "hi", "!"]
+    assert backend.calls == 3
+    assert llm.cache.stats()["disk_hits"] == 1
+
+
+class ToolCallingLLM(CountingLLM):
+    """原生模式的后端：文本之后以 ToolCall 返回一次调用"""
+
+    def _stream(self, text: str):
+        yield "calling "
+        yield ToolCall("calc", '{"a": 1}', "call_0")
+
+
+def test_disk_cache_keeps_native_tool_calls(tmp_path):
+    path = str(tmp_path / "llm.db")
+    backend = ToolCallingLLM()
+    runs = []
+    for _ in range(2):
+        # 第二次是新的缓存，只能从文件中读取
+        llm = CachedLLM(backend, ResponseCache(path=path))
+        runs.append(list(llm.chat("hi", "m", 0)))
+    assert backend.calls == 1 and llm.cache.stats()["disk_hits"] == 1
+    call = runs[1][1]
+    assert runs[1] == runs[0] and isinstance(runs[1][0], str) and not isinstance(runs[1][0], ToolCall)
+    assert isinstance(call, ToolCall) and (call.name, call.arguments, call.id) == ("calc", '{"a": 1}', "call_0")
+
+
+def test_broken_disk_store_is_a_miss(tmp_path):
+    path = str(tmp_path / "llm.db")
+    backend = CountingLLM()
+    list(CachedLLM(backend, ResponseCache(path=path)).chat("hi", "m", 0))
+    llm = CachedLLM(backend, ResponseCache(path=path))
+    llm.cache._db.execute("UPDATE llm_cache SET chunks = '{not json'")
+    llm.cache._db.commit()
+
+    results = []
+    worker = threading.Thread(target=lambda: results.extend("".join(llm.chat("hi", "m", 0)) for _ in range(2)))
+    worker.start()
+    worker.join(2)
+    # 损坏的条目视为未命中并被重新写入，之后的相同请求不会一直等待
+    assert results == ["echo: hi!"] * 2 and backend.calls == 2
+    assert llm.cache._db.execute("SELECT chunks FROM llm_cache").fetchone()[0] != "{not json"
+
+    # 写入失败不影响已经成功的请求
+    llm.cache._db.close()
+    assert "".join(llm.chat("other", "m", 0)) == "echo: other!"
+
+
+def test_async_cache():
+    async def main():
+        backend = CountingLLM(delay=0.01)
+        llm = CachedLLM(backend)
+        results = await asyncio.gather(*[collect(llm) for _ in range(3)])
+        results.append(await collect(llm))
+        return backend, results
+
+    async def collect(llm):
+        return [chunk async for chunk in llm.achat("hi", "m", 0)]
+
+    backend, results = asyncio.run(main())
+    assert backend.calls == 1
+    assert results == [["echo", ": ", "hi", "!"]] * 4
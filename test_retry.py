@@ -0,0 +1,173 @@
+import asyncio
+import random
+import time
+from typing import AsyncGenerator, Dict, Generator, List
+import pytest
+from src.llm_proxy import LLMBase, OpenAILLM, AsyncOpenAILLM, HTTPTransport, APIError, RetryingLLM, CancelToken, ChatCancelled
+from src.llm_proxy.cancellation import cancel_scope
+from src.tools.retry import RetryPolicy, CircuitBreaker, CircuitOpenError, LatencyTracker, parse_retry_after, retry
+from benchmarks.fake_server import FakeOpenAIServer, Script
+
+EXPECTED = "".join(f"t{i} " for i in range(5))
+
+
+def make_llm(server: FakeOpenAIServer, cls=OpenAILLM, **kwargs) -> RetryingLLM:
+    backend = cls(server.base_url, "key", transport=HTTPTransport(server.base_url))
+    kwargs.setdefault("policy", RetryPolicy(base_delay=0.01, rng=random.Random(0)))
+    kwargs.setdefault("breaker", CircuitBreaker(server.base_url))
+    return RetryingLLM(backend, **kwargs)
+
+
+def test_retries_before_first_token_and_honors_retry_after():
+    scenarios = {"flaky": Script(reply_tokens=5, fail_first=2, error_status=503),
+                 "limited": Script(reply_tokens=5, fail_first=1, error_status=429, retry_after="0.2"),
+                 "bad": Script(fail_first=1, error_status=400)}
+    with FakeOpenAIServer(scenarios=scenarios) as server:
+        llm = make_llm(server)
+        assert "".join(llm.chat("hi", "flaky", 0)) == EXPECTED
+        assert llm.stats()["retries"] == 2
+
+        start = time.perf_counter()
+        assert "".join(llm.chat("hi", "limited", 0)) == EXPECTED
+        assert time.perf_counter() - start >= 0.2
+
+        with pytest.raises(APIError) as info:
+            llm.chat("hi", "bad", 0)
+        assert info.value.status_code == 400 and llm.stats()["retries"] == 3
+
+        async def main():
+            async_llm = make_llm(server, AsyncOpenAILLM)
+            server.scenarios["flaky"] = Script(reply_tokens=5, fail_first=server._served["flaky"] + 1, error_status=502)
+            text = "".join([chunk async for chunk in async_llm.achat("hi", "flaky", 0)])
+            await async_llm.llm.aclose()
+            return text, async_llm.stats()["retries"]
+        assert asyncio.run(main()) == (EXPECTED, 1)
+
+
+def test_policy_helpers():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
+    policy = RetryPolicy(max_retries=2, base_delay=1.0, max_delay=3.0, rng=random.Random(1))
+    assert all(0 <= policy.delay(attempt) <= min(3.0, 2 ** attempt) for attempt in range(2))
+    assert policy.delay(2) is None
+    assert policy.delay(0, APIError(429, "", "120")) is None  # Retry-After 超过上限
+    assert policy.is_retryable(ConnectionError()) and not policy.is_retryable(ValueError())
+
+    calls = []
+
+    @retry(max_retries=3, delay=0.001, jitter=True)
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise RuntimeError
+        return "ok"
+    assert asyncio.run(flaky()) == "ok" and len(calls) == 3
+
+
+def test_circuit_breaker_fails_fast_and_recovers():
+    with FakeOpenAIServer(scenarios={"down": Script(reply_tokens=5, fail_first=2, error_status=500)}) as server:
+        breaker = CircuitBreaker(server.base_url, failure_threshold=2, recovery_timeout=0.2)
+        llm = make_llm(server, policy=RetryPolicy(max_retries=0), breaker=breaker)
+        for _ in range(2):
+            with pytest.raises(APIError):
+                llm.chat("hi", "down", 0)
+        assert breaker.state == "open"
+        with pytest.raises(CircuitOpenError):
+            llm.chat("hi", "down", 0)
+        assert server.requests == 2 and llm.stats()["rejected"] == 1
+
+        time.sleep(0.25)
+        assert "".join(llm.chat("hi", "down", 0)) == EXPECTED
+        assert breaker.state == "closed"
+
+
+def test_cancelled_probe_releases_the_breaker():
+    scenarios = {"down": Script(fail_first=2, error_status=500), "slow": Script(reply_tokens=5, ttft=2.0)}
+    with FakeOpenAIServer(Script(reply_tokens=5), scenarios=scenarios) as server:
+        for cls in (OpenAILLM, AsyncOpenAILLM):
+            breaker = CircuitBreaker(server.base_url, failure_threshold=1, recovery_timeout=0.1)
+            llm = make_llm(server, cls=cls, policy=RetryPolicy(max_retries=0), breaker=breaker)
+            if cls is OpenAILLM:
+                with pytest.raises(APIError):
+                    llm.chat("hi", "down", 0)
+                time.sleep(0.15)
+                # 探测请求被取消：既不算成功也不算失败
+                with pytest.raises(ChatCancelled):
+                    with cancel_scope(CancelToken(0.1)):
+                        llm.chat("hi", "slow", 0)
+                assert breaker.state == "half_open" and not breaker._probing
+                assert "".join(llm.chat("hi", "ok", 0)) == EXPECTED
+            else:
+                async def main():
+                    with pytest.raises(APIError):
+                        await llm.achat("hi", "down", 0).__anext__()
+                    await asyncio.sleep(0.15)
+                    # 任务被取消时 except Exception 捕获不到 CancelledError
+                    with pytest.raises(asyncio.TimeoutError):
+                        await asyncio.wait_for(llm.achat("hi", "slow", 0).__anext__(), 0.1)
+                    assert breaker.state == "half_open" and not breaker._probing
+                    chunks = [chunk async for chunk in llm.achat("hi", "ok", 0)]
+                    await llm.llm.aclose()
+                    return "".join(chunks)
+                assert asyncio.run(main()) == EXPECTED
+            assert breaker.state == "closed"
+
+
+class SlowFirstLLM(LLMBase):
+    """第一个请求的首包很慢，之后的请求立即返回"""
+
+    def __init__(self):
+        super().__init__(base_url="http://slow", api_key="")
+        self.calls = 0
+        self.closed = 0
+
+    def _reply(self, index: int):
+        return ["slow" if index == 0 else "fast", "!"]
+
+    def _chat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> Generator[str, None, None]:
+        index, self.calls = self.calls, self.calls + 1
+        return self._stream(index)
+
+    def _stream(self, index: int):
+        try:
+            if index == 0:
+                time.sleep(0.3)
+            yield from self._reply(index)
+        finally:
+            self.closed += 1
+
+    async def _achat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> AsyncGenerator[str, None]:
+        index, self.calls = self.calls, self.calls + 1
+        try:
+            if index == 0:
+                await asyncio.sleep(0.3)
+            for chunk in self._reply(index):
+                yield chunk
+        finally:
+            self.closed += 1
+
+
+def test_hedged_request_wins_over_slow_first_token():
+    latency = LatencyTracker()
+    for _ in range(20):
+        latency.observe(0.01)
+    backend = SlowFirstLLM()
+    llm = RetryingLLM(backend, breaker=CircuitBreaker("slow"), hedge_quantile=0.95, latency=latency)
+    start = time.perf_counter()
+    assert "".join(llm.chat("hi", "m", 0)) == "fast!"
+    assert time.perf_counter() - start < 0.25
+    time.sleep(0.4)
+    assert backend.calls == 2 and backend.closed == 2
+    assert llm.stats()["hedges"] == 1 and llm.stats()["hedge_wins"] == 1
+
+    backend = SlowFirstLLM()
+    llm = RetryingLLM(backend, breaker=CircuitBreaker("slow"), hedge_quantile=0.95, latency=latency)
+
+    async def main():
+        text = "".join([chunk async for chunk in llm.achat("hi", "m", 0)])
+        return text
+    start = time.perf_counter()
+    assert asyncio.run(main()) == "fast!"
+    assert time.perf_counter() - start < 0.25
+    assert backend.calls == 2 and backend.closed == 2 and llm.stats()["hedge_wins"] == 1
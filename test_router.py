@@ -0,0 +1,92 @@
+import asyncio
+import pytest
+from src.llm_proxy import OpenAILLM, AsyncOpenAILLM, HTTPTransport, RouterLLM, Backend, APIError
+from benchmarks.fake_server import FakeOpenAIServer, Script
+
+EXPECTED = "".join(f"t{i} " for i in range(5))
+
+
+def backend(server: FakeOpenAIServer, cls=OpenAILLM, weight: float = 1.0, name: str = None) -> Backend:
+    return Backend(cls(server.base_url, "key", transport=HTTPTransport(server.base_url)), weight, name)
+
+
+def test_fails_over_before_first_byte_and_cools_down():
+    with FakeOpenAIServer(Script(reply_tokens=5, error_rate=1.0, error_status=503)) as bad, \
+            FakeOpenAIServer(Script(reply_tokens=5)) as good:
+        # 坏后端权重更高，第一次请求一定先选中它
+        router = RouterLLM([backend(bad, weight=2, name="bad"), backend(good, name="good")],
+                           failure_threshold=1, cooldown=60)
+        for _ in range(3):
+            assert "".join(router.chat("hi", "m", 0)) == EXPECTED
+        stats = {b["name"]: b for b in router.stats()["backends"]}
+        assert bad.requests == 1 and stats["bad"]["healthy"] is False
+        assert stats["good"]["requests"] == 3 and stats["good"]["inflight"] == 0
+        assert router.stats()["failovers"] == 1
+
+        # 健康检查通过后立即恢复
+        assert router.check_health() == {"bad": True, "good": True}
+        assert {b["name"]: b["healthy"] for b in router.stats()["backends"]} == {"bad": True, "good": True}
+
+
+def test_raises_last_error_when_every_backend_fails():
+    with FakeOpenAIServer(Script(error_rate=1.0, error_status=503)) as bad:
+        router = RouterLLM([backend(bad, name="a"), backend(bad, name="b")])
+        with pytest.raises(APIError):
+            router.chat("hi", "m", 0)
+        assert bad.requests == 2
+        router.backends.clear()
+        with pytest.raises(RuntimeError):
+            router.chat("hi", "m", 0)
+
+
+def test_prefers_fast_backend_and_respects_load():
+    with FakeOpenAIServer(Script(reply_tokens=5, ttft=0.15)) as slow, FakeOpenAIServer(Script(reply_tokens=5)) as fast:
+        router = RouterLLM([backend(slow, name="slow"), backend(fast, name="fast")], seed=0)
+        for _ in range(2):
+            "".join(router.chat("hi", "m", 0))
+        for _ in range(5):
+            "".join(router.chat("hi", "m", 0))
+        stats = {b["name"]: b for b in router.stats()["backends"]}
+        assert stats["slow"]["requests"] <= 2 and stats["fast"]["requests"] >= 5
+        assert stats["slow"]["ttft_ms"] > stats["fast"]["ttft_ms"]
+
+        # 快后端上的进行中流足够多时，慢后端也会分到请求
+        slow_backend, fast_backend = router.backends
+        router.ttft_alpha = 0.0
+        slow_backend.ttft, fast_backend.ttft = 0.1, 0.01
+        streams = [router.chat("hi", "m", 0) for _ in range(12)]
+        assert slow_backend.inflight >= 1 and fast_backend.inflight >= 10
+        for stream in streams:
+            stream.close()
+        assert slow_backend.inflight == fast_backend.inflight == 0
+
+
+def test_async_failover():
+    with FakeOpenAIServer(Script(reply_tokens=5, drop_after=0)) as bad, FakeOpenAIServer(Script(reply_tokens=5)) as good:
+        router = RouterLLM([backend(bad, AsyncOpenAILLM, weight=100, name="bad"),
+                            backend(good, AsyncOpenAILLM, name="good")])
+
+        async def main():
+            text = "".join([chunk async for chunk in router.achat("hi", "m", 0)])
+            for b in router.backends:
+                await b.llm.aclose()
+            return text
+        assert asyncio.run(main()) == EXPECTED
+        assert router.stats()["failovers"] == 1
+
+
+def test_cancelled_request_releases_the_backend():
+    with FakeOpenAIServer(Script(reply_tokens=5, ttft=2.0)) as slow:
+        router = RouterLLM([backend(slow, AsyncOpenAILLM, name="slow")])
+
+        async def consume():
+            return "".join([chunk async for chunk in router.achat("hi", "m", 0)])
+
+        async def main():
+            # 首个数据块之前任务被取消
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(consume(), 0.1)
+            await router.backends[0].llm.aclose()
+        asyncio.run(main())
+        stats = router.stats()["backends"][0]
+        assert stats["inflight"] == 0 and stats["errors"] == 0
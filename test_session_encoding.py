@@ -0,0 +1,39 @@
+import json
+from typing import Dict, Generator, List
+from src.llm_proxy import LLMBase, LLMMessage
+from src.llm_proxy.llm_base import MessageList, encode_request_body
+from src.agent import Agent
+
+
+class RecordingLLM(LLMBase):
+    def __init__(self):
+        super().__init__(base_url="", api_key="")
+        self.bodies: List[bytes] = []
+
+    def _chat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> Generator[str, None, None]:
+        self.bodies.append(encode_request_body(messages, model=model, temperature=temperature, stream=True))
+        yield "<function_call>missing({})</function_call>"
+
+
+def test_body_reuses_message_fragments():
+    session = [LLMMessage("system", "身份"), LLMMessage("user", 'quote " and \\ backslash')]
+    body = encode_request_body(MessageList(session), model="m", temperature=0.5, stream=True)
+    assert json.loads(body) == {
+        "messages": [msg.to_dict() for msg in session], "model": "m", "temperature": 0.5, "stream": True
+    }
+    fragment = session[0].to_json()
+    assert session[0].to_json() is fragment
+    session[0].content = "new"
+    assert json.loads(session[0].to_json())["content"] == "new"
+    assert json.loads(encode_request_body([{"role": "user", "content": "x"}]))["messages"][0]["content"] == "x"
+
+
+def test_agent_writes_each_turn_once():
+    llm = RecordingLLM()
+    agent = Agent("a", "b", "c", llm, "m")
+    for question in ("one", "two"):
+        "".join(agent.chat_default(question))
+    assert [msg.role for msg in llm.session] == ["system", "user", "assistant", "user", "assistant"]
+    # 保存的是替换了函数调用结果之后的回复
+    assert "Function Call Error" in llm.session[2].content
+    assert [m["role"] for m in json.loads(llm.bodies[-1])["messages"]] == ["system", "user", "assistant", "user"]
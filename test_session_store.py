@@ -0,0 +1,68 @@
+import time
+from typing import Dict, Generator, List
+from src.llm_proxy import LLMBase, LLMMessage, MemorySessionStore, SQLiteSessionStore
+from src.agent import Agent
+
+
+class EchoLLM(LLMBase):
+    def __init__(self):
+        super().__init__(base_url="", api_key="")
+
+    def _chat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> Generator[str, None, None]:
+        yield f"reply {len(messages)}"
+
+
+def make_agent(store, session_id="alice") -> Agent:
+    return Agent("alice", "b", "c", EchoLLM(), "m", session_store=store, session_id=session_id)
+
+
+def test_sqlite_store_survives_restart(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = SQLiteSessionStore(path, flush_interval=60)
+    agent = make_agent(store)
+    for question in ("one", "two"):
+        "".join(agent.chat_default(question))
+    agent.update_identity(goal="new goal")
+    "".join(agent.chat_default("three"))
+    store.close()
+
+    restarted = SQLiteSessionStore(path)
+    # 对话开始后的身份变化追加在会话末尾
+    stored = restarted.get("alice")
+    assert "new goal" not in stored[0].content and "new goal" in stored[5].content
+    agent = make_agent(restarted)
+    session = agent.llm.session
+    assert [msg.role for msg in session] == ["system"] + ["user", "assistant"] * 2 + ["system", "user", "assistant"]
+    # 新的 Agent 用自己的身份替换第一条 system 消息，其余历史保持不变
+    assert "Your goal: c" in session[0].content
+    assert session[-1].content == "reply 7"
+
+    agent.clear_context()
+    "".join(agent.chat_default("four"))
+    restarted.close()
+    reopened = SQLiteSessionStore(path)
+    assert [msg.content for msg in reopened.get("alice")[1:]] == ["four", "reply 2"]
+    reopened.close()
+
+
+def test_write_behind_batches_and_idle_eviction(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"), flush_interval=0.05, idle_timeout=0.1)
+    llm = EchoLLM()
+    llm.bind_session(store, "bob")
+    llm.session.extend([LLMMessage("user", str(i)) for i in range(100)])
+    assert store.resident_sessions() == ["bob"]
+    time.sleep(0.4)
+    assert store.resident_sessions() == []  # 已写入并移出内存
+    assert len(llm.session) == 100  # 再次访问时加载
+    llm.clear_session()
+    assert llm.session == []
+    store.close()
+
+
+def test_memory_store_shares_sessions_by_id():
+    store = MemorySessionStore()
+    first, second = EchoLLM(), EchoLLM()
+    first.bind_session(store, "shared")
+    second.bind_session(store, "shared")
+    "".join(first.chat_with_context("hi", "m", 0))
+    assert [msg.content for msg in second.session] == ["hi", "reply 1"]
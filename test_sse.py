@@ -0,0 +1,35 @@
+import json
+from src.llm_proxy.sse import SSEDecoder, iter_deltas, iter_sse_json, json_loads
+
+
+def frame(content: str, newline: bytes = b"\n") -> bytes:
+    event = {"choices": [{"index": 0, "delta": {"content": content}}]}
+    return b"data: " + json.dumps(event, ensure_ascii=False).encode("utf-8") + newline * 2
+
+
+def test_frames_split_at_every_byte():
+    payload = b": keep-alive\n\n" + frame("你好") + frame("，") + frame("world") + b"data: [DONE]\n\n"
+    for size in range(1, 40):
+        reads = [payload[i:i + size] for i in range(0, len(payload), size)]
+        assert "".join(iter_deltas(reads, loads=json_loads)) == "你好，world"
+
+
+def test_crlf_and_multiline_data():
+    payload = frame("a", b"\r\n") + b'event: message\r\ndata: {"choices": [{"delta":\r\ndata: {"content": "b"}}]}\r\n\r\n'
+    reads = [payload[i:i + 1] for i in range(len(payload))]
+    assert "".join(iter_deltas(reads)) == "ab"
+
+
+def test_malformed_frames_go_to_callback():
+    errors = []
+    payload = frame("a") + b"data: {not json\n\n" + frame("b") + b"data: [DONE]\n\n" + frame("ignored")
+    text = "".join(iter_deltas([payload], on_error=lambda data, e: errors.append(data)))
+    assert text == "ab"
+    assert errors == [b"{not json"]
+
+
+def test_flush_unterminated_event():
+    decoder = SSEDecoder()
+    assert decoder.feed(b'data: {"x": 1}') == []
+    assert decoder.flush() == [b'{"x": 1}']
+    assert list(iter_sse_json([b'data: {"x": 1}\n'])) == [{"x": 1}]
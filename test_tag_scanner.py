@@ -0,0 +1,90 @@
+import random
+import re
+from src.llm_proxy.tag_scanner import TagScanner, FUNCTION_CALL_TAG, TOOL_CALL_TAG
+
+
+def reference(text: str, dialects) -> list:
+    """在完整文本上用正则得到的期望结果"""
+    pattern = re.compile("|".join(f"{re.escape(d.start)}(.*?){re.escape(d.end)}" for d in dialects), re.S)
+    events, pos = [], 0
+    for match in pattern.finditer(text):
+        events.append(('text', text[pos:match.start()]))
+        events.append(('call', next(g for g in match.groups() if g is not None)))
+        pos = match.end()
+    events.append(('text', text[pos:]))
+    return events
+
+
+def normalize(events: list) -> list:
+    """合并相邻文本，去掉空文本"""
+    merged = []
+    for kind, value in events:
+        if kind == 'text' and merged and merged[-1][0] == 'text':
+            merged[-1] = ('text', merged[-1][1] + value)
+        else:
+            merged.append((kind, value))
+    return [e for e in merged if e != ('text', '')]
+
+
+def scan(text: str, sizes, dialects) -> list:
+    scanner = TagScanner(dialects)
+    events, pos, i = [], 0, 0
+    while pos < len(text):
+        size = sizes[i % len(sizes)]
+        events += scanner.feed(text[pos:pos + size])
+        pos += size
+        i += 1
+    return events + scanner.flush()
+
+
+def test_matches_reference_for_every_split():
+    dialects = [FUNCTION_CALL_TAG, TOOL_CALL_TAG]
+    text = ('a < b <function_call>calc({"x": "<function_call"})</function_call>tail <tool_call>'
+            '{"name": "w"}</tool_call><<<function_call>x()</function_call></function_call>end <function')
+    expected = normalize(reference(text, dialects))
+    for size in range(1, 30):
+        assert normalize(scan(text, [size], dialects)) == expected
+
+
+def test_random_streams():
+    rng = random.Random(0)
+    pieces = ["<", "<function_call>", "</function_call>", "</", "<function", "call>", "x", "文本", " "]
+    for _ in range(300):
+        text = "".join(rng.choice(pieces) for _ in range(40))
+        sizes = [rng.randint(1, 8) for _ in range(5)]
+        got = normalize(scan(text, sizes, [FUNCTION_CALL_TAG]))
+        expected = reference(text, [FUNCTION_CALL_TAG])
+        # 未闭合的调用在流结束时作为文本输出，与正则的结果一致
+        assert got == normalize(expected)
+
+
+def test_plain_chunks_pass_through_unchanged():
+    scanner = TagScanner()
+    chunk = "no tags here"
+    [(kind, value)] = scanner.feed(chunk)
+    assert kind == 'text' and value is chunk
+
+
+def test_function_call_accepts_json_object_calls():
+    from pydantic import BaseModel
+    from src.llm_proxy import BaseTool, FunctionCall
+
+    class AddSchema(BaseModel):
+        x: int
+        y: int
+
+    class AddTool(BaseTool):
+        name = "add"
+        description = "加法"
+        argSchema = AddSchema
+
+        def _run(self, x: int, y: int) -> int:
+            return x + y
+
+    function_call = FunctionCall(dialects=[TOOL_CALL_TAG, FUNCTION_CALL_TAG])
+    function_call.add_tool(AddTool())
+    stream = ['<tool_', 'call>{"name": "add", "arguments": {"x": 1, "y": 2}}</tool_call> / ',
+              '<function_call>add({"x": 3, "y": 4})</function_call>']
+    text = "".join(function_call.handle_stream(iter(stream)))
+    assert text.endswith("Result: 3] / [Function Call: add({\"x\": 3, \"y\": 4}), Result: 7]")
+    assert "<tool_call>tool_name(parameter_JSON)</tool_call>" in function_call.get_system_prompt()
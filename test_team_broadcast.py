@@ -0,0 +1,90 @@
+import asyncio
+import time
+from src.llm_proxy import OpenAILLM, AsyncOpenAILLM, HTTPTransport
+from src.agent import Agent
+from src.agent.team import Team
+from benchmarks.fake_server import FakeOpenAIServer, Script
+
+BROADCAST = '<function_call>ask_team_members({"question": "help"})</function_call>'
+
+
+def make_team(server: FakeOpenAIServer, cls=OpenAILLM, **kwargs):
+    transport = HTTPTransport(server.base_url)
+    leader = Agent("leader", "b", "g", cls(server.base_url, "key", transport=transport), "leader", allow_ask_other=True)
+    members = [Agent(name, "b", "g", cls(server.base_url, "key", transport=transport), name)
+               for name in ("slow", "fast", "mid")]
+    team = Team("team", "g", "b", agents=[leader, *members], **kwargs)
+    return team, leader
+
+
+def scenarios(inject=BROADCAST):
+    return {
+        "leader": Script(reply_tokens=4, inject=inject, inject_at=1),
+        "slow": Script(reply_tokens=3, ttft=0.4),
+        "fast": Script(reply_tokens=3, ttft=0.05),
+        "mid": Script(reply_tokens=3, ttft=0.2),
+    }
+
+
+def tool_result(leader: Agent) -> str:
+    return next(m.content for m in leader.llm.session if "[slow]" in m.content or "[fast]" in m.content)
+
+
+def test_member_lookup_is_by_name():
+    with FakeOpenAIServer(scenarios=scenarios()) as server:
+        team, leader = make_team(server)
+        assert team.get_agent("fast") is team.agents[2]
+        team.remove_agent(team.get_agent("fast"))
+        assert team.get_agent("fast") is None
+        assert team.get_agent("missing") is None
+
+
+def test_broadcast_runs_concurrently_in_completion_order():
+    with FakeOpenAIServer(scenarios=scenarios()) as server:
+        team, leader = make_team(server)
+        start = time.perf_counter()
+        "".join(leader.chat_default("hi"))
+        elapsed = time.perf_counter() - start
+    result = tool_result(leader)
+    # 三个成员并发回答，总时间接近最慢的成员而不是三者之和
+    assert elapsed < 0.4 + 0.2 + 0.05
+    assert result.index("[fast]") < result.index("[mid]") < result.index("[slow]")
+    assert "[leader]" not in result
+    assert "[fast]: t0 t1 t2 " in result
+
+
+def test_broadcast_member_ordering_and_unknown_names():
+    inject = '<function_call>ask_team_members({"question": "help", "names": ["slow", "nobody", "fast"]})</function_call>'
+    with FakeOpenAIServer(scenarios=scenarios(inject)) as server:
+        team, leader = make_team(server, broadcast_ordering="member")
+        "".join(leader.chat_default("hi"))
+    result = tool_result(leader)
+    assert result.index("[slow]: t0 t1 t2 ") < result.index("[nobody]: Agent not found") < result.index("[fast]: t0 t1 t2 ")
+    assert "[mid]" not in result
+
+
+def test_broadcast_deadline_returns_partial_results():
+    with FakeOpenAIServer(scenarios=scenarios()) as server:
+        team, leader = make_team(server, broadcast_deadline=0.25)
+        start = time.perf_counter()
+        "".join(leader.chat_default("hi"))
+        elapsed = time.perf_counter() - start
+    result = tool_result(leader)
+    assert elapsed < 0.4
+    assert "[fast]: t0 t1 t2 " in result
+    assert "[slow]:  [no complete answer before the deadline]" in result
+
+
+def test_async_broadcast():
+    with FakeOpenAIServer(scenarios=scenarios()) as server:
+        async def main():
+            team, leader = make_team(server, AsyncOpenAILLM)
+            start = time.perf_counter()
+            "".join([chunk async for chunk in leader.achat_default("hi")])
+            elapsed = time.perf_counter() - start
+            await leader.llm.aclose()
+            return leader, elapsed
+        leader, elapsed = asyncio.run(main())
+    result = tool_result(leader)
+    assert elapsed < 0.4 + 0.2 + 0.05
+    assert result.index("[fast]") < result.index("[mid]") < result.index("[slow]")
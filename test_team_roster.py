@@ -0,0 +1,106 @@
+from typing import Dict, Generator, List
+from src.llm_proxy import LLMBase, LLMMessage
+from src.agent import Agent
+from src.agent.team import Team
+
+
+class RecordingLLM(LLMBase):
+    def __init__(self):
+        super().__init__(base_url="", api_key="")
+        self.sent: List[List[Dict[str, str]]] = []
+
+    def _chat_raw(self, messages: List[Dict[str, str]], model: str, temperature: float, **kwargs) -> Generator[str, None, None]:
+        self.sent.append(list(messages))
+        yield "ok"
+
+
+def make_agent(name: str, backstory: str = "backstory") -> Agent:
+    return Agent(name, backstory, "goal", RecordingLLM(), "model", allow_ask_other=True)
+
+
+def test_roster_is_shared_and_up_to_date():
+    first, second = make_agent("first"), make_agent("second")
+    team = Team("team", "goal", "story", [first, second])
+    assert first.llm.session[1] is second.llm.session[1] is team.roster_message
+
+    late = make_agent("late")
+    team.add_agent(late)
+    "".join(first.chat_default("hi"))
+    # 早加入的成员也能看到后加入的成员
+    roster = first.llm.sent[0][1]["content"]
+    assert "Member name: late" in roster and "Member name: second" in roster
+    assert "ask_team_member:" not in roster
+
+
+def test_remove_agent_only_removes_roster():
+    agent = make_agent("a")
+    other = make_agent("b")
+    team = Team("team", "goal", "story", [agent, other])
+    session = agent.llm.session
+    # 会话中在名单之前插入一条 system 消息
+    session.insert(1, LLMMessage(role="system", content="note"))
+    team.remove_agent(agent)
+    assert [msg.content for msg in agent.llm.session[1:]] == ["note"]
+    assert team.get_agent("a") is None and team.agents == [other]
+    assert "Member name: a\n" not in team.roster_message.content
+    assert "ask_team_member" not in agent.system_message.content
+
+    # 对话开始后离开团队：已经发送过的名单保留，追加离开的说明和工具变化
+    "".join(other.chat_default("hi"))
+    prefix = [msg.content for msg in other.llm.session[:2]]
+    team.remove_agent(other)
+    "".join(other.chat_default("again"))
+    assert [msg["content"] for msg in other.llm.sent[1][:2]] == prefix
+    assert [msg["role"] for msg in other.llm.sent[1][2:]] == ["user", "assistant", "system", "system", "user"]
+    assert "no longer a member" in other.llm.sent[1][4]["content"]
+    assert "ask_team_member" in other.llm.sent[1][5]["content"]
+
+
+def test_changes_after_the_conversation_started_are_appended():
+    first, second = make_agent("first"), make_agent("second")
+    team = Team("team", "goal", "story", [first, second])
+    "".join(first.chat_default("hi"))
+    sent = [msg.to_json() for msg in first.llm.session]
+
+    # 新成员加入：first 的会话前缀不变，变化以一条更新追加；second 还没有对话，共享的名单直接更新
+    team.add_agent(make_agent("late"))
+    team.add_agent(make_agent("later"))
+    "".join(first.chat_default("again"))
+    "".join(second.chat_default("hi"))
+    request = first.llm.sent[-1]
+    assert [msg.to_json() for msg in first.llm.session[:len(sent)]] == sent
+    update = request[len(sent)]["content"]
+    assert request[len(sent)]["role"] == "system" and update.startswith("Update of your team team")
+    assert "Member name: late" in update and "Member name: later" in update
+    assert "Member name: later" in second.llm.sent[-1][1]["content"]
+    assert second.llm.session[1] is team.roster_message
+
+    # 已经发送过的更新同样保持不变，之后的变化追加新的更新
+    team.remove_agent(team.get_agent("late"))
+    "".join(first.chat_default("third"))
+    assert first.llm.sent[-1][len(sent)]["content"] == update
+    assert first.llm.sent[-1][-2]["content"].endswith("Members who left your team: late")
+
+
+def test_roster_is_rendered_lazily():
+    team = Team("team", "goal", "story")
+    renders = []
+    render = team.roster_message._render
+    team.roster_message._render = lambda: renders.append(1) or render()
+    for i in range(50):
+        team.add_agent(make_agent(f"m{i}"))
+    assert renders == []
+    assert "m49" in team.roster_message.content
+    assert "m49" in team.roster_message.content
+    assert len(renders) == 1
+
+
+def test_large_team_roster_is_summarized():
+    agents = [make_agent(f"m{i}", f"role {i}\nlong details {i}") for i in range(20)]
+    team = Team("team", "goal", "story", agents, roster_summary_threshold=10)
+    roster = team.roster_message.content
+    assert "- m3: role 3" in roster and "long details" not in roster
+    assert "describe_team_member" in roster
+    tool = agents[0].function_call.tools["describe_team_member"]
+    assert "long details 3" in tool._run(name="m3")
+    assert tool._run(name="nobody") == "Agent not found"
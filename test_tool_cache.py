@@ -0,0 +1,102 @@
+import threading
+import time
+from pydantic import BaseModel
+from src.llm_proxy import BaseTool, FunctionCall, ToolCache, ToolExecutor
+
+
+class LookupSchema(BaseModel):
+    city: str
+    days: int = 1
+
+
+class LookupTool(BaseTool):
+    name = "lookup"
+    description = "查询，记录执行次数"
+    argSchema = LookupSchema
+
+    def __init__(self, delay: float = 0.0):
+        self.calls = 0
+        self.delay = delay
+        self._lock = threading.Lock()
+
+    def _run(self, city: str, days: int = 1) -> str:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return f"{city}:{days}"
+
+
+def run(function_call: FunctionCall, calls) -> str:
+    stream = [f"<function_call>lookup({args})</function_call>" for args in calls]
+    return "".join(function_call.handle_stream(iter(stream)))
+
+
+def test_canonicalized_args_hit_cache():
+    tool = LookupTool()
+    cache = ToolCache()
+    function_call = FunctionCall(cache=cache)
+    function_call.add_tool(tool)
+    # 参数顺序、默认值和类型转换不影响缓存键
+    run(function_call, ['{"city": "北京"}', '{"days": 1, "city": "北京"}', '{"city": "北京", "days": "1"}'])
+    assert tool.calls == 1
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+
+def test_ttl_lru_and_opt_out():
+    tool = LookupTool()
+    cache = ToolCache(max_entries=1, ttl=0.05)
+    function_call = FunctionCall(cache=cache)
+    function_call.add_tool(tool)
+    run(function_call, ['{"city": "a"}', '{"city": "b"}', '{"city": "a"}'])
+    assert tool.calls == 3
+    run(function_call, ['{"city": "a"}'])
+    assert tool.calls == 3
+    time.sleep(0.06)
+    run(function_call, ['{"city": "a"}'])
+    assert tool.calls == 4
+
+    tool.cacheable = False
+    run(function_call, ['{"city": "a"}', '{"city": "a"}'])
+    assert tool.calls == 6
+
+
+def test_concurrent_identical_calls_share_one_execution():
+    tool = LookupTool(delay=0.1)
+    cache = ToolCache()
+    function_call = FunctionCall(executor=ToolExecutor(max_workers=4), cache=cache)
+    function_call.add_tool(tool)
+    text = run(function_call, ['{"city": "北京"}'] * 4)
+    assert text.count("Result: 北京:1") == 4
+    assert tool.calls == 1
+    assert cache.stats()["coalesced"] == 3
+
+
+def test_disk_store_survives_new_cache(tmp_path):
+    path = str(tmp_path / "tools.db")
+    tool = LookupTool()
+    for _ in range(2):
+        function_call = FunctionCall(cache=ToolCache(path=path))
+        function_call.add_tool(tool)
+        run(function_call, ['{"city": "北京"}'])
+    assert tool.calls == 1
+    assert function_call.cache.stats()["disk_hits"] == 1
+
+
+def test_broken_disk_store_is_a_miss(tmp_path):
+    tool = LookupTool()
+    cache = ToolCache(path=str(tmp_path / "tools.db"))
+    key = cache.make_key(tool, {"city": "北京"})
+    cache._db.execute("INSERT INTO tool_cache (key, expires, value) VALUES (?, NULL, ?)", (key, b"garbage"))
+    cache._db.commit()
+
+    results = []
+    worker = threading.Thread(target=lambda: results.extend(cache.call(tool, {"city": "北京"}) for _ in range(2)))
+    worker.start()
+    worker.join(2)
+    # 损坏的条目被删除，之后的相同调用不会一直等待
+    assert results == ["北京:1", "北京:1"] and tool.calls == 1
+    assert cache._db.execute("SELECT value FROM tool_cache").fetchall() != [(b"garbage",)]
+
+    # 写入失败不影响调用结果
+    cache._db.close()
+    assert cache.call(tool, {"city": "上海"}) == "上海:1"
@@ -0,0 +1,95 @@
+import asyncio
+import json
+from src.llm_proxy import OpenAILLM, AsyncOpenAILLM, HTTPTransport, BaseTool, BaseModel, FunctionCall
+from src.llm_proxy.tool_calls import ToolCall, ToolCallAssembler, parse_arguments
+from src.agent import Agent
+from benchmarks.fake_server import FakeOpenAIServer, Script
+
+
+class UpperInput(BaseModel):
+    text: str
+    times: int = 1
+
+
+class UpperTool(BaseTool):
+    name: str = "upper"
+    description: str = "Upper case the text"
+    argSchema: BaseModel = UpperInput
+
+    def _run(self, text: str, times: int) -> str:
+        return text.upper() * times
+
+
+def delta(**fields):
+    return {"choices": [{"index": 0, "delta": fields}]}
+
+
+def test_assembler_joins_streamed_tool_calls():
+    assembler = ToolCallAssembler()
+    out = []
+    for event in [
+        delta(content="Let me check. "),
+        delta(tool_calls=[{"index": 0, "id": "a", "function": {"name": "upper", "arguments": '{"te'}}]),
+        delta(tool_calls=[{"index": 0, "function": {"arguments": 'xt": "x"}'}}]),
+        delta(tool_calls=[{"index": 1, "id": "b", "function": {"name": "upper", "arguments": "{}"}}]),
+        {"choices": [{"index": 0, "delta": {}, "finish_reason": "tool_calls"}]},
+    ]:
+        out.extend(assembler.feed(event))
+    assert out[0] == "Let me check. " and not isinstance(out[0], ToolCall)
+    first, second = out[1:]
+    assert (first.id, first.name, first.arguments) == ("a", "upper", '{"text": "x"}')
+    assert first == 'upper({"text": "x"})'
+    assert (second.id, second.arguments) == ("b", "{}")
+    assert assembler.flush() == []
+
+
+def test_arguments_are_validated_and_repaired():
+    tool = UpperTool()
+    assert parse_arguments(tool, '{"text": "a", "times": "2"}') == {"text": "a", "times": 2}
+    # 单引号和多余的逗号由 json-repair 修复
+    assert parse_arguments(tool, "{'text': 'a',}") == {"text": "a", "times": 1}
+    function_call = FunctionCall()
+    function_call.add_tool(tool)
+    result = function_call._execute_function_call(ToolCall("upper", '{"times": 2}'))
+    assert result.startswith("[Function Call Error: Parameter validation failed")
+    stream = iter(["a ", ToolCall("upper", '{"text": "b"}'), " <function_call>upper({})</function_call>"])
+    out = "".join(function_call.handle_stream(stream, native=True))
+    # 原生模式不解析文本中的标签
+    assert out == 'a [Function Call: upper({"text": "b"}), Result: B] <function_call>upper({})</function_call>'
+
+
+def make_agent(server: FakeOpenAIServer, cls=OpenAILLM) -> Agent:
+    llm = cls(server.base_url, "key", transport=HTTPTransport(server.base_url))
+    return Agent("agent", "b", "g", llm, "native", tools=[UpperTool()], tool_mode={"native": "native"})
+
+
+def test_agent_native_mode_per_model():
+    script = Script(reply_tokens=4, inject_at=2, tool_call='upper({"text": "hi", "times": 2})')
+    with FakeOpenAIServer(scenarios={"native": script, "text": script}) as server:
+        agent = make_agent(server)
+        assert "argSchema" not in agent.system_message.content
+        text = "".join(agent.chat_default("hi"))
+        assert text == 't0 t1 [Function Call: upper({"text": "hi", "times": 2}), Result: HIHI]t2 t3 '
+        native_bytes = server.request_bytes
+
+        # 其他模型仍使用文本模式：工具写在系统提示里，请求不带 tools
+        text = "".join(agent.chat("again", "text"))
+        assert text == "t0 t1 t2 t3 "
+        assert "argSchema" in agent.llm.session[0].content
+        assert server.request_bytes - native_bytes > 0
+
+    tokens = agent.function_call.tool_prompt_tokens()
+    assert tokens["saved"] == tokens["text"] - tokens["native"] > 0
+
+
+def test_async_native_mode():
+    script = Script(reply_tokens=2, inject_at=1, tool_call='upper({"text": "ok"})')
+    with FakeOpenAIServer(scenarios={"native": script}) as server:
+        async def main():
+            agent = make_agent(server, AsyncOpenAILLM)
+            text = "".join([chunk async for chunk in agent.achat_default("hi")])
+            await agent.llm.aclose()
+            return text, agent
+        text, agent = asyncio.run(main())
+    assert text == 't0 [Function Call: upper({"text": "ok"}), Result: OK]t1 '
+    assert json.loads(json.dumps(agent.function_call.get_tool_specs()))[0]["function"]["name"] == "upper"
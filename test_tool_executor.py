@@ -0,0 +1,89 @@
+import time
+from pydantic import BaseModel
+from src.llm_proxy import BaseTool, FunctionCall, ToolExecutor
+
+
+class WeatherSchema(BaseModel):
+    city: str
+
+
+class SlowWeatherTool(BaseTool):
+    name = "weather"
+    description = "查询天气，耗时 0.2 秒"
+    argSchema = WeatherSchema
+
+    def _run(self, city: str) -> str:
+        time.sleep(0.2)
+        return f"{city}晴"
+
+
+class StreamingWeatherTool(SlowWeatherTool):
+    name = "weather_stream"
+
+    def _run(self, city: str):
+        time.sleep(0.2)
+        yield city
+        yield "晴"
+
+
+def response(tool_name: str, cities):
+    for city in cities:
+        yield f"{city}: <function_call>{tool_name}"
+        yield f'({{"city": "{city}"}})</function_call>\n'
+    yield "done"
+
+
+def run(tool: BaseTool, executor: ToolExecutor = None, cities=("北京", "上海", "广州")):
+    function_call = FunctionCall(executor=executor)
+    function_call.add_tool(tool)
+    start = time.perf_counter()
+    text = "".join(function_call.handle_stream(response(tool.name, cities)))
+    return text, time.perf_counter() - start
+
+
+def test_calls_run_concurrently_in_document_order():
+    sequential, sequential_time = run(SlowWeatherTool())
+    concurrent, concurrent_time = run(SlowWeatherTool(), ToolExecutor(max_workers=4))
+    assert concurrent == sequential
+    assert sequential_time >= 0.6
+    assert concurrent_time < 0.45
+
+    streamed, streamed_time = run(StreamingWeatherTool(), ToolExecutor(max_workers=4))
+    assert streamed == "北京: 北京晴\n上海: 上海晴\n广州: 广州晴\ndone"
+    assert streamed_time < 0.45
+
+
+def test_per_tool_concurrency_limit_and_timeout():
+    limited = SlowWeatherTool()
+    limited.max_concurrency = 1
+    _, elapsed = run(limited, ToolExecutor(max_workers=4))
+    assert elapsed >= 0.6
+
+    slow = SlowWeatherTool()
+    slow.timeout = 0.05
+    text, elapsed = run(slow, ToolExecutor(max_workers=4), cities=("北京",))
+    assert text == "北京: [Function Call Error: Tool 'weather' timed out after 0.05s]\ndone"
+    assert elapsed < 0.2
+
+
+def test_cancelled_queued_calls_never_run():
+    ran = []
+
+    def call(name: str):
+        def fn():
+            time.sleep(0.1)
+            ran.append(name)
+            return name
+        return fn
+
+    # 在线程池队列中等待
+    executor = ToolExecutor(max_workers=1)
+    first = executor.submit("t", call("first"))
+    queued = executor.submit("t", call("queued"))
+    queued.cancel()
+    # 在并发限制的队列中等待，取消后名额交给下一个调用
+    limited = [executor.submit("limited", call(f"limited{i}"), max_concurrency=1) for i in range(3)]
+    limited[1].cancel()
+    assert list(first) == ["first"] and list(limited[2]) == ["limited2"]
+    executor.shutdown()
+    assert ran == ["first", "limited0", "limited2"] and queued.done
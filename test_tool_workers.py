@@ -0,0 +1,163 @@
+import asyncio
+import os
+import time
+from typing import Generator
+from src.llm_proxy import BaseTool, BaseModel, FunctionCall, ProcessToolPool, ToolCache
+from src.llm_proxy.tool_workers import ThreadToolPool, ToolTimeoutError, ToolWorkerError
+
+
+class CountInput(BaseModel):
+    n: int
+    delay: float = 0.0
+
+
+class PidTool(BaseTool):
+    name: str = "pid"
+    description: str = "Return the worker pid"
+    argSchema: BaseModel = CountInput
+    execution: str = "process"
+
+    def _run(self, n: int, delay: float) -> str:
+        time.sleep(delay)
+        return f"{os.getpid()}:{n * 2}"
+
+
+class CountTool(BaseTool):
+    name: str = "count"
+    description: str = "Count up to n"
+    argSchema: BaseModel = CountInput
+    execution: str = "process"
+    timeout: float = 2.0
+
+    def _run(self, n: int, delay: float) -> Generator[str, None, None]:
+        for i in range(n):
+            time.sleep(delay)
+            yield f"{i} "
+        if n < 0:
+            raise ValueError("negative")
+
+
+class HangTool(BaseTool):
+    name: str = "hang"
+    description: str = "Never returns"
+    argSchema: BaseModel = CountInput
+    execution: str = "process"
+    timeout: float = 0.5
+
+    def _run(self, n: int, delay: float) -> str:
+        while True:
+            pass
+
+
+class FailTool(BaseTool):
+    name: str = "fail"
+    description: str = "Always fails"
+    argSchema: BaseModel = CountInput
+    execution: str = "thread"
+
+    def _run(self, n: int, delay: float) -> str:
+        raise RuntimeError(f"failed {n}")
+
+
+def test_process_pool_is_warm_and_validates_arguments():
+    pool = ProcessToolPool(max_workers=1)
+    try:
+        pool.warm()
+        first = pool.call(PidTool(), {"n": "21"})
+        second = pool.call(PidTool(), {"n": 1})
+        assert first.endswith(":42")
+        assert first.split(":")[0] == second.split(":")[0] != str(os.getpid())
+        assert pool.stats()["started"] == 1
+        try:
+            pool.call(PidTool(), {"n": "x"})
+            assert False
+        except ValueError:
+            pass
+    finally:
+        pool.close()
+
+
+def test_process_generator_streams_and_timeout_kills_worker():
+    pool = ProcessToolPool(max_workers=1)
+    try:
+        stream = pool.call(CountTool(), {"n": 3, "delay": 0.2})
+        start = time.perf_counter()
+        assert next(stream) == "0 "
+        # 第一块在整个生成器结束之前就已到达
+        assert time.perf_counter() - start < 0.5
+        assert list(stream) == ["1 ", "2 "]
+
+        start = time.perf_counter()
+        try:
+            pool.call(HangTool(), {"n": 1}, timeout=0.5)
+            assert False
+        except ToolTimeoutError as e:
+            assert "timed out after 0.5s" in str(e)
+        assert time.perf_counter() - start < 2
+        assert pool.stats()["killed"] == 1
+
+        # 被终止的进程由新进程替换
+        assert pool.call(PidTool(), {"n": 1}).endswith(":2")
+        assert pool.stats()["started"] == 2
+
+        # 读到一半关闭生成器，工作进程停止后回到池中
+        stream = pool.call(CountTool(), {"n": 100, "delay": 0.01})
+        next(stream)
+        stream.close()
+        assert pool.stats() == {"idle": 1, "started": 2, "killed": 1}
+        try:
+            pool.call(CountTool(), {"n": -1})
+            assert False
+        except ToolWorkerError as e:
+            assert str(e) == "negative"
+        assert pool.stats()["idle"] == 1
+    finally:
+        pool.close()
+
+
+def test_function_call_dispatches_by_execution_mode():
+    function_call = FunctionCall(cache=ToolCache())
+    for tool in (PidTool(), CountTool(), HangTool(), FailTool()):
+        function_call.add_tool(tool)
+    stream = iter([
+        'a <function_call>pid({"n": 2})</function_call>',
+        ' <function_call>count({"n": 2})</function_call>',
+        ' <function_call>hang({"n": 1})</function_call>',
+        ' <function_call>fail({"n": 3})</function_call>',
+    ])
+    out = "".join(function_call.handle_stream(stream))
+    assert f'Result: {os.getpid()}' not in out and ':4]' in out
+    assert "0 1 " in out
+    assert "[Function Call Error: Tool 'hang' timed out after 0.5s]" in out
+    assert "[Function Call Error: failed 3]" in out
+    # 进程模式的结果同样可以被缓存
+    again = "".join(function_call.handle_stream(iter(['<function_call>pid({"n": 2})</function_call>'])))
+    assert again.split("Result: ")[1] == out.split("Result: ")[1].split("]")[0] + "]"
+
+    async def main():
+        return "".join([c async for c in function_call.ahandle_stream(_aiter(['<function_call>count({"n": 3})</function_call>']))])
+    assert asyncio.run(main()) == "0 1 2 "
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+def test_thread_pool_timeout_does_not_block():
+    pool = ThreadToolPool(max_workers=2)
+    tool = PidTool()
+    start = time.perf_counter()
+    try:
+        pool.call(tool, {"n": 1, "delay": 1.0}, timeout=0.2)
+        assert False
+    except ToolTimeoutError:
+        pass
+    assert time.perf_counter() - start < 0.5
+    assert pool.call(tool, {"n": 1}) == f"{os.getpid()}:2"
+    try:
+        pool.call(FailTool(), {"n": 1})
+        assert False
+    except ToolWorkerError as e:
+        assert str(e) == "failed 1"
+    pool.close()